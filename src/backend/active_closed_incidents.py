@@ -1,17 +1,31 @@
-import sqlite3
+import numpy as np
 import pandas as pd
 import json
 from database_filter_variables import *
+from thresholds import SEVERITY_LEVELS, get_severity_thresholds, classify
 import eel
+from result_cache import cached_endpoint
+from database_connections import get_connection
+
+# Pandas period aliases of the supported coarser granularities, 'day' keeps the daily series
+GRANULARITY_PERIODS = {'week': 'W', 'month': 'M'}
+
+def day_numbers(timestamps):
+    """Converts a column of timestamp strings into float day numbers since 1970-01-01, NaN where missing."""
+    days = pd.to_datetime(timestamps, errors='coerce').to_numpy(dtype='datetime64[D]')
+    return np.where(np.isnat(days), np.nan, days.astype(np.int64).astype(float))
 
 @eel.expose
-def get_incidents_open_and_closed_over_time(db_path="../data/incidents.db"):
+@cached_endpoint
+def get_incidents_open_and_closed_over_time(db_path="../data/incidents.db", granularity="day"):
     """
     Queries the incident opened_at and closed_at from the database and processes it
     to return data for visualizing active and closed incidents over time along with severity levels.
 
     Args:
         db_path (str): Path to the SQLite database file.
+        granularity (str): 'day', 'week' or 'month'. Coarser series hold one entry per week or month, labeled
+                           with its first day and carrying the value of its last day.
 
     Returns:
         dict: A dictionary with the following structure:
@@ -49,7 +63,7 @@ def get_incidents_open_and_closed_over_time(db_path="../data/incidents.db"):
             }
 
     Interpretation:
-        - Each list contains daily time series data.
+        - Each list contains daily time series data, or weekly or monthly data for a coarser granularity.
         - 'opened_incidents': Number of incidents opened on each date (cumulative).
         - 'active_incidents': Number of incidents that are active (open but not yet closed) on each date.
         - 'closed_incidents': Cumulative number of incidents closed up to each date, with breakdown by severity.
@@ -59,7 +73,7 @@ def get_incidents_open_and_closed_over_time(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         
         # Query to get opened_at and closed_at for incidents
         query = f"""
@@ -76,138 +90,81 @@ def get_incidents_open_and_closed_over_time(db_path="../data/incidents.db"):
         
         # Execute the query and load the result into a DataFrame
         df = pd.read_sql_query(query, conn)
-        
-        # Ensure that 'opened_at' and 'closed_at' are datetime objects
-        df['opened_at'] = pd.to_datetime(df['opened_at']).dt.normalize()
-        df['closed_at'] = pd.to_datetime(df['closed_at'], errors='coerce').dt.normalize()  # Handle NaT values for open incidents
 
-        # Sort the data by opened_at date
-        df = df.sort_values('opened_at')
+        # Integer day numbers of opened_at and closed_at, NaT for open incidents
+        opened_days = day_numbers(df['opened_at'])
+        closed_days = day_numbers(df['closed_at'])
 
-        # Get selected incident IDs
-        selected_incident_ids = get_incident_ids_selection()
-        formatted_incident_ids = ', '.join(f"'{incident_id}'" for incident_id in selected_incident_ids)
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
 
-        # Get compliance metric and thresholds
-        # Get compliance metric and thresholds
+        # Get compliance metric and its compiled severity thresholds
         compliance_metric = get_filter_value("filters.compliance_metric")
-        # Try to get metric-specific thresholds first
-        compliance_metric_severity_levels2 = get_filter_value("filters.thresholds.compliance_metric_severity_levels2")
-        if compliance_metric_severity_levels2 and compliance_metric in compliance_metric_severity_levels2:
-            compliance_metric_thresholds = compliance_metric_severity_levels2[compliance_metric]
-        else:
-            compliance_metric_thresholds = get_filter_value("filters.thresholds.compliance_metric_severity_levels")
-
-        print("active_closed_incidents.py")
-        print(compliance_metric_thresholds)
+        compliance_metric_thresholds = get_severity_thresholds(compliance_metric)
 
         # Query to get compliance metric values for the selected incidents
         query_selected = f"""
         SELECT incident_id, closed_at, {compliance_metric}
         FROM incidents_fa_values_table
-        WHERE incident_id IN ({formatted_incident_ids})
+        JOIN incident_selection USING (incident_id)
         """
 
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query_selected += f" AND ( {whatif_clause} )"
-
         # Load the selected incidents' closed_at dates and compliance metric
         df_selected = pd.read_sql_query(query_selected, conn)
+        selected_closed_days = day_numbers(df_selected['closed_at'])
+        selected_closed = ~np.isnan(selected_closed_days)
+        if not selected_closed.any() or np.isnan(opened_days).all() or np.isnan(closed_days).all():
+            return {'opened_incidents': [], 'active_incidents': [], 'closed_incidents': [], 'closed_selected_incidents': []}
+
+        # Day offsets from the earliest opened_at up to the latest closed_at
+        first_day = np.nanmin(opened_days)
+        number_of_days = int(np.nanmax(closed_days) - first_day) + 1
+
+        def daily_counts(days):
+            offsets = days[~np.isnan(days)] - first_day
+            offsets = offsets[(offsets >= 0) & (offsets < number_of_days)].astype(np.int64)
+            return np.bincount(offsets, minlength=number_of_days)
+
+        # Cumulative opened and closed incidents per day, the active incidents are their difference
+        opened_per_day = np.cumsum(daily_counts(opened_days))
+        closed_per_day = np.cumsum(daily_counts(closed_days))
+        active_per_day = opened_per_day - closed_per_day
+
+        # Assign each selected incident to the first matching severity level in one vectorized step
+        metric_values = pd.to_numeric(df_selected[compliance_metric], errors='coerce').to_numpy(dtype=float)
+        severity = classify(metric_values, compliance_metric_thresholds)
+
+        # Cumulative closed selected incidents per day and severity level
+        severity_per_day = {
+            level: np.cumsum(daily_counts(np.where(severity == index, selected_closed_days, np.nan)))
+            for index, level in enumerate(SEVERITY_LEVELS)
+        }
 
-        # Ensure 'closed_at' are datetime objects for the selected incidents
-        df_selected['closed_at'] = pd.to_datetime(df_selected['closed_at'], errors='coerce').dt.normalize()
-        # Filter out NaT (null) values before calculating min and max dates
-        df_selected_filtered = df_selected.dropna(subset=['closed_at'])
-
-        # Get the min and max closed_at for the selected incidents
-        min_selected_date = df_selected_filtered['closed_at'].min()
-        max_selected_date = df_selected_filtered['closed_at'].max()
-
-        # Create a range of dates covering the period from the earliest opened_at to the latest closed_at
-        time_range = pd.date_range(start=df['opened_at'].min(), end=df['closed_at'].max(), freq='D')
-
-        # Initialize lists to hold the number of active and closed incidents over time
-        opened_incidents = []
-        active_incidents = []
-        closed_incidents = []
-        closed_selected_incidents = []
-        closed_low_severity = []
-        closed_moderate_severity = []
-        closed_high_severity = []
-        closed_critical_severity = []
-
-        # Initialize counters for active and closed incidents
-        current_active_count = 0
-        total_active_count = 0
-        current_closed_count = 0
-        previous_closed_count = 0
-        closed_low_severity_count = 0
-        closed_moderate_severity_count = 0
-        closed_high_severity_count = 0
-        closed_critical_severity_count = 0
-
-        # Helper function to check if a metric value falls within a given threshold range
-        def check_threshold(value, threshold):
-            conditions = threshold.split('AND')
-            for condition in conditions:
-                condition = condition.strip()
-                if not eval(f"{value} {condition}"):
-                    return False
-            return True
-
-        # Iterate through each time point in the time range
-        for time_point in time_range:
-            # Add incidents opened on the current time_point
-            current_active_count += df[df['opened_at'] == time_point].shape[0]
-            total_active_count += df[df['opened_at'] == time_point].shape[0]
-            
-            # Subtract incidents closed on the current time_point
-            closed_on_current = df[df['closed_at'] == time_point].shape[0]
-            current_active_count -= closed_on_current
-            current_closed_count += closed_on_current
-
-            if time_point < min_selected_date:
-                previous_closed_count = current_closed_count
-            
-            # Calculate closed incidents by severity levels
-            closed_at_current = df_selected_filtered[df_selected_filtered['closed_at'] == time_point]
-
-            # Evaluate each incident for its severity level based on the compliance metric value
-            for _, incident in closed_at_current.iterrows():
-                metric_value = incident[compliance_metric]
-
-                if check_threshold(metric_value, compliance_metric_thresholds['low']):
-                    closed_low_severity_count += 1
-                elif check_threshold(metric_value, compliance_metric_thresholds['moderate']):
-                    closed_moderate_severity_count += 1
-                elif check_threshold(metric_value, compliance_metric_thresholds['high']):
-                    closed_high_severity_count += 1
-                elif check_threshold(metric_value, compliance_metric_thresholds['critical']):
-                    closed_critical_severity_count += 1
-
-            # Append the counts to the lists
-            opened_incidents.append({'time': time_point.strftime('%Y-%m-%d'), 'count': total_active_count})
-            active_incidents.append({'time': time_point.strftime('%Y-%m-%d'), 'count': current_active_count})
-            closed_incidents.append({
-                'time': time_point.strftime('%Y-%m-%d'),
-                'count': current_closed_count,
-                'low': closed_low_severity_count,
-                'moderate': closed_moderate_severity_count,
-                'high': closed_high_severity_count,
-                'critical': closed_critical_severity_count
-            })
-
-        # Filter the active and closed incidents lists based on the selected min and max closed_at dates
-        opened_incidents = [entry for entry in opened_incidents if min_selected_date <= pd.to_datetime(entry['time']) <= max_selected_date]
-        active_incidents = [entry for entry in active_incidents if min_selected_date <= pd.to_datetime(entry['time']) <= max_selected_date]
-        closed_incidents = [entry for entry in closed_incidents if min_selected_date <= pd.to_datetime(entry['time']) <= max_selected_date]
-
+        # Restrict the series to the period of the selected incidents
+        start = int(np.nanmin(selected_closed_days) - first_day)
+        end = int(np.nanmax(selected_closed_days) - first_day) + 1
+        previous_closed_count = closed_per_day[start - 1] if start > 0 else 0
+        dates = pd.to_datetime(first_day + np.arange(start, end), unit='D')
+
+        # All series are cumulative or levels, so each period reports the value of its last day
+        series = pd.DataFrame({
+            'opened': opened_per_day[start:end],
+            'active': active_per_day[start:end],
+            'closed': closed_per_day[start:end] - previous_closed_count,
+            **{level: counts[start:end] for level, counts in severity_per_day.items()}
+        }, index=dates)
+        if granularity in GRANULARITY_PERIODS:
+            series = series.groupby(dates.to_period(GRANULARITY_PERIODS[granularity])).last()
+            series.index = series.index.start_time
+        times = series.index.strftime('%Y-%m-%d')
+
+        opened_incidents = [{'time': time, 'count': int(count)} for time, count in zip(times, series['opened'])]
+        active_incidents = [{'time': time, 'count': int(count)} for time, count in zip(times, series['active'])]
+        closed_incidents = [
+            {'time': time, 'count': int(row.closed), **{level: int(getattr(row, level)) for level in SEVERITY_LEVELS}}
+            for time, row in zip(times, series.itertuples())
+        ]
         closed_selected_incidents = closed_incidents
-        if closed_selected_incidents:
-            for incident in closed_selected_incidents:
-                incident['count'] -= previous_closed_count
 
         # Prepare the result to return
         result = {
@@ -223,10 +180,6 @@ def get_incidents_open_and_closed_over_time(db_path="../data/incidents.db"):
         print("active_closed_incidents.py")
         print(f"An error occurred: {e}")
         return {'active_incidents': [], 'closed_incidents': []}  # Return empty data on error
-    
-    finally:
-        # Close the database connection
-        conn.close()
 
 # Example usage
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import sqlite3
 import eel
 import json
 from database_filter_variables import *
+from database_connections import get_connection, write_transaction
 
 @eel.expose
 def insert_assessment_result(name, entry_type, incident_ids_list, control_id, status, db_path="../data/security_controls.db"):
@@ -28,41 +29,38 @@ def insert_assessment_result(name, entry_type, incident_ids_list, control_id, st
         if status not in valid_statuses:
             raise ValueError(f"Invalid status '{status}'. Valid statuses are: {valid_statuses}")
 
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        # Insert the result and update the control in one transaction of the writer, committed at the end of the block
+        with write_transaction(db_path) as conn:
+            cursor = conn.cursor()
 
-        # Insert the record into the assessment_results table
-        cursor.execute("""
-            INSERT INTO assessment_results (name, type, incident_ids_list) 
-            VALUES (?, ?, ?)
-        """, (name, entry_type, incident_ids_list))
+            # Insert the record into the assessment_results table
+            cursor.execute("""
+                INSERT INTO assessment_results (name, type, incident_ids_list) 
+                VALUES (?, ?, ?)
+            """, (name, entry_type, incident_ids_list))
 
-        # Fetch the ID of the newly inserted assessment result
-        assessment_result_id = cursor.lastrowid
+            # Fetch the ID of the newly inserted assessment result
+            assessment_result_id = cursor.lastrowid
 
-        # Fetch the current evidence value for the security control
-        cursor.execute("SELECT evidence FROM security_controls WHERE id = ?", (control_id,))
-        result = cursor.fetchone()
-        current_evidence = result[0] if result else ""
-
-        # Append the new assessment name to the current evidence, separating by ';' if necessary
-        if current_evidence:
-            updated_evidence = current_evidence + ";" + name
-        else:
-            updated_evidence = name
-
-        # Update the evidence and status fields in the security_controls table
-        cursor.execute("""
-            UPDATE security_controls 
-            SET evidence = ?, status = ? 
-            WHERE id = ?
-        """, (updated_evidence, status, control_id))
+            # Fetch the current evidence value for the security control
+            cursor.execute("SELECT evidence FROM security_controls WHERE id = ?", (control_id,))
+            result = cursor.fetchone()
+            current_evidence = result[0] if result else ""
+
+            # Append the new assessment name to the current evidence, separating by ';' if necessary
+            if current_evidence:
+                updated_evidence = current_evidence + ";" + name
+            else:
+                updated_evidence = name
+
+            # Update the evidence and status fields in the security_controls table
+            cursor.execute("""
+                UPDATE security_controls 
+                SET evidence = ?, status = ? 
+                WHERE id = ?
+            """, (updated_evidence, status, control_id))
+            cursor.close()
 
-        # Commit the transaction and close the connection
-        conn.commit()
-        cursor.close()
-        conn.close()
         print("add_assessment_result.py")
         print(f"Successfully inserted {entry_type} with name {name}, incident IDs: {incident_ids_list}, and updated status to '{status}'")
         return {"assessment_result_id": assessment_result_id, "control_id": control_id, "updated_evidence": updated_evidence}
@@ -84,17 +82,14 @@ def get_all_assessment_ids_and_names(db_path="../data/security_controls.db"):
     list: A list of dictionaries with 'id' and 'name' keys for each assessment result.
     """
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
 
         # Query to fetch all ids and names from the assessment_results table
         cursor.execute("SELECT id, name FROM assessment_results")
         results = cursor.fetchall()
 
-        # Close the cursor and connection
+        # Close the cursor
         cursor.close()
-        conn.close()
 
         # Extract the ids and names from the results
         assessment_list = [{"id": row[0], "name": row[1]} for row in results]
@@ -118,17 +113,14 @@ def get_all_assessment_details(db_path="../data/security_controls.db"):
     list: A list of dictionaries containing 'id', 'type', 'incident_ids_list', and 'name' for each assessment result.
     """
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
 
         # Query to fetch all records from the assessment_results table
         cursor.execute("SELECT id, type, incident_ids_list, name FROM assessment_results")
         results = cursor.fetchall()
 
-        # Close the cursor and connection
+        # Close the cursor
         cursor.close()
-        conn.close()
 
         # Convert the results to a list of dictionaries
         assessment_details = [
@@ -156,9 +148,7 @@ def apply_what_if_analysis_multiple(assessment_ids, db_path="../data/security_co
     str: Success message or error.
     """
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
 
         combined_incident_ids = set()  # Use a set to avoid duplicates
 
@@ -180,9 +170,8 @@ def apply_what_if_analysis_multiple(assessment_ids, db_path="../data/security_co
         combined_incident_ids_list = list(combined_incident_ids)
         set_filter_value("filters.whatIf_analysis", combined_incident_ids_list)
 
-        # Close the cursor and connection
+        # Close the cursor
         cursor.close()
-        conn.close()
 
         return f"Successfully applied what-if analysis for assessment IDs: {', '.join(map(str, assessment_ids))}"
 
@@ -204,38 +193,35 @@ def remove_assessment_result(assessment_id, db_path="../data/security_controls.d
     str: Success message or error.
     """
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch the name of the assessment result to be removed
-        cursor.execute("SELECT name FROM assessment_results WHERE id = ?", (assessment_id,))
-        result = cursor.fetchone()
-        if not result:
-            raise ValueError(f"No assessment result found with ID {assessment_id}")
-        assessment_name = result[0]
-
-        # Remove the assessment result from the assessment_results table
-        cursor.execute("DELETE FROM assessment_results WHERE id = ?", (assessment_id,))
-
-        # Update the evidence field in the security_controls table
-        cursor.execute("SELECT id, evidence FROM security_controls")
-        controls = cursor.fetchall()
-        for control_id, evidence in controls:
-            if evidence:
-                # Remove the assessment name from the evidence field
-                updated_evidence = ";".join(
-                    [e.strip() for e in evidence.split(";") if e.strip() != assessment_name]
-                )
-                cursor.execute(
-                    "UPDATE security_controls SET evidence = ? WHERE id = ?",
-                    (updated_evidence, control_id),
-                )
-
-        # Commit the transaction and close the connection
-        conn.commit()
-        cursor.close()
-        conn.close()
+        # Remove the result and its evidence references in one transaction of the writer
+        with write_transaction(db_path) as conn:
+            cursor = conn.cursor()
+
+            # Fetch the name of the assessment result to be removed
+            cursor.execute("SELECT name FROM assessment_results WHERE id = ?", (assessment_id,))
+            result = cursor.fetchone()
+            if not result:
+                raise ValueError(f"No assessment result found with ID {assessment_id}")
+            assessment_name = result[0]
+
+            # Remove the assessment result from the assessment_results table
+            cursor.execute("DELETE FROM assessment_results WHERE id = ?", (assessment_id,))
+
+            # Update the evidence field in the security_controls table
+            cursor.execute("SELECT id, evidence FROM security_controls")
+            controls = cursor.fetchall()
+            for control_id, evidence in controls:
+                if evidence:
+                    # Remove the assessment name from the evidence field
+                    updated_evidence = ";".join(
+                        [e.strip() for e in evidence.split(";") if e.strip() != assessment_name]
+                    )
+                    cursor.execute(
+                        "UPDATE security_controls SET evidence = ? WHERE id = ?",
+                        (updated_evidence, control_id),
+                    )
+
+            cursor.close()
 
         print("add_assessment_result.py")
         print(f"Successfully removed assessment result with ID {assessment_id}")
@@ -18,6 +18,7 @@ from api_keys import GEMINI_API_KEY
 import eel
 import sqlite3
 import json
+from database_connections import get_connection, write_transaction, SECURITY_CONTROLS_DATABASE
 
 def generate_ai_recommendation(control, update=None):
 
@@ -266,9 +267,7 @@ def generate_assessment_security_control(control_id, operator_response=None):
     Returns a dictionary with these fields, or None if not found.
     """
     try:
-        database = "../data/security_controls.db"
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+        cursor = get_connection(SECURITY_CONTROLS_DATABASE).cursor()
 
         sql_fetch_control = """
             SELECT title, description, operator_id, comments
@@ -298,9 +297,8 @@ def generate_assessment_security_control(control_id, operator_response=None):
             SET comments = ?
             WHERE id = ?
         """
-        cursor.execute(sql_update_comments, (recommendation, control_id))
-        conn.commit()
-        conn.close()
+        with write_transaction(SECURITY_CONTROLS_DATABASE) as conn:
+            conn.execute(sql_update_comments, (recommendation, control_id))
 
         return recommendation
 
@@ -317,17 +315,13 @@ def clear_comments_for_controls(start_id=148, end_id=154, db_path="../data/secur
     Returns a JSON string with number of rows updated: {"updated": n}.
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
         sql = """
         UPDATE security_controls
         SET comments = ''
         WHERE id >= ? AND id <= ?
         """
-        cursor.execute(sql, (start_id, end_id))
-        updated = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with write_transaction(db_path) as conn:
+            updated = conn.execute(sql, (start_id, end_id)).rowcount
         return json.dumps({"updated": updated})
     except sqlite3.Error as e:
         print("ai_recommendation.py")
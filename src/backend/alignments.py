@@ -0,0 +1,373 @@
+import json
+import heapq
+import hashlib
+import time
+import eel
+import numpy as np
+
+from database_filter_variables import get_filter_value
+from helper import copy_deviation_columns
+from incident_metrics import DEVIATION_KINDS
+from model_registry import get_compiled_model
+from quantile_sketches import refresh_quantile_sketches
+from database_connections import write_transaction
+
+# Added to the cost of every model and log move, so that among equally weighted alignments the one
+# with the fewest moves is found and zero weights in the cost function do not stall the search
+MOVE_EPSILON = 0.001
+
+# Maximum number of markings explored when computing the heuristic of one marking
+HEURISTIC_MARKING_LIMIT = 10000
+
+ALIGNMENT_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alignment_cache (
+    model_version TEXT NOT NULL,
+    cost_version TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    alignment TEXT,
+    missing TEXT,
+    repetition TEXT,
+    mismatch TEXT,
+    cost REAL,
+    fitness REAL,
+    PRIMARY KEY (model_version, cost_version, variant)
+) WITHOUT ROWID
+"""
+
+class MoveCosts:
+    """
+    Costs of the alignment moves per state, taken from a cost function such as filters.cost_function:
+    a model move of state X costs the missing weight of X, a log move of X costs the repetition weight
+    of X if it repeats the previous event and the mismatch weight of X otherwise. Each weight is scaled
+    by the cost of its deviation type. Synchronous moves are free.
+    """
+
+    def __init__(self, cost_function):
+        type_costs = cost_function.get("cost", {})
+        self.weights = {
+            kind: {state: float(weight) * float(type_costs.get(kind, 1)) for state, weight in cost_function.get(kind, {}).items()}
+            for kind in DEVIATION_KINDS
+        }
+
+    def move(self, kind, state):
+        return self.weights[kind].get(state, 1.0) + MOVE_EPSILON
+
+    def log_move(self, event, previous):
+        return self.move('repetition' if event == previous else 'mismatch', event)
+
+def cost_version(cost_function):
+    return hashlib.sha256(json.dumps(cost_function, sort_keys=True).encode()).hexdigest()
+
+class Aligner:
+    """
+    A* search of optimal alignments of trace variants on a ReferenceModel.
+
+    A search state is the marking of the net, the position in the trace and the previous log event, which
+    decides whether a log move is a repetition or a mismatch. The heuristic is the cost of the cheapest
+    model-only path to the final marking where transitions with a label still ahead in the trace are free,
+    plus the log moves of the remaining events which have no transition at all. It is cached per marking
+    and set of remaining labels, as most searches of a log revisit the same markings.
+    """
+
+    def __init__(self, model, move_costs):
+        self.model = model
+        self.move_costs = move_costs
+        self.heuristic_cache = {}
+        self.model_move_costs = [
+            move_costs.move('missing', label) if label is not None else MOVE_EPSILON for label in model.labels
+        ]
+
+    def is_final(self, marking):
+        if self.model.final_choice:
+            return marking.sum() == 1 and any(marking[place] == 1 for place in self.model.final_places)
+        final = np.zeros(len(marking), dtype=np.int64)
+        final[self.model.final_places] = 1
+        return np.array_equal(marking, final)
+
+    def enabled(self, marking):
+        return [transition for transition in range(len(self.model.labels)) if (self.model.pre[transition] <= marking).all()]
+
+    def fire(self, marking, transition):
+        return marking - self.model.pre[transition] + self.model.post[transition]
+
+    def heuristic(self, marking, remaining_labels):
+        key = (marking.tobytes(), remaining_labels)
+        if key in self.heuristic_cache:
+            return self.heuristic_cache[key]
+
+        # Dijkstra over the markings reachable with model moves, free for labels still ahead in the trace
+        best = 0.0
+        distances = {marking.tobytes(): 0.0}
+        queue = [(0.0, 0, marking)]
+        counter = 1
+        while queue:
+            distance, _, current = heapq.heappop(queue)
+            if distance > distances.get(current.tobytes(), np.inf):
+                continue
+            if self.is_final(current):
+                best = distance
+                break
+            if len(distances) > HEURISTIC_MARKING_LIMIT:
+                break
+            for transition in self.enabled(current):
+                label = self.model.labels[transition]
+                following = self.fire(current, transition)
+                step = 0.0 if label in remaining_labels else self.model_move_costs[transition]
+                if distance + step < distances.get(following.tobytes(), np.inf):
+                    distances[following.tobytes()] = distance + step
+                    heapq.heappush(queue, (distance + step, counter, following))
+                    counter += 1
+
+        self.heuristic_cache[key] = best
+        return best
+
+    def align(self, events):
+        """
+        Returns the optimal alignment of a trace variant.
+
+        Args:
+            events (list): State codes of the events in order.
+
+        Returns:
+            tuple: The moves as ('S'|'L'|'M', state) tuples and the total cost, or (None, inf) if the final
+                   marking cannot be reached.
+        """
+        labels = set(self.model.transitions_by_label)
+        unmodelled_costs = [0.0] * (len(events) + 1)
+        for position in range(len(events) - 1, -1, -1):
+            event = events[position]
+            unmodelled = 0.0
+            if event not in labels:
+                previous = events[position - 1] if position else None
+                unmodelled = self.move_costs.log_move(event, previous)
+            unmodelled_costs[position] = unmodelled_costs[position + 1] + unmodelled
+        remaining_labels = [frozenset(events[position:]) for position in range(len(events) + 1)]
+
+        def estimate(marking, position):
+            return self.heuristic(marking, remaining_labels[position]) + unmodelled_costs[position]
+
+        start = (self.model.initial.copy(), 0, None)
+        queue = [(estimate(start[0], 0), 0.0, 0, 0, start, None)]
+        costs = {(start[0].tobytes(), 0, None): 0.0}
+        parents = {}
+        counter = 1
+        while queue:
+            _, cost, _, _, (marking, position, previous), _ = heapq.heappop(queue)
+            key = (marking.tobytes(), position, previous)
+            if cost > costs.get(key, np.inf):
+                continue
+            if position == len(events) and self.is_final(marking):
+                moves = []
+                while key in parents:
+                    key, move = parents[key]
+                    if move is not None:
+                        moves.append(move)
+                return moves[::-1], cost
+
+            successors = []
+            if position < len(events):
+                event = events[position]
+                successors.append((marking, position + 1, event, self.move_costs.log_move(event, previous), ('L', event)))
+            for transition in self.enabled(marking):
+                label = self.model.labels[transition]
+                following = self.fire(marking, transition)
+                if position < len(events) and label == events[position]:
+                    successors.append((following, position + 1, label, 0.0, ('S', label)))
+                successors.append((following, position, previous, self.model_move_costs[transition], ('M', label) if label else None))
+
+            for following, next_position, next_previous, step, move in successors:
+                next_key = (following.tobytes(), next_position, next_previous)
+                if cost + step < costs.get(next_key, np.inf):
+                    costs[next_key] = cost + step
+                    parents[next_key] = (key, move)
+                    priority = cost + step + estimate(following, next_position)
+                    heapq.heappush(queue, (priority, cost + step, -next_position, counter, (following, next_position, next_previous), move))
+                    counter += 1
+
+        return None, np.inf
+
+def alignment_deviations(moves, states):
+    """
+    Counts the deviations of an alignment per state: model moves are missing, log moves repeating the
+    previous log event are repetitions and other log moves are mismatches.
+    """
+    deviations = {kind: dict.fromkeys(states, 0) for kind in DEVIATION_KINDS}
+    previous = None
+    for move_type, state in moves:
+        if move_type == 'M':
+            kind = 'missing'
+        elif move_type == 'L':
+            kind = 'repetition' if state == previous else 'mismatch'
+        else:
+            kind = None
+        if kind and state in deviations[kind]:
+            deviations[kind][state] += 1
+        if move_type in ('S', 'L'):
+            previous = state
+    return deviations
+
+def format_alignment(moves):
+    """Formats moves in the alignment notation of IM_log.csv, e.g. '[S]N;[M]A;[S]R;[L]R;[S]C;'."""
+    return ''.join(f"[{move_type}]{state};" for move_type, state in moves)
+
+def align_variant(aligner, variant, model_only_cost):
+    """
+    Aligns one variant and derives its deviation counts, cost and fitness. The fitness relates the cost
+    to the worst alignment of the variant: all events as log moves after a model-only run of the net.
+
+    Returns:
+        dict: alignment, missing, repetition and mismatch in the notation of incident_alignment_table,
+              cost and fitness, or None if the final marking cannot be reached.
+    """
+    events = variant.split()
+    moves, cost = aligner.align(events)
+    if moves is None:
+        return None
+    deviations = alignment_deviations(moves, aligner.model.states)
+    worst_cost = model_only_cost + sum(
+        aligner.move_costs.log_move(event, events[position - 1] if position else None)
+        for position, event in enumerate(events)
+    )
+    return {
+        'alignment': format_alignment(moves),
+        'missing': str(deviations['missing']),
+        'repetition': str(deviations['repetition']),
+        'mismatch': str(deviations['mismatch']),
+        'cost': round(cost, 3),
+        'fitness': round(1 - cost / worst_cost if worst_cost else 1.0, 3),
+    }
+
+@eel.expose
+def align_event_log(db_path="../data/incidents.db", pnml_path="../data/reference_model.pnml", mapping_path="../data/mapping.txt",
+                    parallel=False, max_workers=None):
+    """
+    Computes optimal alignments of all variants on the reference model with the move costs of
+    filters.cost_function and writes them to incident_alignment_table, together with the missing,
+    repetition and mismatch counts per state, the alignment cost and the fitness. The deviation columns
+    and fitness of incidents_fa_values_table are updated from them.
+
+    Each distinct variant is aligned once. Results are cached in the alignment_cache table per model
+    version, cost function and variant, so a rerun only aligns variants which were not aligned before.
+    With parallel set, the variants are aligned in a process pool and cached chunk by chunk.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        pnml_path (str): Path to the PNML reference model.
+        mapping_path (str): Path to the mapping of place names to state codes.
+        parallel (bool): Align the variants in a process pool (parallel_conformance).
+        max_workers (int, optional): Number of worker processes, the number of CPUs by default.
+
+    Returns:
+        dict: The number of aligned, cached and unaligned variants and of updated incidents, or {'error': <error_message>}.
+              Incidents of unaligned variants, whose final marking cannot be reached, get no fitness and deviations.
+    """
+    started = time.perf_counter()
+    try:
+        cost_function = get_filter_value("filters.cost_function")
+        compiled_model = get_compiled_model(pnml_path, mapping_path)
+        model = compiled_model.reference_model
+        model_version = compiled_model.version
+        costs_version = cost_version(cost_function)
+
+        with write_transaction(db_path) as conn:
+            conn.execute(ALIGNMENT_CACHE_SCHEMA)
+            variants = [row[0] for row in conn.execute(
+                "SELECT DISTINCT variant FROM incidents_fa_values_table WHERE variant IS NOT NULL"
+            )]
+            cached = {row[0] for row in conn.execute(
+                "SELECT variant FROM alignment_cache WHERE model_version = ? AND cost_version = ?",
+                (model_version, costs_version)
+            )}
+
+        pending = [variant for variant in variants if variant not in cached]
+        aligned_count = 0
+        unaligned_variants = []
+
+        # The alignment cache is committed chunk by chunk, each chunk in its own transaction
+        def cache_alignments(results):
+            nonlocal aligned_count
+            rows = [
+                (model_version, costs_version, variant, result['alignment'], result['missing'], result['repetition'],
+                 result['mismatch'], result['cost'], result['fitness'])
+                for variant, result in results if result is not None
+            ]
+            with write_transaction(db_path) as conn:
+                conn.executemany("INSERT OR REPLACE INTO alignment_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            aligned_count += len(rows)
+            unaligned_variants.extend(variant for variant, result in results if result is None)
+
+        if parallel:
+            # Imported here as parallel_conformance builds on this module
+            from parallel_conformance import run_conformance
+            run_conformance('alignment', model, cost_function, pending, cache_alignments, max_workers)
+        else:
+            aligner = Aligner(model, MoveCosts(cost_function))
+            model_only_cost = aligner.align([])[1]
+            cache_alignments([(variant, align_variant(aligner, variant, model_only_cost)) for variant in pending])
+
+        # Write the cached alignments of the variants to their incidents in one transaction
+        with write_transaction(db_path) as conn:
+            conn.execute("""
+                CREATE TEMP VIEW IF NOT EXISTS aligned_incidents AS
+                SELECT f.incident_id, c.model_version, c.cost_version, c.alignment, c.missing, c.repetition,
+                       c.mismatch, c.cost, c.fitness
+                FROM incidents_fa_values_table AS f
+                JOIN alignment_cache AS c ON c.variant = f.variant
+            """)
+            scope = "model_version = ? AND cost_version = ?"
+            conn.execute(f"""
+                UPDATE incident_alignment_table
+                SET alignment = a.alignment, missing = a.missing, repetition = a.repetition,
+                    mismatch = a.mismatch, fitness = a.fitness, costTotal = a.cost
+                FROM (SELECT * FROM temp.aligned_incidents WHERE {scope}) AS a
+                WHERE incident_alignment_table.incident_id = a.incident_id
+            """, (model_version, costs_version))
+            conn.execute(f"""
+                INSERT INTO incident_alignment_table (incident_id, alignment, missing, repetition, mismatch, fitness, costTotal)
+                SELECT incident_id, alignment, missing, repetition, mismatch, fitness, cost
+                FROM temp.aligned_incidents
+                WHERE {scope}
+                  AND NOT EXISTS (SELECT 1 FROM incident_alignment_table AS t WHERE t.incident_id = aligned_incidents.incident_id)
+            """, (model_version, costs_version))
+            # Incidents of variants without an alignment on this model keep no values of a previous model
+            conn.execute(f"""
+                UPDATE incident_alignment_table
+                SET alignment = NULL, missing = NULL, repetition = NULL, mismatch = NULL, fitness = NULL, costTotal = NULL
+                WHERE incident_id IN (
+                    SELECT f.incident_id FROM incidents_fa_values_table AS f
+                    WHERE f.variant IS NULL OR NOT EXISTS (
+                        SELECT 1 FROM alignment_cache AS c WHERE c.variant = f.variant AND {scope}
+                    )
+                )
+            """, (model_version, costs_version))
+            cursor = conn.execute("""
+                UPDATE incidents_fa_values_table
+                SET fitness = a.fitness
+                FROM incident_alignment_table AS a
+                WHERE a.incident_id = incidents_fa_values_table.incident_id
+            """)
+            updated_count = cursor.rowcount
+            refresh_quantile_sketches(conn)
+
+        # Copy the deviation counts into incidents_fa_values_table and incident_metrics
+        copy_deviation_columns(db_path)
+
+        print("alignments.py")
+        print(f"Aligned {aligned_count} variants ({len(variants) - len(pending)} cached) for {updated_count} incidents in {time.perf_counter() - started:.2f}s.")
+        if unaligned_variants:
+            print(f"{len(unaligned_variants)} variants cannot reach the final marking, the fitness and deviations of their incidents were cleared.")
+        return {
+            "aligned_variants": aligned_count,
+            "cached_variants": len(variants) - len(pending),
+            "unaligned_variants": len(unaligned_variants),
+            "updated_incidents": updated_count
+        }
+
+    except Exception as e:
+        print("alignments.py")
+        print(f"An error occurred: {e}")
+        return {'error': str(e)}
+
+# Run the alignment
+if __name__ == "__main__":
+    print(align_event_log())
@@ -2,8 +2,12 @@ import sqlite3
 import eel
 
 from database_filter_variables import *
+from result_cache import cached_endpoint
+from database_connections import get_connection
+from quantile_sketches import selection_quantiles, quantile_label, DEFAULT_QUANTILES
 
 @eel.expose
+@cached_endpoint
 def calculate_column_average(column_name, db_path="../data/incidents.db", table_name="incidents_fa_values_table"):
     """
     Calculates the average value of a specified column in a given SQLite database table,
@@ -36,13 +40,13 @@ def calculate_column_average(column_name, db_path="../data/incidents.db", table_
         if not incident_ids:
             return 0.000
 
-        # Format incident IDs for SQL query
-        formatted_incident_ids = ', '.join(f"'{incident_id}'" for incident_id in incident_ids)
-
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
         # Check if the specified column exists in the table
         cursor.execute(f"PRAGMA table_info({table_name})")
         columns = [info[1] for info in cursor.fetchall()]
@@ -54,20 +58,14 @@ def calculate_column_average(column_name, db_path="../data/incidents.db", table_
         query = f"""
         SELECT AVG({column_name}) 
         FROM {table_name}
-        WHERE incident_id IN ({formatted_incident_ids})
+        JOIN incident_selection USING (incident_id)
         """
 
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
         cursor.execute(query)
         average_value = cursor.fetchone()[0]
 
-        # Close the connection
+        # Close the cursor
         cursor.close()
-        conn.close()
 
         return average_value
 
@@ -80,6 +78,42 @@ def calculate_column_average(column_name, db_path="../data/incidents.db", table_
         print(f"An error occurred: {e}")
         return None
 
+@eel.expose
+@cached_endpoint
+def calculate_column_quantiles(column_name, quantiles=DEFAULT_QUANTILES, db_path="../data/incidents.db"):
+    """
+    Calculates quantiles (e.g. the median, p90 and p99) of a compliance metric over the incidents specified by
+    the `get_incident_ids_selection()` function. For a selected time period they are merged from the daily
+    quantile sketches and are within 1% of the exact values, for any other selection they are read from the
+    selected incidents.
+
+    Args:
+        column_name (str): The compliance metric, 'fitness' or 'cost'.
+        quantiles (list): Quantiles between 0 and 1, [0.5, 0.9, 0.99] by default.
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        dict: {'p50': value, ...} and 'source' ('sketch' or 'exact'), the quantiles are None if no incident
+              is selected. None if the metric has no quantiles or any error occurs.
+    """
+    try:
+        conn = get_connection(db_path)
+
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
+        values, source = selection_quantiles(conn, column_name, quantiles, get_sketch_day_range())
+        return {**values.get('', dict.fromkeys(quantile_label(float(quantile)) for quantile in quantiles)), 'source': source}
+
+    except sqlite3.Error as e:
+        print("calculate_averages_db.py")
+        print(f"An error occurred with the database: {e}")
+        return None
+    except Exception as e:
+        print("calculate_averages_db.py")
+        print(f"An error occurred: {e}")
+        return None
+
 # Example usage
 if __name__ == "__main__":
     column_name = "cost"  # Replace with the desired column name
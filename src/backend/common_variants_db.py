@@ -1,8 +1,10 @@
 import pandas as pd
 import sqlite3
-from collections import Counter
 import eel
 from database_filter_variables import *
+from helper import create_incident_indexes, incident_scope
+from result_cache import cached_endpoint
+from database_connections import get_connection
 
 def process_alignment(alignment):
     """Extracts relevant events and creates a variant."""
@@ -14,22 +16,16 @@ def process_alignment(alignment):
         print(f"Failed processing alignment {alignment}: {e}")
         return ""
 
-def analyze_alignments(df):
-    """Analyzes alignments in a DataFrame and returns sorted variants."""
-    try:
-        df['processed'] = df['alignment'].apply(process_alignment)
-        variant_counts = Counter(df['processed'])
-        return sorted(variant_counts.items(), key=lambda x: x[1], reverse=True)
-    except Exception as e:
-        print("common_variants_db.py")
-        print(f"Error during analysis: {e}")
-        return []
-
 @eel.expose
-def get_sorted_variants_from_db():
+@cached_endpoint
+def get_sorted_variants_from_db(top_k=None):
     """
-    Queries the incident_alignment_table in the SQLite database for alignments of selected incidents,
-    processes the alignment data to extract process variants, and returns a sorted list of variants by frequency.
+    Counts the process variants of the selected incidents by grouping their variant ids and returns
+    a sorted list of variants by frequency.
+
+    Args:
+        top_k (int, optional): Returns only the top_k most frequent variants, followed by a ("remaining", frequency)
+                               entry with the total frequency of all other variants. All variants if None.
 
     Returns:
         list of tuples: Each tuple is (variant, frequency), sorted from most frequent to least frequent.
@@ -42,9 +38,10 @@ def get_sorted_variants_from_db():
             ]
 
     Interpretation:
-        - Each variant is a string representing the sequence of process states (e.g., "N R C") as extracted from the alignment data.
+        - Each variant is a string representing the sequence of process states (e.g., "N R C") as recorded for the incident.
         - The frequency is the number of incidents in which that variant occurred.
         - The list is sorted in descending order by frequency, so the most common variants appear first.
+        - With top_k, the last entry ("remaining", frequency) sums up the incidents of all less frequent variants.
         - Only incidents selected by get_incident_ids_selection() and filtered by what-if analysis are included.
         - If no incidents are found, the function returns an empty list.
 
@@ -55,56 +52,62 @@ def get_sorted_variants_from_db():
     """
     try:
         db_path = "../data/incidents.db"
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
 
-        # Format the incident IDs for SQL query
-        formatted_incident_ids = ', '.join(f"'{incident_id}'" for incident_id in get_incident_ids_selection())
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
 
-        # Build the base SQL query to select the desired columns
-        query = f"""
-        SELECT alignment
-        FROM incident_alignment_table
-        WHERE incident_id IN ({formatted_incident_ids})
+        # Count the incidents per variant id and bucket all variants ranked below top_k as 'remaining'
+        query = """
+        WITH variant_counts AS (
+            SELECT f.variant_id, COUNT(*) AS frequency, MIN(f.incident_id) AS first_incident
+            FROM incidents_fa_values_table AS f
+            JOIN incident_selection USING (incident_id)
+            WHERE f.variant_id IS NOT NULL
+            GROUP BY f.variant_id
+        ),
+        ranked AS (
+            SELECT v.sequence, c.frequency,
+                   ROW_NUMBER() OVER (ORDER BY c.frequency DESC, c.first_incident) AS rank
+            FROM variant_counts AS c
+            JOIN variants AS v USING (variant_id)
+        )
+        SELECT CASE WHEN ? IS NULL OR rank <= ? THEN sequence ELSE 'remaining' END AS variant,
+               SUM(frequency) AS frequency
+        FROM ranked
+        GROUP BY 1
+        ORDER BY MIN(rank)
         """
-
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return analyze_alignments(df)
+        return conn.execute(query, (top_k, top_k)).fetchall()
     except Exception as e:
         print("common_variants_db.py")
         print(f"An error occurred while querying the database: {e}")
         return []
     
-def update_variants_in_db():
+def update_variants_in_db(db_path="../data/incidents.db", incident_ids=None):
     """
     Queries all incident IDs and their alignments from the incident_alignment_table, processes the alignment data
     to calculate the variant for each incident ID, and updates the variant column in the incidents_fa_values_table
-    with the calculated variant.
+    with the calculated variant. If incident_ids is given, only these incidents are updated.
     """
     try:
-        db_path = "../data/incidents.db"
         conn = sqlite3.connect(db_path)
+        create_incident_indexes(conn)
 
         # Query all incident_id and alignment data from incident_alignment_table
-        query = "SELECT incident_id, alignment FROM incident_alignment_table"
+        query = f"SELECT incident_id, alignment FROM incident_alignment_table WHERE {incident_scope(conn, incident_ids)}"
         df = pd.read_sql(query, conn)
 
         # Process each alignment to calculate the variant
         df['variant'] = df['alignment'].apply(process_alignment)
 
-        # Update the variant in the incidents_fa_values_table
-        for _, row in df.iterrows():
-            update_query = """
-            UPDATE incidents_fa_values_table
-            SET variant = ?
-            WHERE incident_id = ?
-            """
-            conn.execute(update_query, (row['variant'], row['incident_id']))
+        # Update the variant in the incidents_fa_values_table with one prepared statement
+        update_query = """
+        UPDATE incidents_fa_values_table
+        SET variant = ?
+        WHERE incident_id = ?
+        """
+        conn.executemany(update_query, zip(df['variant'], df['incident_id']))
 
         # Commit changes and close the connection
         conn.commit()
@@ -1,249 +1,295 @@
 import sqlite3
+import numpy as np
 import pandas as pd
 import json
 import eel
 from database_filter_variables import *
+from incident_metrics import get_incident_metrics_generation
+from quantile_sketches import refresh_quantile_sketches
+from result_cache import cached_endpoint
+from database_connections import get_connection, write_transaction
 
-# Function to count deviations from JSON-like strings
-def count_deviations(deviation_str):
-    """
-    Converts the JSON-like string to a dictionary and returns the deviation counts per state.
+# Deviation types along the last axis of the deviation tensor
+DEVIATION_TYPES = ['missing', 'repetition', 'mismatch']
+
+def load_deviation_tensor(conn, incident_ids, states):
     """
-    if deviation_str:
-        # Convert single quotes to double for JSON compatibility
-        deviation_dict = json.loads(deviation_str.replace("'", '"'))  
-        return deviation_dict
-    return {}
+    Loads the typed deviation counts of incident_metrics into an (incidents x states x deviation types) tensor.
 
-@eel.expose
-def get_compliance_per_state_per_incident(db_path="../data/incidents.db"):
+    Args:
+        conn (sqlite3.Connection): Open connection to the incidents database.
+        incident_ids (pandas.Series): Incident IDs in the order of the first axis.
+        states (list): State codes in the order of the second axis.
+
+    Returns:
+        numpy.ndarray: Integer deviation counts, 0 where an incident has no value.
     """
-    Retrieves the compliance per state for all incidents within the specified date range, 
-    aggregating missing, repetition, and mismatch deviations.
+    deviations = np.zeros((len(incident_ids), len(states), len(DEVIATION_TYPES)), dtype=np.int64)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS tensor_incidents (incident_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.tensor_incidents")
+    conn.executemany("INSERT OR IGNORE INTO temp.tensor_incidents VALUES (?)", ((incident_id,) for incident_id in incident_ids))
+    rows = pd.read_sql_query(f"""
+        SELECT incident_id, kind, state, CAST(value AS INTEGER) AS value
+        FROM incident_metrics
+        JOIN temp.tensor_incidents USING (incident_id)
+        WHERE kind IN ({', '.join('?' for _ in DEVIATION_TYPES)})
+    """, conn, params=DEVIATION_TYPES)
+
+    incident_index = pd.Index(incident_ids).get_indexer(rows['incident_id'])
+    state_index = pd.Index(states).get_indexer(rows['state'])
+    type_index = pd.Index(DEVIATION_TYPES).get_indexer(rows['kind'])
+    known = (incident_index >= 0) & (state_index >= 0)
+    deviations[incident_index[known], state_index[known], type_index[known]] = rows['value'].to_numpy()[known]
+    return deviations
+
+def calculate_compliance_per_state(deviations, fitness):
+    """
+    Calculates the fitness share of every state for all incidents at once.
+
+    Each state scores 1/5 * (1 - (deviations of the state / deviations of the incident)), or 1/5 without deviations.
+    The scores are normalized to sum up to 1 per incident and weighted by the fitness of the incident.
 
     Args:
-        db_path (str): Path to the SQLite database file.
+        deviations (numpy.ndarray): (incidents x states x deviation types) deviation counts.
+        fitness (numpy.ndarray): Fitness of each incident.
 
     Returns:
-        str: A JSON string containing compliance per state for each incident within the date range.
+        numpy.ndarray: (incidents x states) compliance scores.
     """
-    try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-
-        # Get filters from the global filter variables
-        filters = get_filter_value()
-        date_range = filters.get('filters', {}).get('overview_metrics', {}).get('date_range', {})
-        
-        if not date_range.get('min_date') or not date_range.get('max_date'):
-            return json.dumps({'error': 'Date range not specified'})
-
-        # Extract min and max dates from the filters
-        min_date = date_range['min_date']
-        max_date = date_range['max_date']
-
-        # Build the base query to fetch incidents within the date range
-        query = """
-            SELECT 
-                incident_id,
-                fitness,
-                cost,
-                variant,
-                missing_deviation,
-                repetition_deviation,
-                mismatch_deviation,
-                closed_at
-            FROM incidents_fa_values_table 
-            WHERE closed_at BETWEEN ? AND ?
-        """
-
-        # Add the 'whatif_analysis' exclusion clause if applicable
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
-        # Add the ORDER BY clause at the end
-        query += " ORDER BY closed_at ASC"
-                
-        # Load data into a DataFrame
-        df = pd.read_sql_query(query, conn, params=(min_date, max_date))
-
-        if df.empty:
-            return json.dumps({'error': 'No incidents found within the specified date range'})
-
-        # Initialize a list to hold the results for each incident
-        results = []
-
-        # Iterate through each incident to calculate compliance per state
-        for _, row in df.iterrows():
-            # Initialize a dictionary to hold the aggregated deviations per state for the current incident
-            total_deviations_per_state = {}
-
-            # Store the fitness value
-            fitness = round(row['fitness'], 2)  # Round fitness to 2 decimal places
-            cost = round(row['cost'], 2)
-
-            # Aggregate deviations from missing, repetition, and mismatch deviations
-            missing_deviations = count_deviations(row['missing_deviation'])
-            repetition_deviations = count_deviations(row['repetition_deviation'])
-            mismatch_deviations = count_deviations(row['mismatch_deviation'])
-
-            total_deviations_per_type_per_state = {"missing": missing_deviations, "repetition": repetition_deviations, "mismatch": mismatch_deviations}
-
-            # Sum up all deviations per state
-            for state, count in missing_deviations.items():
-                total_deviations_per_state[state] = total_deviations_per_state.get(state, 0) + count
-
-            for state, count in repetition_deviations.items():
-                total_deviations_per_state[state] = total_deviations_per_state.get(state, 0) + count
-
-            for state, count in mismatch_deviations.items():
-                total_deviations_per_state[state] = total_deviations_per_state.get(state, 0) + count
-
-            # Calculate the total number of deviations across all states
-            total_deviations = sum(total_deviations_per_state.values())
-
-            # Calculate the total number of events from the variant column
-            variant = row['variant']
-            # Count the total events without separating between states
-            total_events = len(variant.split())
-
-            if row['incident_id'] == "INC0030204":
-                print("Total events:")
-                print(total_events)
-
-            compliance_metric = get_filter_value("filters.compliance_metric")
-            # Calculate compliance per state
-            if (compliance_metric == "fitness"):
-                compliance_per_state = calculate_compliance_per_state(total_deviations_per_state, total_deviations)
-                for state in compliance_per_state:    
-                    compliance_per_state[state] *=  fitness
-            else:
-                compliance_per_state = calculate_cost_per_state(total_deviations_per_type_per_state, total_events, get_filter_value("filters.cost_function"))
-
-
-            # Prepare the result dictionary for the current incident
-            incident_result = {
-                'incident_id': row['incident_id'],
-                'fitness': fitness,
-                'cost': cost,
-                'closed_at': row['closed_at'],
-                'total_deviations_per_state': {state: round(count, 2) for state, count in total_deviations_per_state.items()},
-                'total_deviations': round(total_deviations, 2),
-                'compliance_per_state': {state: round(score, 2) for state, score in compliance_per_state.items()}
-            }
+    deviations_per_state = deviations.sum(axis=2)
+    total_deviations = deviations_per_state.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(total_deviations != 0, 0.2 * (1 - deviations_per_state / total_deviations), 0.2)
+        # Summed state by state, in the same order as a per-incident loop would
+        total_compliance = np.zeros(total_deviations.shape)
+        for state_scores in scores.T:
+            total_compliance[:, 0] += state_scores
+        normalization_factor = np.where(total_compliance != 0, 1 / total_compliance, 0)
+    return scores * normalization_factor * fitness[:, None]
+
+def cost_function_weights(cost_function, states):
+    """
+    Returns the cost function as a (states x deviation types) weight matrix and a vector with the weight of each
+    deviation type.
+    """
+    state_weights = np.array([[cost_function[deviation_type][state] for deviation_type in DEVIATION_TYPES] for state in states], dtype=float)
+    type_weights = np.array([cost_function["cost"][deviation_type] for deviation_type in DEVIATION_TYPES], dtype=float)
+    return state_weights, type_weights
 
-            if incident_result['incident_id'] == "INC0030204":
-                print(incident_result)
+def calculate_cost_per_state(deviations, total_events, cost_function, states):
+    """
+    Calculates the non-compliance cost per state for all incidents at once.
 
-            # Append the result for the current incident to the results list
-            results.append(incident_result)
+    Each deviation count is multiplied by the weight of its state and type. A weighted count above 1 contributes
+    the full weight of the deviation type, otherwise it contributes its weighted share. Repetition and mismatch
+    shares are normalized by the number of events of the incident. Incidents without events (e.g. without a
+    variant) have no trace to price and cost 0 in every state.
 
-        return json.dumps(results)
+    Args:
+        deviations (numpy.ndarray): (incidents x states x deviation types) deviation counts.
+        total_events (numpy.ndarray): Number of events of each incident.
+        cost_function (dict): Cost weights for each deviation type and state.
+        states (list): State codes in the order of the second tensor axis.
 
-    except Exception as e:
-        print("compliance_metric_per_state.py")
-        print(f"An error occurred: {e}")
-        return json.dumps({'error': str(e)})
+    Returns:
+        numpy.ndarray: (incidents x states) non-compliance costs.
+    """
+    state_weights, type_weights = cost_function_weights(cost_function, states)
+    weighted = deviations * state_weights
 
-    finally:
-        # Close the database connection
-        if conn:
-            conn.close()
+    # Missing deviations are not normalized by the number of events
+    total_events = np.asarray(total_events, dtype=float)
+    has_events = total_events > 0
+    divisor = np.ones(weighted.shape[:1] + (1, len(DEVIATION_TYPES)))
+    divisor[:, 0, 1:] = np.where(has_events, total_events, 1)[:, None]
 
-def calculate_compliance_per_state(deviations_per_state, total_deviations):
+    cost = np.where(weighted > 1, 1, weighted / divisor) * type_weights
+
+    # Summed type by type, in the same order as a per-incident loop would
+    cost_per_state = np.zeros(cost.shape[:2])
+    for type_index in range(len(DEVIATION_TYPES)):
+        cost_per_state += cost[:, :, type_index]
+    cost_per_state[~has_events] = 0
+    return cost_per_state
+
+class DeviationProfiles:
+    """
+    Incidents deduplicated into their unique (deviation tensor, number of events) profiles. The cost of an
+    incident only depends on its profile, so a cost function is evaluated once per profile and broadcast back.
     """
-    Calculates the compliance score per state based on the total deviations.
 
-    Args:
-        deviations_per_state (dict): Dictionary with the total deviations per state.
-        total_deviations (int): Total number of deviations across all states.
+    def __init__(self, incident_ids, deviations, total_events):
+        self.incident_index = pd.Index(incident_ids)
+        self.shape = deviations.shape[1:]
+        flat_profiles = np.concatenate([deviations.reshape(len(deviations), -1), total_events[:, None]], axis=1)
+        unique_profiles, inverse = np.unique(flat_profiles, axis=0, return_inverse=True)
+        self.deviations = unique_profiles[:, :-1].reshape((len(unique_profiles),) + self.shape)
+        self.total_events = unique_profiles[:, -1]
+        self.inverse = inverse.ravel()
+
+    def rows(self, incident_ids):
+        """Returns the profile index of each incident, -1 for incidents without a profile."""
+        positions = self.incident_index.get_indexer(incident_ids)
+        return np.where(positions >= 0, self.inverse[positions], -1)
+
+    def cost_per_state(self, cost_function, states):
+        """Returns the (profiles x states) non-compliance costs of a cost function."""
+        return calculate_cost_per_state(self.deviations, self.total_events, cost_function, states)
+
+    def __repr__(self):
+        return f"DeviationProfiles({len(self.incident_index)} incidents, {len(self.deviations)} profiles)"
+
+# Deviation profiles per database file and state order, loaded at the current incident_metrics generation.
+# All of them are dropped whenever incident_metrics is rebuilt by this process.
+deviation_profiles_cache = {}
+deviation_profiles_generation = None
+
+def get_deviation_profiles(conn, states):
+    """
+    Returns the DeviationProfiles of all incidents of the database, reloaded once incident_metrics is rebuilt.
+    Writes which leave incident_metrics untouched keep the profiles; incidents added by another process are
+    picked up by load_incident_profiles.
+    """
+    global deviation_profiles_generation
+    if deviation_profiles_generation != get_incident_metrics_generation():
+        deviation_profiles_cache.clear()
+        deviation_profiles_generation = get_incident_metrics_generation()
+
+    database_file = getattr(conn, 'db_path', None) or conn.execute("PRAGMA database_list").fetchone()[2]
+    key = (database_file, tuple(states))
+    profiles = deviation_profiles_cache.get(key)
+    if profiles is None:
+        incidents = pd.read_sql_query("SELECT incident_id, variant FROM incidents_fa_values_table", conn)
+        deviations = load_deviation_tensor(conn, incidents['incident_id'], states)
+        # Count the total events without separating between states
+        total_events = incidents['variant'].fillna('').str.split().str.len().to_numpy(dtype=np.int64)
+        profiles = deviation_profiles_cache[key] = DeviationProfiles(incidents['incident_id'], deviations, total_events)
+    return profiles
+
+def load_incident_profiles(conn, incident_ids, states):
+    """
+    Returns the DeviationProfiles and the profile index of each incident, reloading the profiles once
+    if an incident was added after they were cached.
+    """
+    profiles = get_deviation_profiles(conn, states)
+    rows = profiles.rows(incident_ids)
+    if (rows < 0).any():
+        deviation_profiles_cache.clear()
+        profiles = get_deviation_profiles(conn, states)
+        rows = profiles.rows(incident_ids)
+    return profiles, rows
+
+def round_scores(compliance):
+    """Rounds a (incidents x states) compliance array to 2 decimals with Python's round, as displayed."""
+    return [[round(score, 2) for score in incident_compliance] for incident_compliance in compliance.tolist()]
+
+def compute_compliance_per_state(conn, compliance_metric=None, cost_function=None):
+    """
+    Loads the incidents closed within the selected date range and computes their compliance per state
+    with the selected compliance metric, or with the given compliance metric and cost function.
 
     Returns:
-        dict: A dictionary with the compliance score per state.
+        tuple: The incidents DataFrame, the state codes, the deviation tensor and the (incidents x states)
+               compliance array. Raises ValueError if no date range is selected or no incident is found.
+    """
+    # Get filters from the global filter variables
+    filters = get_filter_value()
+    date_range = filters.get('filters', {}).get('overview_metrics', {}).get('date_range', {})
+
+    if not date_range.get('min_date') or not date_range.get('max_date'):
+        raise ValueError('Date range not specified')
+
+    # Build the base query to fetch incidents within the date range
+    query = """
+        SELECT 
+            incident_id,
+            fitness,
+            cost,
+            variant,
+            closed_at
+        FROM incidents_fa_values_table 
+        WHERE closed_at BETWEEN ? AND ?
     """
-    compliance_scores = {}
-    total_compliance = 0
 
-    # Calculate compliance score for each state
-    for state, deviations in deviations_per_state.items():
-        # Compliance calculation: 1/5 * (1 - (total_deviations_state / total_deviations))
-        compliance_score = 0.2 * (1 - (deviations / total_deviations))  if total_deviations != 0 else 0.2
-        compliance_scores[state] = compliance_score
-        total_compliance += compliance_score
+    # Add the 'whatif_analysis' exclusion clause if applicable
+    whatif_clause = apply_whatif_analysis_filter()
+    if whatif_clause:
+        query += f" AND ( {whatif_clause} )"
+
+    # Add the ORDER BY clause at the end
+    query += " ORDER BY closed_at ASC"
+
+    # Load data into a DataFrame
+    df = pd.read_sql_query(query, conn, params=(date_range['min_date'], date_range['max_date']))
+
+    if df.empty:
+        raise ValueError('No incidents found within the specified date range')
+
+    # The compliance metric and the cost function are read once for all incidents
+    compliance_metric = compliance_metric or get_filter_value("filters.compliance_metric")
+    cost_function = cost_function or get_filter_value("filters.cost_function")
+    states = list(cost_function["missing"])
+
+    profiles, rows = load_incident_profiles(conn, df['incident_id'], states)
+    deviations = profiles.deviations[rows]
 
-    # Calculate normalization factor
-    normalization_factor = 1 / total_compliance if total_compliance != 0 else 0
+    if compliance_metric == "fitness":
+        fitness = np.array([round(fitness, 2) for fitness in df['fitness']], dtype=float)
+        compliance = calculate_compliance_per_state(deviations, fitness)
+    else:
+        # Evaluated once per unique profile and broadcast back to the incidents
+        compliance = profiles.cost_per_state(cost_function, states)[rows]
 
-    # Normalize compliance scores
-    for state in compliance_scores:
-        compliance_scores[state] *= normalization_factor
-    return compliance_scores
+    return df, states, deviations, compliance
 
-def calculate_cost_per_state(deviations_per_type_per_state, total_events, cost_function):
+@eel.expose
+@cached_endpoint
+def get_compliance_per_state_per_incident(db_path="../data/incidents.db"):
     """
-    Calculates the non-compliance cost per state based on deviations and a cost function.
+    Retrieves the compliance per state for all incidents within the specified date range, 
+    aggregating missing, repetition, and mismatch deviations.
 
     Args:
-        deviations_per_type_per_state (dict): Nested dict with deviation counts per type and state.
-        total_events (int): Total number of events in the incident.
-        cost_function (dict): Cost weights for each deviation type and state.
+        db_path (str): Path to the SQLite database file.
 
     Returns:
-        dict: A dictionary mapping each process state to its non-compliance cost.
-        Example:
-            {"N": 0.12, "A": 0.08, ...}
-
-    Interpretation:
-        - Each key is a process state code.
-        - Each value is the calculated non-compliance cost for that state.
-        - Used for cost-based compliance analysis.
+        str: A JSON string containing compliance per state for each incident within the date range.
     """
-    # Initialize total cost for the process
-    non_compliance_cost_per_state = {}
-
-    thresholds = {"missing": False, "repetition": False, "mismatch": False}
-
-    # Loop through all process states of the reference process
-    for state in cost_function["missing"]:
-        # Set of missing deviations
-        deviations_missing = deviations_per_type_per_state["missing"][state]
-        
-        # Set of repetition deviations
-        deviations_repetition = deviations_per_type_per_state["repetition"][state]
-        
-        # Set of mismatch deviations
-        deviations_mismatch = deviations_per_type_per_state["mismatch"][state]
-        
-        
-        # Initialize the non-compliance cost for the current state
-        state_non_compliance_cost = 0
-        
-        # Calculate cost for missing deviations
-        if deviations_missing * cost_function["missing"][state] > 1:
-            state_non_compliance_cost += 1 * cost_function["cost"]["missing"]
-        else:
-            state_non_compliance_cost += deviations_missing * cost_function["missing"][state] * cost_function["cost"]["missing"]
-        
-        # Calculate cost for repetition deviations (normalized by total_events)
-        if deviations_repetition * cost_function["repetition"][state] > 1:
-            state_non_compliance_cost += 1 * cost_function["cost"]["repetition"]
-        else:
-            state_non_compliance_cost += deviations_repetition * cost_function["repetition"][state] * cost_function["cost"]["repetition"] / total_events
-        
-        # Calculate cost for mismatch deviations (normalized by total_events)
-        if deviations_mismatch * cost_function["mismatch"][state] > 1:
-            state_non_compliance_cost += 1 * cost_function["cost"]["mismatch"]
-        else:
-            state_non_compliance_cost += deviations_mismatch * cost_function["mismatch"][state] * cost_function["cost"]["mismatch"] / total_events
-        
-        # Add the non-compliance cost of this state to the dictionary
-        non_compliance_cost_per_state[state] = state_non_compliance_cost
-    
-    # Return non-compliance cost per state
-    return non_compliance_cost_per_state
+    try:
+        conn = get_connection(db_path)
+
+        df, states, deviations, compliance = compute_compliance_per_state(conn)
+        deviations_per_state = deviations.sum(axis=2)
+        rounded_compliance = round_scores(compliance)
+
+        # Prepare the result dictionary for each incident
+        results = [
+            {
+                'incident_id': incident_id,
+                'fitness': round(fitness, 2),
+                'cost': round(cost, 2),
+                'closed_at': closed_at,
+                'total_deviations_per_state': dict(zip(states, map(int, incident_deviations))),
+                'total_deviations': int(incident_deviations.sum()),
+                'compliance_per_state': dict(zip(states, incident_compliance))
+            }
+            for incident_id, fitness, cost, closed_at, incident_deviations, incident_compliance in zip(
+                df['incident_id'], df['fitness'], df['cost'], df['closed_at'], deviations_per_state, rounded_compliance
+            )
+        ]
+
+        return json.dumps(results)
+
+    except ValueError as e:
+        return json.dumps({'error': str(e)})
+
+    except Exception as e:
+        print("compliance_metric_per_state.py")
+        print(f"An error occurred: {e}")
+        return json.dumps({'error': str(e)})
 
 @eel.expose
+@cached_endpoint
 def get_average_compliance_per_state(db_path="../data/incidents.db"):
     """
     Calculates and returns the average process compliance value for each process state across all incidents closed within the currently selected date range.
@@ -266,29 +312,12 @@ def get_average_compliance_per_state(db_path="../data/incidents.db"):
         - The dictionary can be directly consumed by JavaScript via Eel for frontend analytics and reporting.
     """
     try:
-        # Get compliance data for each incident
-        compliance_data = get_compliance_per_state_per_incident(db_path)
+        _, states, _, compliance = compute_compliance_per_state(get_connection(db_path))
 
-        if isinstance(compliance_data, str):
-            compliance_data = json.loads(compliance_data)
-
-        if 'error' in compliance_data:
-            return {'error': compliance_data['error']}
-
-        # Initialize a dictionary to sum compliance scores per state
-        compliance_sum_per_state = {}
-        incident_count = 0
-
-        # Iterate through each incident's compliance data
-        for incident in compliance_data:
-            incident_count += 1
-            for state, compliance in incident['compliance_per_state'].items():
-                compliance_sum_per_state[state] = compliance_sum_per_state.get(state, 0) + compliance
-
-        # Calculate the average compliance per state
+        # Average the (rounded) compliance of each state over the incidents axis
         average_compliance_per_state = {
-            state: round(compliance_sum / incident_count, 2)
-            for state, compliance_sum in compliance_sum_per_state.items()
+            state: round(float(average), 2)
+            for state, average in zip(states, np.array(round_scores(compliance)).mean(axis=0))
         }
 
         return average_compliance_per_state  # Return a Python dictionary directly
@@ -310,8 +339,8 @@ from database_filter_variables import *
 @eel.expose
 def update_cost_with_compliance_per_state(db_path="../data/incidents.db"):
     """
-    Updates the 'cost' column in the incidents_fa_values_table for each incident
-    with the sum of the compliance_per_state values as calculated by get_compliance_per_state_per_incident.
+    Updates the 'cost' column in the incidents_fa_values_table for each incident closed within the selected
+    date range with the sum of its non-compliance costs per state under the current cost function.
 
     Args:
         db_path (str): Path to the SQLite database file.
@@ -320,30 +349,28 @@ def update_cost_with_compliance_per_state(db_path="../data/incidents.db"):
         dict: A summary of the update operation, including the number of updated incidents.
     """
     try:
-        # Get compliance data for each incident
-        compliance_data = get_compliance_per_state_per_incident(db_path)
-        if isinstance(compliance_data, str):
-            compliance_data = json.loads(compliance_data)
-        if 'error' in compliance_data:
-            return {'error': compliance_data['error']}
-
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        updated_count = 0
-
-        for incident in compliance_data:
-            incident_id = incident['incident_id']
-            # The new cost is the sum of compliance_per_state values
-            new_cost = sum(incident['compliance_per_state'].values())
-            # Update the cost in the database
-            cursor.execute(
-                "UPDATE incidents_fa_values_table SET cost = ? WHERE incident_id = ?",
-                (new_cost, incident_id)
-            )
-            updated_count += cursor.rowcount
+        try:
+            df, _, _, compliance = compute_compliance_per_state(get_connection(db_path), compliance_metric="cost")
+        except ValueError as e:
+            return {'error': str(e)}
+
+        # The new cost is the sum of the (rounded) costs per state
+        new_costs = [sum(incident_compliance) for incident_compliance in round_scores(compliance)]
+
+        # Update the cost of all incidents with one statement
+        with write_transaction(db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS rescored_costs (incident_id TEXT PRIMARY KEY, cost REAL)")
+            cursor.execute("DELETE FROM temp.rescored_costs")
+            cursor.executemany("INSERT OR REPLACE INTO temp.rescored_costs VALUES (?, ?)", zip(df['incident_id'], new_costs))
+            cursor.execute("""
+                UPDATE incidents_fa_values_table SET cost = r.cost
+                FROM temp.rescored_costs AS r
+                WHERE incidents_fa_values_table.incident_id = r.incident_id
+            """)
+            updated_count = cursor.rowcount
+            refresh_quantile_sketches(conn, list(df['incident_id']))
 
-        conn.commit()
-        conn.close()
         return {"updated_incidents": updated_count}
 
     except Exception as e:
@@ -351,6 +378,39 @@ def update_cost_with_compliance_per_state(db_path="../data/incidents.db"):
         print(f"An error occurred during cost update: {e}")
         return {'error': str(e)}
 
+@eel.expose
+@cached_endpoint
+def preview_cost_function(cost_function, db_path="../data/incidents.db"):
+    """
+    Re-scores the incidents closed within the selected date range with a candidate cost function without
+    storing it, e.g. while its weights are being edited. Each unique deviation profile is scored once.
+
+    Args:
+        cost_function (dict): Cost weights for each deviation type and state, as in filters.cost_function.
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        dict: The average cost per state, the average total cost and the number of incidents and profiles,
+              or {'error': <error_message>}.
+    """
+    try:
+        conn = get_connection(db_path)
+        states = list(cost_function["missing"])
+        df, _, _, compliance = compute_compliance_per_state(conn, compliance_metric="cost", cost_function=cost_function)
+        profile_count = len(np.unique(load_incident_profiles(conn, df['incident_id'], states)[1]))
+
+        return {
+            'average_cost_per_state': {state: round(float(average), 2) for state, average in zip(states, compliance.mean(axis=0))},
+            'average_cost': round(float(compliance.sum(axis=1).mean()), 2),
+            'incidents': len(df),
+            'profiles': profile_count,
+        }
+
+    except Exception as e:
+        print("compliance_metric_per_state.py")
+        print(f"An error occurred: {e}")
+        return {'error': str(e)}
+
 # Example usage
 if __name__ == "__main__":
     # Example call to the exposed function
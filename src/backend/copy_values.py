@@ -1,58 +1,56 @@
 import sqlite3
+from helper import incident_scope
 
-def transfer_event_log_data(db_path="../data/incidents.db"):
+def transfer_event_log_data(db_path="../data/incidents.db", incident_ids=None):
     """
     Transfers data from the event_log_table to the incidents_fa_values_table.
     For each incident_id, the latest event data will be used to update the corresponding row in incidents_fa_values_table.
     
     Args:
         db_path (str): Path to the SQLite database file.
+        incident_ids (list, optional): Restricts the transfer to these incidents. All incidents if None.
+
+    Returns:
+        int: The number of updated incidents, or None if an error occurred.
     """
+    conn = None
     try:
         # Connect to the SQLite database
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
-        # Fetch the most recent event for each incident_id from event_log_table
-        query = """
-        SELECT incident_id, location, category, subcategory, u_symptom, impact, urgency, priority, assignment_group,
-               assigned_to, resolved_by, made_sla
-        FROM event_log_table
-        WHERE ROWID IN (
-            SELECT MAX(ROWID)
-            FROM event_log_table
-            GROUP BY incident_id
-        )
-        """
-        cursor.execute(query)
-        event_data = cursor.fetchall()
-
-        # Iterate over the event data and update the corresponding incident in incidents_fa_values_table
-        update_query = """
+        # Update every incident with its most recent event from event_log_table in one statement
+        scope = incident_scope(conn, incident_ids)
+        cursor.execute(f"""
         UPDATE incidents_fa_values_table
-        SET location = ?, category = ?, subcategory = ?, u_symptom = ?, impact = ?, urgency = ?, priority = ?,
-            assignment_group = ?, assigned_to = ?, resolved_by = ?, made_sla = ?
-        WHERE incident_id = ?
-        """
-
-        for row in event_data:
-            incident_id = row[0]
-            # Get the other fields from the row
-            location, category, subcategory, u_symptom, impact, urgency, priority, assignment_group, \
-                assigned_to, resolved_by, made_sla = row[1:]
-
-            # Execute the update for each incident_id
-            cursor.execute(update_query, (location, category, subcategory, u_symptom, impact, urgency, priority,
-                                          assignment_group, assigned_to, resolved_by, made_sla, incident_id))
+        SET location = e.location, category = e.category, subcategory = e.subcategory, u_symptom = e.u_symptom,
+            impact = e.impact, urgency = e.urgency, priority = e.priority, assignment_group = e.assignment_group,
+            assigned_to = e.assigned_to, resolved_by = e.resolved_by, made_sla = e.made_sla
+        FROM (
+            SELECT incident_id, location, category, subcategory, u_symptom, impact, urgency, priority, assignment_group,
+                   assigned_to, resolved_by, made_sla
+            FROM event_log_table
+            WHERE ROWID IN (
+                SELECT MAX(ROWID)
+                FROM event_log_table
+                WHERE {scope}
+                GROUP BY incident_id
+            )
+        ) AS e
+        WHERE incidents_fa_values_table.incident_id = e.incident_id
+        """)
+        updated_incidents = cursor.rowcount
 
         # Commit the changes
         conn.commit()
         print("copy_values.py")
-        print(f"Data transferred successfully for {len(event_data)} incidents.")
+        print(f"Data transferred successfully for {updated_incidents} incidents.")
+        return updated_incidents
 
     except Exception as e:
         print("copy_values.py")
         print(f"An error occurred: {e}")
+        return None
 
     finally:
         # Close the database connection
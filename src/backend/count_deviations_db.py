@@ -1,19 +1,12 @@
-import pandas as pd
-import sqlite3
-import ast
 import eel
 import json
 
 from database_filter_variables import *
-
-
-def parse_dict_column(column):
-    """
-    Convert string representation of dictionary to an actual dictionary.
-    """
-    return column.apply(lambda x: ast.literal_eval(x))
+from result_cache import cached_endpoint
+from database_connections import get_connection
 
 @eel.expose
+@cached_endpoint
 def count_frequencies():
     """
     Counts the frequencies of process states for missing, repetition, and mismatch deviations across all incidents specified in `incident_ids_from_time_period`.
@@ -39,42 +32,32 @@ def count_frequencies():
         - The dictionary can be directly consumed by JavaScript via Eel for frontend analytics and reporting.
     """
     db_path = "../data/incidents.db"
-    conn = sqlite3.connect(db_path)
-    try:
-        # Prepare the incident IDs for SQL query
-        formatted_incident_ids = ', '.join(f"'{incident_id}'" for incident_id in get_incident_ids_selection())
-
-        # Query the necessary data from the database
-        query = f"""
-        SELECT missing, repetition, mismatch 
-        FROM incident_alignment_table 
-        WHERE incident_id IN ({formatted_incident_ids})
-        """
-
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
-        df = pd.read_sql_query(query, conn)
-
-        # Initialize counters
-        frequencies = {
-            'missing': {'N': 0, 'A': 0, 'R': 0, 'C': 0, 'W': 0},
-            'repetition': {'N': 0, 'A': 0, 'R': 0, 'C': 0, 'W': 0},
-            'mismatch': {'N': 0, 'A': 0, 'R': 0, 'C': 0, 'W': 0}
-        }
+    conn = get_connection(db_path)
+
+    # Materialize the selected incident IDs, without the what-if exclusions
+    materialize_incident_selection(conn)
+
+    # Sum the typed per-state deviation counts directly in SQL
+    query = f"""
+    SELECT kind, state, SUM(value)
+    FROM incident_metrics
+    JOIN incident_selection USING (incident_id)
+    WHERE kind IN ('missing', 'repetition', 'mismatch')
+    GROUP BY kind, state
+    """
 
-        # Sum up the counts for each state in each column
-        for column in ['missing', 'repetition', 'mismatch']:
-            parsed_column = parse_dict_column(df[column])
-            for state in frequencies[column].keys():
-                frequencies[column][state] = int(parsed_column.apply(lambda x: x[state]).sum())
+    # Initialize counters
+    frequencies = {
+        'missing': {'N': 0, 'A': 0, 'R': 0, 'C': 0, 'W': 0},
+        'repetition': {'N': 0, 'A': 0, 'R': 0, 'C': 0, 'W': 0},
+        'mismatch': {'N': 0, 'A': 0, 'R': 0, 'C': 0, 'W': 0}
+    }
 
-        return frequencies  # Return the Python dictionary directly
+    # Fill in the counts for each state in each deviation type
+    for kind, state, count in conn.execute(query):
+        frequencies[kind][state] = int(count or 0)
 
-    finally:
-        conn.close()
+    return frequencies  # Return the Python dictionary directly
 
 def main():
     try:
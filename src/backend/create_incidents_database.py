@@ -1,19 +1,95 @@
 import pandas as pd
 from sqlalchemy import create_engine
+import sqlite3
 import os
 
+# State codes of the event log stored as small integers in the event_code column
+STATE_CODES = {'N': 1, 'A': 2, 'W': 3, 'R': 4, 'C': 5}
+
+# Timestamp columns which receive an additional <column>_min column holding integer epoch minutes
+TIMESTAMP_COLUMNS = ['opened_at', 'sys_created_at', 'sys_updated_at', 'resolved_at', 'closed_at']
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Declared column types per table, columns not listed here are stored as they are parsed
+TABLE_SCHEMAS = {
+    'event_log_table': {
+        'incident_id': 'TEXT',
+        'event': 'TEXT',
+        'incident_state': 'TEXT',
+        'active': 'INTEGER',
+        'reassignment_count': 'INTEGER',
+        'reopen_count': 'INTEGER',
+        'sys_mod_count': 'INTEGER',
+        'made_sla': 'INTEGER',
+        'knowledge': 'INTEGER',
+        'u_priority_confirmation': 'INTEGER',
+        'opened_at': 'TEXT',
+        'sys_created_at': 'TEXT',
+        'sys_updated_at': 'TEXT',
+        'resolved_at': 'TEXT',
+        'closed_at': 'TEXT',
+        'location': 'TEXT',
+        'category': 'TEXT',
+        'subcategory': 'TEXT',
+        'u_symptom': 'TEXT',
+        'impact': 'TEXT',
+        'urgency': 'TEXT',
+        'priority': 'TEXT',
+        'assignment_group': 'TEXT',
+        'assigned_to': 'TEXT',
+        'resolved_by': 'TEXT',
+    },
+    'incident_alignment_table': {
+        'incident_id': 'TEXT',
+        'alignment': 'TEXT',
+        'missing': 'TEXT',
+        'repetition': 'TEXT',
+        'mismatch': 'TEXT',
+        'fitness': 'REAL',
+        'costTotal': 'REAL',
+        'severity': 'TEXT',
+    },
+}
+
+# Indexes built once all chunks are loaded
+TABLE_INDEXES = {
+    'event_log_table': {
+        'idx_event_log_incident_time': '(incident_id, sys_updated_at)',
+    },
+    'incident_alignment_table': {
+        'idx_incident_alignment_incident': '(incident_id)',
+    },
+}
+
+# PRAGMAs applied to the loading connection only
+BULK_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+]
+
+# Seconds a load waits for the write lock of the database file while another load, e.g. of a parallel
+# pipeline step, writes a different table of it
+LOAD_BUSY_TIMEOUT = 600
+
+BOOLEAN_VALUES = {'true': 1, 'false': 0, '1': 1, '0': 0, True: 1, False: 0}
+
 # Function to load CSV and write to SQLite
-def csv_to_sqlite(csv_file, table_name, delimiter=';', database='../data/incidents.db'):
+def csv_to_sqlite(csv_file, table_name, delimiter=';', database='../data/incidents.db', streaming=False, chunksize=100000):
+    if streaming:
+        return stream_csv_to_sqlite(csv_file, table_name, delimiter=delimiter, database=database, chunksize=chunksize)
+
     # Ensure the data directory exists
     os.makedirs(os.path.dirname(database), exist_ok=True)
-    
+
     # Create a connection to the SQLite database
     engine = create_engine(f'sqlite:///{database}')
-    
+
     try:
         # Load the CSV file into a DataFrame
         df = pd.read_csv(csv_file, delimiter=delimiter, on_bad_lines='skip')
-        
+
         # Write the DataFrame to a table in the SQLite database
         df.to_sql(table_name, con=engine, if_exists='replace', index=False)
         print("create_incidents_database.py")
@@ -25,12 +101,137 @@ def csv_to_sqlite(csv_file, table_name, delimiter=';', database='../data/inciden
         print("create_incidents_database.py")
         print(f"An error occurred: {e}")
 
+def table_columns(header, schema):
+    """
+    Returns the (column, declared type) pairs of a table loaded from a CSV with the given header.
+    Timestamp columns are followed by their <column>_min epoch-minute column and the event column by event_code.
+    """
+    columns = []
+    for column in header:
+        columns.append((column, schema.get(column, '')))
+        if column in TIMESTAMP_COLUMNS:
+            columns.append((f"{column}_min", 'INTEGER'))
+        elif column == 'event':
+            columns.append(('event_code', 'INTEGER'))
+    return columns
+
+def cast_chunk(chunk, schema):
+    """
+    Casts a CSV chunk to the declared schema and adds the typed companion columns.
+
+    Args:
+        chunk (DataFrame): Chunk as read by pandas with all columns as strings.
+        schema (dict): Declared column types of the target table.
+
+    Returns:
+        DataFrame: The chunk with columns ordered as returned by table_columns().
+    """
+    header = list(chunk.columns)
+    epoch = pd.Timestamp("1970-01-01")
+    for column, column_type in schema.items():
+        if column not in chunk.columns:
+            continue
+        if column_type == 'INTEGER':
+            values = chunk[column].str.strip().str.lower()
+            chunk[column] = values.map(BOOLEAN_VALUES).fillna(pd.to_numeric(values, errors='coerce')).astype('Int64')
+        elif column_type == 'REAL':
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+
+    for column in TIMESTAMP_COLUMNS:
+        if column in chunk.columns:
+            timestamps = pd.to_datetime(chunk[column], format=TIMESTAMP_FORMAT, errors='coerce')
+            chunk[f"{column}_min"] = ((timestamps - epoch) // pd.Timedelta(minutes=1)).astype('Int64')
+    if 'event' in chunk.columns:
+        chunk['event_code'] = chunk['event'].map(STATE_CODES).astype('Int64')
+
+    return chunk[[column for column, _ in table_columns(header, schema)]]
+
+def chunk_rows(chunk):
+    """Converts a typed chunk into tuples of plain Python values with None for missing values."""
+    return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+
+def create_table(conn, table_name, header, schema):
+    """Drops and recreates a table with the declared schema for the given CSV header."""
+    columns_sql = ', '.join(f'"{column}" {column_type}'.strip() for column, column_type in table_columns(header, schema))
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(f'CREATE TABLE "{table_name}" ({columns_sql})')
+
+def create_indexes(conn, table_name):
+    """Creates the indexes declared for a table in TABLE_INDEXES."""
+    for index_name, index_columns in TABLE_INDEXES.get(table_name, {}).items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON "{table_name}" {index_columns}')
+
+def stream_csv_to_sqlite(csv_file, table_name, delimiter=';', database='../data/incidents.db', chunksize=100000):
+    """
+    Loads a CSV into SQLite in bounded chunks, replacing the table.
+
+    Each chunk is cast to the schema declared in TABLE_SCHEMAS and bulk-inserted, all inside a single
+    transaction on a connection tuned for loading. Timestamps additionally get an integer epoch-minute column
+    and state codes a small integer column. Indexes are built once after the last chunk.
+
+    Args:
+        csv_file (str): Path to the CSV file.
+        table_name (str): Name of the table to (re)create.
+        delimiter (str): CSV delimiter.
+        database (str): Path to the SQLite database file.
+        chunksize (int): Number of CSV rows held in memory at once.
+
+    Returns:
+        int: The number of rows written, or None if the load failed.
+    """
+    os.makedirs(os.path.dirname(database), exist_ok=True)
+    schema = TABLE_SCHEMAS.get(table_name, {})
+    conn = sqlite3.connect(database, isolation_level=None, timeout=LOAD_BUSY_TIMEOUT)
+    try:
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+
+        # The table is created from the header, or the declared schema for an empty file, before any row is read
+        try:
+            header = list(pd.read_csv(csv_file, delimiter=delimiter, nrows=0).columns)
+            reader = pd.read_csv(csv_file, delimiter=delimiter, on_bad_lines='skip', dtype=str,
+                                 keep_default_na=False, na_values=[''], chunksize=chunksize)
+        except pd.errors.EmptyDataError:
+            header, reader = list(schema), []
+        insert_query = f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * len(table_columns(header, schema)))})'
+
+        rows_written = 0
+        # Take the write lock up front: a deferred transaction could not wait for another load to commit
+        conn.execute("BEGIN IMMEDIATE")
+        create_table(conn, table_name, header, schema)
+        for chunk in reader:
+            if chunk.empty:
+                continue
+            chunk = cast_chunk(chunk, schema)
+            conn.executemany(insert_query, chunk_rows(chunk))
+            rows_written += len(chunk)
+
+        create_indexes(conn, table_name)
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA optimize")
+
+        print("create_incidents_database.py")
+        print(f"Streamed {rows_written} rows from {csv_file} into table '{table_name}' in database '{database}'.")
+        return rows_written
+    except pd.errors.ParserError as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print("create_incidents_database.py")
+        print(f"Error parsing {csv_file}: {e}")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print("create_incidents_database.py")
+        print(f"An error occurred: {e}")
+    finally:
+        conn.close()
+
 # Main function to execute the script
 if __name__ == "__main__":
     # Define the CSV file paths
     event_log_csv = '../data/simple_log.csv'
     incident_log_csv = '../data/IM_log.csv'
-    
+
     # Write each CSV to the database
-    csv_to_sqlite(event_log_csv, 'event_log_table', delimiter=';')
-    csv_to_sqlite(incident_log_csv, 'incident_alignment_table', delimiter=',')
+    csv_to_sqlite(event_log_csv, 'event_log_table', delimiter=';', streaming=True)
+    csv_to_sqlite(incident_log_csv, 'incident_alignment_table', delimiter=',', streaming=True)
@@ -1,11 +1,13 @@
-import sqlite3
 import pandas as pd
 import json
 import eel
-import re  # Import regular expressions module
 from database_filter_variables import *
+from thresholds import get_severity_thresholds
+from result_cache import cached_endpoint
+from database_connections import get_connection
 
 @eel.expose
+@cached_endpoint
 def get_critical_incidents(db_path="../data/incidents.db"):
     """
     Retrieves incidents that fall into the critical range based on the selected compliance metric and threshold levels.
@@ -36,23 +38,20 @@ def get_critical_incidents(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
 
         # Get the compliance metric from the filters
         compliance_metric = get_filter_value("filters.compliance_metric")
 
-        compliance_metric_severity_levels2 = get_filter_value("filters.thresholds.compliance_metric_severity_levels2")
-        if compliance_metric_severity_levels2 and compliance_metric in compliance_metric_severity_levels2:
-            thresholds = compliance_metric_severity_levels2[compliance_metric]
-        else:
-            thresholds = get_filter_value("filters.thresholds.compliance_metric_severity_levels")
+        thresholds = get_severity_thresholds(compliance_metric)
 
         # Get selected incident IDs
         incident_ids = get_incident_ids_selection()
         if not incident_ids:
             return []  # No incidents to process
 
-        formatted_incident_ids = ', '.join(f"'{incident_id}'" for incident_id in incident_ids)
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
 
         # Define severity level and sort order based on the compliance metric
         if compliance_metric == 'fitness':
@@ -64,25 +63,17 @@ def get_critical_incidents(db_path="../data/incidents.db"):
         else:
             raise ValueError(f"Unknown compliance metric: {compliance_metric}")
 
-        # Get the threshold string for the severity level
-        threshold_str = thresholds[severity_level]  # e.g., '>= 0 AND <= 0.5'
-
-        # Build the threshold condition for the SQL query
-        threshold_condition = build_threshold_condition(compliance_metric, threshold_str)
+        # Build the SQL condition of the compiled threshold of the severity level, e.g. '>= 0 AND <= 0.5'
+        threshold_condition = thresholds[severity_level].sql(compliance_metric)
 
         # Build the SQL query to get incidents that fall in the critical range
         query = f"""
             SELECT incident_id, {compliance_metric}
             FROM incidents_fa_values_table
-            WHERE incident_id IN ({formatted_incident_ids})
-            AND {threshold_condition}
+            JOIN incident_selection USING (incident_id)
+            WHERE {threshold_condition}
         """
 
-        # Add the 'whatif_analysis' exclusion clause if applicable
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ({whatif_clause})"
-
         # Add the ORDER BY clause
         query += f" ORDER BY {compliance_metric} {sort_order}"
 
@@ -99,36 +90,6 @@ def get_critical_incidents(db_path="../data/incidents.db"):
         print(f"An error occurred: {e}")
         return []  # Return an empty list on error
 
-    finally:
-        # Close the database connection
-        conn.close()
-
-def build_threshold_condition(compliance_metric, threshold_str):
-    """
-    Builds a SQL condition string by embedding the compliance metric into the threshold expressions.
-
-    Args:
-        compliance_metric (str): The compliance metric column name.
-        threshold_str (str): The threshold expression string, e.g., '>= 0 AND <= 0.5'.
-
-    Returns:
-        str: A SQL condition string with the compliance metric applied to each condition.
-    """
-    # Split the threshold_str into tokens using 'AND' or 'OR' as delimiters
-    tokens = re.split(r'\s+(AND|OR)\s+', threshold_str)
-    conditions = []
-    for token in tokens:
-        token = token.strip()
-        if token in ('AND', 'OR'):
-            # Logical operators are added directly
-            conditions.append(token)
-        else:
-            # Prepend the compliance metric to each condition
-            conditions.append(f"{compliance_metric} {token}")
-    # Join the conditions back into a single string
-    condition_str = ' '.join(conditions)
-    return condition_str
-
 # Example usage
 if __name__ == "__main__":
     critical_incidents_json = get_critical_incidents()
@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from create_incidents_database import stream_csv_to_sqlite, LOAD_BUSY_TIMEOUT
+from prepare_incidents_table import create_incidents_table, seed_incidents
+from helper import copy_deviation_columns
+from copy_values import transfer_event_log_data
+from derive_incident_features import derive_incident_features
+
+def run_ingest_event_log(db_path, data_dir):
+    if stream_csv_to_sqlite(os.path.join(data_dir, 'simple_log.csv'), 'event_log_table', delimiter=';', database=db_path) is None:
+        raise RuntimeError("Loading the event log failed")
+
+def run_ingest_alignments(db_path, data_dir):
+    if stream_csv_to_sqlite(os.path.join(data_dir, 'IM_log.csv'), 'incident_alignment_table', delimiter=',', database=db_path) is None:
+        raise RuntimeError("Loading the alignments failed")
+
+def run_seed_incidents(db_path, data_dir):
+    create_incidents_table(db_path)
+    seed_incidents(db_path)
+
+# The preparation steps print their errors and return None, which must fail the step rather than checkpoint it
+def run_transfer_event_log_data(db_path, data_dir):
+    if transfer_event_log_data(db_path) is None:
+        raise RuntimeError("Transferring the event log data failed")
+
+def run_copy_deviation_columns(db_path, data_dir):
+    if copy_deviation_columns(db_path) is None:
+        raise RuntimeError("Copying the deviation columns failed")
+
+def run_derive_incident_features(db_path, data_dir):
+    if derive_incident_features(db_path) is None:
+        raise RuntimeError("Deriving the incident features failed")
+
+def run_update_cost(db_path, data_dir):
+    # Imported here as the compliance module pulls in the Eel runtime
+    from compliance_metric_per_state import update_cost_with_compliance_per_state
+    result = update_cost_with_compliance_per_state(db_path)
+    if isinstance(result, dict) and 'error' in result:
+        raise RuntimeError(result['error'])
+
+# The data preparation DAG. Each step declares the steps it depends on, the files and tables it reads
+# and the tables it writes as its resources. Steps sharing a resource never run at the same time, steps
+# writing different tables run in parallel: SQLite allows a single writer per database file, so their
+# write transactions take turns while the parsing of one step overlaps with the writing of the other.
+PIPELINE_STEPS = [
+    {
+        "name": "ingest_event_log",
+        "depends_on": [],
+        "input_files": ["simple_log.csv"],
+        "input_tables": [],
+        "resources": ["event_log_table"],
+        "run": run_ingest_event_log,
+    },
+    {
+        "name": "ingest_alignments",
+        "depends_on": [],
+        "input_files": ["IM_log.csv"],
+        "input_tables": [],
+        "resources": ["incident_alignment_table"],
+        "run": run_ingest_alignments,
+    },
+    {
+        "name": "seed_incidents",
+        "depends_on": ["ingest_event_log", "ingest_alignments"],
+        "input_files": [],
+        "input_tables": ["event_log_table", "incident_alignment_table"],
+        "resources": ["incidents_fa_values_table"],
+        "run": run_seed_incidents,
+    },
+    {
+        "name": "transfer_event_log_data",
+        "depends_on": ["seed_incidents"],
+        "input_files": [],
+        "input_tables": ["event_log_table"],
+        "resources": ["incidents_fa_values_table"],
+        "run": run_transfer_event_log_data,
+    },
+    {
+        "name": "copy_deviation_columns",
+        "depends_on": ["seed_incidents"],
+        "input_files": [],
+        "input_tables": ["incident_alignment_table"],
+        "resources": ["incidents_fa_values_table"],
+        "run": run_copy_deviation_columns,
+    },
+    {
+        "name": "derive_incident_features",
+        "depends_on": ["seed_incidents"],
+        "input_files": [],
+        "input_tables": ["event_log_table"],
+        "resources": ["incidents_fa_values_table", "incident_metrics", "quantile_sketches"],
+        "run": run_derive_incident_features,
+    },
+    {
+        "name": "update_cost",
+        "depends_on": ["copy_deviation_columns", "derive_incident_features"],
+        "input_files": [],
+        "input_tables": [],
+        "resources": ["incidents_fa_values_table"],
+        "run": run_update_cost,
+    },
+]
+
+def validate_pipeline(steps):
+    """
+    Checks that step names are unique and that the dependencies name existing steps without a cycle,
+    as the scheduler would otherwise wait forever for a step which never becomes ready.
+    """
+    names = [step["name"] for step in steps]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate pipeline steps: {', '.join(duplicates)}")
+    for step in steps:
+        unknown = [dependency for dependency in step["depends_on"] if dependency not in names]
+        if unknown:
+            raise ValueError(f"Step {step['name']} depends on unknown steps: {', '.join(unknown)}")
+
+    ordered = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if ordered.issuperset(step["depends_on"])]
+        if not ready:
+            raise ValueError(f"Cyclic dependencies between the steps: {', '.join(step['name'] for step in remaining)}")
+        ordered.update(step["name"] for step in ready)
+        remaining = [step for step in remaining if step["name"] not in ordered]
+
+def file_content_hash(file_path):
+    """Returns the SHA-256 of a file read in 1 MiB blocks, or None if the file does not exist."""
+    if not os.path.exists(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def table_watermark(db_path, table_name):
+    """Returns the row count and max rowid of a table as 'count:max_rowid', or None if the table does not exist."""
+    conn = sqlite3.connect(db_path)
+    try:
+        count, max_rowid = conn.execute(f'SELECT COUNT(*), MAX(ROWID) FROM "{table_name}"').fetchone()
+        return f"{count}:{max_rowid}"
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+
+def create_checkpoint_table(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+            step TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            completed_at TEXT NOT NULL,
+            seconds REAL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+def read_checkpoints(db_path):
+    """Returns the stored fingerprint per completed step."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT step, fingerprint FROM pipeline_checkpoints"))
+    finally:
+        conn.close()
+
+def write_checkpoint(db_path, step_name, fingerprint, seconds):
+    # A parallel step may still be writing the database, wait for its commit like the loads do
+    conn = sqlite3.connect(db_path, timeout=LOAD_BUSY_TIMEOUT)
+    conn.execute(
+        "INSERT OR REPLACE INTO pipeline_checkpoints (step, fingerprint, completed_at, seconds) VALUES (?, ?, ?, ?)",
+        (step_name, fingerprint, datetime.now().isoformat(timespec='seconds'), seconds)
+    )
+    conn.commit()
+    conn.close()
+
+def step_fingerprint(step, db_path, data_dir, file_hashes, upstream_fingerprints):
+    """
+    Combines the content hashes of a step's input files, the watermarks of its input tables and the
+    fingerprints of the steps it depends on into one fingerprint.
+    """
+    inputs = {
+        "files": {name: file_hashes[name] for name in step["input_files"]},
+        "tables": {name: table_watermark(db_path, name) for name in step["input_tables"]},
+        "upstream": {name: upstream_fingerprints[name] for name in step["depends_on"]},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def run_pipeline(db_path="../data/incidents.db", data_dir="../data", force=False, max_workers=4, steps=PIPELINE_STEPS):
+    """
+    Runs the data preparation DAG and returns the outcome per step.
+
+    A step is skipped when the fingerprint of its inputs equals the fingerprint checkpointed after its last
+    successful run, unless force is set. Checkpoints are written to pipeline_checkpoints as soon as a step
+    finishes, so an interrupted run resumes with the first step that did not complete. Steps whose
+    dependencies are satisfied run in parallel unless they write the same resource.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        data_dir (str): Directory holding the input CSV files.
+        force (bool): Rerun every step regardless of its checkpoint.
+        max_workers (int): Maximum number of steps and input hashes processed at the same time.
+        steps (list): The step declarations, PIPELINE_STEPS by default.
+
+    Returns:
+        dict: Maps each step name to 'skipped', 'done', 'failed' or 'blocked' (a dependency failed).
+
+    Raises:
+        ValueError: If the steps have duplicate names, unknown dependencies or cyclic dependencies.
+    """
+    validate_pipeline(steps)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    create_checkpoint_table(db_path)
+    checkpoints = {} if force else read_checkpoints(db_path)
+    steps_by_name = {step["name"]: step for step in steps}
+
+    outcome = {}
+    fingerprints = {}
+    busy_resources = set()
+    running = {}
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        input_files = sorted({name for step in steps for name in step["input_files"]})
+        hashes = executor.map(lambda name: file_content_hash(os.path.join(data_dir, name)), input_files)
+        file_hashes = dict(zip(input_files, hashes))
+
+        def execute(step, fingerprint):
+            started = time.perf_counter()
+            step["run"](db_path, data_dir)
+            seconds = round(time.perf_counter() - started, 3)
+            with lock:
+                write_checkpoint(db_path, step["name"], fingerprint, seconds)
+            return seconds
+
+        while len(outcome) < len(steps):
+            for step in steps:
+                name = step["name"]
+                if name in outcome or name in running.values():
+                    continue
+                dependency_outcomes = [outcome.get(dependency) for dependency in step["depends_on"]]
+                if any(result in ('failed', 'blocked') for result in dependency_outcomes):
+                    outcome[name] = 'blocked'
+                    continue
+                if any(result is None for result in dependency_outcomes):
+                    continue
+                if busy_resources.intersection(step["resources"]):
+                    continue
+
+                fingerprint = step_fingerprint(step, db_path, data_dir, file_hashes, fingerprints)
+                if checkpoints.get(name) == fingerprint:
+                    fingerprints[name] = fingerprint
+                    outcome[name] = 'skipped'
+                    print("data_pipeline.py")
+                    print(f"Skipping {name}: inputs unchanged.")
+                    continue
+
+                print("data_pipeline.py")
+                print(f"Running {name}...")
+                fingerprints[name] = fingerprint
+                busy_resources.update(step["resources"])
+                running[executor.submit(execute, step, fingerprint)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                busy_resources.difference_update(steps_by_name[name]["resources"])
+                try:
+                    seconds = future.result()
+                    outcome[name] = 'done'
+                    print("data_pipeline.py")
+                    print(f"Finished {name} in {seconds:.3f}s.")
+                except Exception as e:
+                    outcome[name] = 'failed'
+                    print("data_pipeline.py")
+                    print(f"Step {name} failed: {e}")
+
+    return outcome
+
+# Run the pipeline, pass --force to rerun all steps
+if __name__ == "__main__":
+    print(run_pipeline(force="--force" in sys.argv))
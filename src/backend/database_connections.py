@@ -0,0 +1,275 @@
+import os
+import sqlite3
+import itertools
+import threading
+from contextlib import contextmanager
+
+from helper import create_incident_indexes
+
+INCIDENTS_DATABASE = "../data/incidents.db"
+SECURITY_CONTROLS_DATABASE = "../data/security_controls.db"
+
+# Pragmas of every managed connection: memory-mapped reads and a page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 32 * 1024
+
+# Prepared statements kept per connection by the statement cache of sqlite3
+CACHED_STATEMENTS = 256
+
+# Seconds a connection waits for a lock held by another connection or process
+BUSY_TIMEOUT = 10
+
+class ManagedConnection(sqlite3.Connection):
+    """
+    A long-lived connection of the connection manager. It knows the path of its database, so helpers given
+    a read connection can route their writes through the writer of the same database.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db_path = None
+        self.replica = None
+        self.functions_version = 0
+        self.transaction_depth = 0
+
+# User-defined SQL functions registered on every managed connection: name -> (number of arguments, function)
+sql_functions = {}
+sql_functions_version = 0
+
+# Read connections of the current thread per database path, and the writer per database path with its lock
+local_connections = threading.local()
+writers = {}
+manager_lock = threading.Lock()
+
+def register_function(name, num_params, function):
+    """
+    Registers a deterministic user-defined SQL function on all managed connections. Connections opened
+    before the registration pick it up the next time they are handed out.
+    """
+    global sql_functions_version
+    with manager_lock:
+        sql_functions[name] = (num_params, function)
+        sql_functions_version += 1
+
+def register_functions(conn):
+    if conn.functions_version == sql_functions_version:
+        return
+    with manager_lock:
+        functions, version = dict(sql_functions), sql_functions_version
+    for name, (num_params, function) in functions.items():
+        conn.create_function(name, num_params, function, deterministic=True)
+    conn.functions_version = version
+
+def open_connection(path, writer=False, replica=None):
+    """
+    Opens a managed connection in WAL mode, so readers never block the writer and see every committed write.
+    Read connections are in autocommit mode and never hold a read transaction between statements.
+    The writer is shared by all threads and serialized by its lock. A connection to a read replica opens
+    its in-memory database instead of the file.
+    """
+    conn = sqlite3.connect(
+        replica.uri if replica else path, factory=ManagedConnection, timeout=BUSY_TIMEOUT,
+        cached_statements=CACHED_STATEMENTS, check_same_thread=not writer,
+        isolation_level="DEFERRED" if writer else None, uri=replica is not None
+    )
+    conn.db_path = path
+    conn.replica = replica
+    if replica is None:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    elif not writer:
+        # Shared-cache readers take no table locks, so writes of the keeper never fail them with SQLITE_LOCKED
+        conn.execute("PRAGMA read_uncommitted = 1")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if writer and replica is None:
+        # In WAL mode a commit is durable once the WAL is checkpointed, and never corrupts the database
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def file_signature(path):
+    """Returns the modification time and size of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+def get_database_generation(db_path=INCIDENTS_DATABASE):
+    """
+    Returns the modification time and size of a database and its write-ahead log, which change with every
+    committed write, whether by an ingest, the data pipeline or another process.
+    """
+    path = os.path.abspath(db_path)
+    return (file_signature(path), file_signature(path + "-wal"))
+
+class ReadReplica:
+    """
+    An in-memory copy of a database, loaded with the backup API. It is a named in-memory database in
+    shared-cache mode, so the read connections of all threads share one copy, and it is freed once its
+    last connection is closed. The keeper connection holds it open and takes the writes made through
+    its read connections.
+    """
+
+    def __init__(self, path, generation, number):
+        self.path = path
+        self.generation = generation
+        self.uri = f"file:read-replica-{number}-{os.path.basename(path)}?mode=memory&cache=shared"
+        self.keeper = open_connection(path, writer=True, replica=self)
+        self.lock = threading.RLock()
+
+    def load(self):
+        source = sqlite3.connect(self.path)
+        try:
+            source.backup(self.keeper)
+        finally:
+            source.close()
+        # Indexes of the analytics queries, in case the database file was prepared without them
+        if self.keeper.execute("SELECT 1 FROM sqlite_master WHERE name = 'incidents_fa_values_table'").fetchone():
+            create_incident_indexes(self.keeper)
+            self.keeper.commit()
+        self.keeper.execute("PRAGMA optimize")
+
+    def close(self):
+        with self.lock:
+            self.keeper.close()
+
+# Current read replica per replicated database path
+replicas = {}
+replica_numbers = itertools.count(1)
+replica_lock = threading.Lock()
+
+def load_read_replica(path):
+    generation = get_database_generation(path)
+    replica = ReadReplica(path, generation, next(replica_numbers))
+    replica.load()
+    return replica
+
+def enable_read_replica(db_path=INCIDENTS_DATABASE):
+    """
+    Serves all read connections of a database from an in-memory copy, e.g. on a machine with slow disks.
+    The copy is replaced by a fresh one as soon as a write to the database file, by the ingest pipeline,
+    the writer or another process, changes its generation. Writes through a read connection go to the copy,
+    all other writes go to the database file through write_transaction(db_path). The incident selection is
+    a TEMP table of each read connection.
+    """
+    path = os.path.abspath(db_path)
+    replica = load_read_replica(path)
+    with replica_lock:
+        previous, replicas[path] = replicas.get(path), replica
+    if previous:
+        previous.close()
+    print("database_connections.py")
+    print(f"Loaded the read replica of {os.path.basename(path)}.")
+
+def disable_read_replica(db_path=INCIDENTS_DATABASE):
+    with replica_lock:
+        replica = replicas.pop(os.path.abspath(db_path), None)
+    if replica:
+        replica.close()
+
+def get_read_replica(path):
+    """Returns the current read replica of a database, reloaded if the database changed, or None if it is not replicated."""
+    replica = replicas.get(path)
+    if replica is None or replica.generation == get_database_generation(path):
+        return replica
+    with replica_lock:
+        replica = replicas.get(path)
+        if replica is None or replica.generation == get_database_generation(path):
+            return replica
+        # Load the new generation first, then swap: queries running on the old copy finish on it
+        previous, replicas[path] = replica, load_read_replica(path)
+    previous.close()
+    return replicas[path]
+
+def get_connection(db_path=INCIDENTS_DATABASE):
+    """
+    Returns the read connection of the current thread to a database, opened on first use and kept open.
+    Greenlets of Eel share the connection of their thread: without monkey patching they never switch
+    in the middle of a statement. While a read replica of the database is enabled, the connection reads
+    the replica. The connection must not be closed by the caller.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        ManagedConnection: The read connection.
+    """
+    path = os.path.abspath(db_path)
+    replica = get_read_replica(path) if replicas else None
+    connections = local_connections.__dict__.setdefault('connections', {})
+    conn = connections.get(path)
+    if conn is not None and conn.replica is not replica:
+        # The replica was enabled, swapped or disabled since the connection was opened
+        conn.close()
+        conn = None
+    if conn is None:
+        conn = connections[path] = open_connection(path, replica=replica)
+    register_functions(conn)
+    return conn
+
+def get_writer(path):
+    with manager_lock:
+        writer = writers.get(path)
+        if writer is None:
+            writer = writers[path] = (open_connection(path, writer=True), threading.RLock())
+    return writer
+
+@contextmanager
+def write_transaction(database=INCIDENTS_DATABASE):
+    """
+    Runs a block as one transaction of the writer of a database. Writers of all threads are serialized,
+    the transaction is committed at the end of the block or rolled back on an exception. Nested blocks
+    join the outer transaction.
+
+    Args:
+        database (str or sqlite3.Connection): Path to the database, or a connection to it. A managed
+            connection is written through the writer of its database (of its read replica, if it reads
+            one), any other connection directly.
+
+    Yields:
+        sqlite3.Connection: The connection to write with.
+    """
+    if isinstance(database, sqlite3.Connection) and not isinstance(database, ManagedConnection):
+        try:
+            yield database
+            database.commit()
+        except BaseException:
+            database.rollback()
+            raise
+        return
+
+    if isinstance(database, ManagedConnection) and database.replica is not None:
+        # Session tables written by a reader of a replica belong to the replica
+        conn, lock = database.replica.keeper, database.replica.lock
+    else:
+        path = database.db_path if isinstance(database, ManagedConnection) else os.path.abspath(database)
+        conn, lock = get_writer(path)
+    with lock:
+        register_functions(conn)
+        conn.transaction_depth += 1
+        try:
+            if conn.transaction_depth == 1:
+                # Take the write lock up front rather than failing to upgrade a read transaction later
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            if conn.transaction_depth == 1:
+                conn.commit()
+        except BaseException:
+            if conn.transaction_depth == 1:
+                conn.rollback()
+            raise
+        finally:
+            conn.transaction_depth -= 1
+
+def close_connections():
+    """Closes the read connections of the current thread and all writers, e.g. before a database file is replaced."""
+    connections = local_connections.__dict__.get('connections', {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+    with manager_lock:
+        for conn, lock in writers.values():
+            with lock:
+                conn.close()
+        writers.clear()
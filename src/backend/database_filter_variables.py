@@ -1,6 +1,11 @@
 # This file contains all the globval database variables for
 import eel
 import json
+import sqlite3
+import uuid
+import hashlib
+
+from contextlib import contextmanager
 
 assessment_filters = {
     "filters": {
@@ -211,6 +216,16 @@ def set_filter_value(path, new_value):
             value = value[key]
         value[keys[-1]] = new_value
 
+        # The what-if exclusions are part of the materialized incident selection
+        if WHATIF_ANALYSIS_PATH.startswith(path) or path.startswith(WHATIF_ANALYSIS_PATH):
+            bump_incident_selection_generation()
+
+        # Compiled thresholds are dropped once any threshold changes
+        if THRESHOLDS_PATH.startswith(path) or path.startswith(THRESHOLDS_PATH):
+            bump_thresholds_generation()
+
+        bump_filters_generation()
+
         # Print the newly set filter value
         print("database_filter_variables.py")
         print(f"Filter updated: {path} = {new_value}")
@@ -222,6 +237,52 @@ def set_filter_value(path, new_value):
         return False
 
 
+# Incremented by every setter of the filter state, used to key cached endpoint results
+filters_generation = 0
+
+def bump_filters_generation():
+    global filters_generation
+    filters_generation += 1
+
+def get_filters_generation():
+    return filters_generation
+
+# Fingerprint of the filter state, recomputed once per filters_generation
+filters_fingerprint = (None, None)
+
+def get_filters_fingerprint():
+    """
+    Returns a digest of the whole filter state: the assessment filters, the incident selection and its day range,
+    the compliance metric and the thresholds. Unlike filters_generation it is the same whenever the same filters
+    are set again, so cached endpoint results keyed on it are reused when the user switches back.
+    """
+    global filters_fingerprint
+    generation, fingerprint = filters_fingerprint
+    if generation != filters_generation:
+        generation = filters_generation
+        state = [
+            assessment_filters, incident_ids_from_time_period, incident_selection_day_range,
+            incident_compliance_metric, compliance_metric_thresholds, filter_compliance_metric_thresholds,
+            incident_selection_from_tabular_analysis,
+        ]
+        fingerprint = hashlib.sha256(json.dumps(state, sort_keys=True, default=repr).encode()).hexdigest()
+        filters_fingerprint = (generation, fingerprint)
+    return fingerprint
+
+# Path of the incident IDs excluded by the what-if analysis
+WHATIF_ANALYSIS_PATH = "filters.whatIf_analysis"
+
+# Path of the threshold expressions, and their generation used to invalidate the compiled thresholds
+THRESHOLDS_PATH = "filters.thresholds"
+thresholds_generation = 0
+
+def bump_thresholds_generation():
+    global thresholds_generation
+    thresholds_generation += 1
+
+def get_thresholds_generation():
+    return thresholds_generation
+
 def apply_whatif_analysis_filter():
     """
     Retrieves the 'whatif_analysis' filter and crafts a SQL condition to exclude the specified incident IDs.
@@ -233,7 +294,7 @@ def apply_whatif_analysis_filter():
         str: A SQL fragment to exclude specific incident IDs.
     """
 
-    whatif_analysis_ids = get_filter_value("filters.whatIf_analysis")
+    whatif_analysis_ids = get_filter_value(WHATIF_ANALYSIS_PATH)
     
     if whatif_analysis_ids:
         # Format the incident IDs to exclude for SQL query
@@ -263,10 +324,132 @@ def get_incident_ids_selection():
 
 
 def set_incident_ids_selection(incident_ids):
-    global incident_ids_from_time_period 
+    global incident_ids_from_time_period, incident_selection_day_range
     incident_ids_from_time_period = incident_ids
+    incident_selection_day_range = None
+    bump_incident_selection_generation()
+    bump_filters_generation()
     return
 
+def get_excluded_selection_ids():
+    """Returns the IDs of the incident selection which the what-if analysis removes from incident_selection."""
+    whatif_analysis_ids = get_filter_value(WHATIF_ANALYSIS_PATH)
+    if not whatif_analysis_ids:
+        return []
+    selected = set(incident_ids_from_time_period)
+    return [incident_id for incident_id in dict.fromkeys(whatif_analysis_ids) if incident_id in selected]
+
+# Range of closed_date day numbers (first_day, last_day) the incident selection was queried with, either bound
+# None for an open range. None if the selection was set from a list of IDs.
+incident_selection_day_range = None
+
+def set_incident_selection_day_range(first_day, last_day):
+    global incident_selection_day_range
+    incident_selection_day_range = (first_day, last_day)
+    bump_filters_generation()
+
+def get_sketch_day_range():
+    """
+    Returns the closed_date day range of the incident selection if its quantiles can be merged from the daily
+    quantile sketches, i.e. it is a time period without what-if exclusions, otherwise None.
+    """
+    if incident_selection_day_range is None or get_filter_value(WHATIF_ANALYSIS_PATH):
+        return None
+    return incident_selection_day_range
+
+# Generation of the incident selection, increased on every change of the selection or the what-if exclusions.
+# The session id tells apart processes sharing the same database file.
+incident_selection_session = uuid.uuid4().hex
+incident_selection_generation = 0
+
+def bump_incident_selection_generation():
+    global incident_selection_generation
+    incident_selection_generation += 1
+
+def get_incident_selection_generation():
+    return f"{incident_selection_session}:{incident_selection_generation}"
+
+def create_incident_selection_table(conn):
+    """
+    Creates the session tables of the incident selection. They are TEMP tables of the connection: writing them
+    leaves the database file, and with it the dataset generation of the result cache, untouched.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS incident_selection (incident_id TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS incident_selection_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+@contextmanager
+def selection_transaction(conn):
+    """Runs a block rewriting the incident selection of a connection as one transaction, or within the caller's."""
+    began = not conn.in_transaction
+    if began:
+        conn.execute("BEGIN")
+    try:
+        create_incident_selection_table(conn)
+        yield conn
+        if began:
+            conn.execute("COMMIT")
+    except BaseException:
+        if began:
+            conn.execute("ROLLBACK")
+        raise
+
+def finish_incident_selection(conn):
+    """Removes the what-if exclusions from incident_selection and stores the current generation."""
+    whatif_analysis_ids = get_filter_value(WHATIF_ANALYSIS_PATH)
+    if whatif_analysis_ids:
+        conn.executemany("DELETE FROM temp.incident_selection WHERE incident_id = ?", ((incident_id,) for incident_id in whatif_analysis_ids))
+    conn.execute(
+        "INSERT OR REPLACE INTO temp.incident_selection_meta (key, value) VALUES ('generation', ?)",
+        (get_incident_selection_generation(),)
+    )
+
+def materialize_incident_selection(conn):
+    """
+    Makes the incident_selection table of the connection hold the current incident selection without the
+    what-if exclusions. The table is only rewritten when its stored generation is outdated, so queries can
+    JOIN incident_selection instead of binding the selected IDs on every call.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the incidents database, which the queries joining
+            incident_selection run on.
+    """
+    try:
+        stored = conn.execute("SELECT value FROM temp.incident_selection_meta WHERE key = 'generation'").fetchone()
+    except sqlite3.OperationalError:
+        # The tables do not exist yet
+        stored = None
+    if stored and stored[0] == get_incident_selection_generation():
+        return
+
+    with selection_transaction(conn):
+        conn.execute("DELETE FROM temp.incident_selection")
+        conn.executemany(
+            "INSERT OR IGNORE INTO temp.incident_selection (incident_id) VALUES (?)",
+            ((incident_id,) for incident_id in incident_ids_from_time_period)
+        )
+        finish_incident_selection(conn)
+
+def select_incidents_into_selection(conn, query, params=()):
+    """
+    Replaces the incident selection with the incident IDs returned by query, written with a single
+    INSERT ... SELECT.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the incidents database.
+        query (str): SELECT statement returning one incident_id column.
+        params (list): Parameters of the query.
+
+    Returns:
+        list: The selected incident IDs, including those excluded by the what-if analysis.
+    """
+    with selection_transaction(conn):
+        conn.execute("DELETE FROM temp.incident_selection")
+        conn.execute(f"INSERT OR IGNORE INTO temp.incident_selection (incident_id) {query}", params)
+        incident_ids = [row[0] for row in conn.execute("SELECT incident_id FROM temp.incident_selection")]
+        set_incident_ids_selection(incident_ids)
+        finish_incident_selection(conn)
+    return incident_ids
+
 @eel.expose
 def get_incident_compliance_metric():
     return incident_compliance_metric
@@ -275,6 +458,7 @@ def get_incident_compliance_metric():
 def set_incident_compliance_metric(selected_metric):
     global incident_compliance_metric
     incident_compliance_metric = selected_metric
+    bump_filters_generation()
     return
 
 @eel.expose
@@ -285,6 +469,7 @@ def get_compliance_metric_thresholds():
 def set_compliance_metric_thresholds(thresholds):
     global compliance_metric_thresholds
     compliance_metric_thresholds = json.loads(thresholds)
+    bump_filters_generation()
     return
 
 @eel.expose
@@ -312,6 +497,7 @@ def set_filter_compliance_metric_thresholds(metric_name, range_start, range_end)
         filter_compliance_metric_thresholds[filter_key] = (metric_name, range_start, range_end)
         print("database_filter_variables.py")
         print(f"Added filter: {filter_key}")
+    bump_filters_generation()
 
     # For debugging, print the current filters
     print("database_filter_variables.py")
@@ -329,4 +515,5 @@ def get_incident_ids_from_tabular_selection():
 def set_incident_ids_from_tabular_selection(incident_ids):
     global incident_selection_from_tabular_analysis
     incident_selection_from_tabular_analysis = incident_ids
+    bump_filters_generation()
     return
\ No newline at end of file
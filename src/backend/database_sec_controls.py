@@ -3,6 +3,7 @@ import eel
 import sqlite3
 import json
 from sqlite3 import Error
+from database_connections import get_connection, write_transaction, SECURITY_CONTROLS_DATABASE
 
 def create_connection(db_file):
     """ Create a database connection to a SQLite database in the specified directory """
@@ -60,32 +61,27 @@ def create_tables(conn):
 def insert_security_control(title, description, operator_name, status='not covered'):
     """Insert a security control into the database."""
     try:
-        database = "../data/security_controls.db"  # Path to the database file
-        conn = sqlite3.connect(database)
-
         # Ensure status is a string and has a valid value
         if not isinstance(status, str):
             raise ValueError(f"Invalid status type: {type(status)}. Expected a string.")
         if status not in ['covered', 'partially covered', 'not covered']:
             raise ValueError(f"Invalid status value: {status}. Expected one of 'covered', 'partially covered', 'not covered'.")
 
-        # Inserting into security_controls table
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO security_controls (title, description, operator_id, status) VALUES (?, ?, ?, ?)",
-            (title, description, operator_name, status)
-        )
-        control_id = cursor.lastrowid  # Fetch the last inserted id
+        # Inserting into security_controls table, committed at the end of the block or rolled back on an error
+        with write_transaction(SECURITY_CONTROLS_DATABASE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO security_controls (title, description, operator_id, status) VALUES (?, ?, ?, ?)",
+                (title, description, operator_name, status)
+            )
+            control_id = cursor.lastrowid  # Fetch the last inserted id
 
-        conn.commit()
         print("database_sec_controls.py")
         print("Security control inserted successfully.")
-        conn.close()
         return "Success"
     except sqlite3.Error as e:
         print("database_sec_controls.py")
         print(f"An error occurred: {e}")
-        conn.rollback()
         return f"Error: {e}"
     except ValueError as ve:
         print("database_sec_controls.py")
@@ -96,9 +92,7 @@ def insert_security_control(title, description, operator_name, status='not cover
 def fetch_all_security_controls():
     """Fetch and display all security controls along with their tags from the database."""
     try:
-        database = "../data/security_controls.db"
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+        cursor = get_connection(SECURITY_CONTROLS_DATABASE).cursor()
         
         sql_query = """
         SELECT sc.id, sc.title, sc.description, sc.operator_id, sc.status, sc.evidence, sc.comments
@@ -109,8 +103,6 @@ def fetch_all_security_controls():
         cursor.execute(sql_query)
         controls = cursor.fetchall()
         controls_list = [{'id': row[0], 'title': row[1], 'description': row[2], 'operator_id': row[3], 'status': row[4], 'evidence': row[5], 'comments': row[6]} for row in controls]
-        
-        conn.close()
         return json.dumps(controls_list)
     except sqlite3.Error as e:
         print("database_sec_controls.py")
@@ -121,42 +113,34 @@ def fetch_all_security_controls():
 def delete_security_control(control_id):
     """Delete a security control from the database by its ID."""
     try:
-        database = "../data/security_controls.db"
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
-        
-        # SQL command to delete the security control
-        sql_delete_control = "DELETE FROM security_controls WHERE id = ?"
-        cursor.execute(sql_delete_control, (control_id,))
-        
-        # Check if the row was deleted
-        if cursor.rowcount == 0:
-            print("database_sec_controls.py")
-            print("No such security control found with ID:", control_id)
-        else:
-            print("database_sec_controls.py")
-            print("Security control deleted successfully.")
-        
-        # Commit the changes to the database
-        conn.commit()
-
-        # Also, delete any associated tags from control_tags to maintain integrity
-        sql_delete_tags = "DELETE FROM control_tags WHERE control_id = ?"
-        cursor.execute(sql_delete_tags, (control_id,))
-        conn.commit()
-        conn.close()
+        # The control and its tags are deleted in one transaction, rolled back if an error occurs
+        with write_transaction(SECURITY_CONTROLS_DATABASE) as conn:
+            cursor = conn.cursor()
+
+            # SQL command to delete the security control
+            sql_delete_control = "DELETE FROM security_controls WHERE id = ?"
+            cursor.execute(sql_delete_control, (control_id,))
+
+            # Check if the row was deleted
+            if cursor.rowcount == 0:
+                print("database_sec_controls.py")
+                print("No such security control found with ID:", control_id)
+            else:
+                print("database_sec_controls.py")
+                print("Security control deleted successfully.")
+
+            # Also, delete any associated tags from control_tags to maintain integrity
+            sql_delete_tags = "DELETE FROM control_tags WHERE control_id = ?"
+            cursor.execute(sql_delete_tags, (control_id,))
 
     except sqlite3.Error as e:
         print("database_sec_controls.py")
         print(f"An error occurred: {e}")
-        conn.rollback()  # Roll back any changes if an error occurs
 
 @eel.expose
 def count_security_controls(security_control_status=None):
     try:
-        database = "../data/security_controls.db"  # Path to your database
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+        cursor = get_connection(SECURITY_CONTROLS_DATABASE).cursor()
         
         # SQL query to count the number of security controls
         if security_control_status:
@@ -166,7 +150,6 @@ def count_security_controls(security_control_status=None):
             
         count = cursor.fetchone()[0]
         
-        conn.close()
         return count
     except sqlite3.Error as e:
         print("database_sec_controls.py")
@@ -1,6 +1,8 @@
 import xml.etree.ElementTree as ET
 import eel
 
+from model_registry import get_compiled_model, get_mapping, invalidate_model_registry
+
 @eel.expose
 def extract_places_from_pnml():
     """
@@ -13,17 +15,8 @@ def extract_places_from_pnml():
     list of str: A list of places in the order of appearance.
     """
     try:
-        file_path = "../data/reference_model.pnml"
-
-        # Parse the XML file
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
-        # Extract all places and their names
-        places = [place.find('name/text').text if place.find('name/text') is not None else "Unnamed Place"
-                  for place in root.findall('.//place')]
-
-        return places
+        # Places and their names of the compiled reference model
+        return [name if name is not None else "Unnamed Place" for name in get_compiled_model().place_names]
     except ET.ParseError as e:
         print("database_sec_controls.py")
         print(f"Failed to parse the XML file: {e}")
@@ -56,6 +49,7 @@ def write_mapping_to_file(places, state_mapping, file_path="../data/mapping.txt"
             file.writelines(lines)
             print("database_sec_controls.py")
             print(f"Mapping successfully written to {file_path}")
+        invalidate_model_registry()
 
     except Exception as e:
         print("database_sec_controls.py")
@@ -89,17 +83,8 @@ def read_mapping_from_file(file_path="../data/mapping.txt"):
         - The dictionary can be directly consumed by JavaScript via Eel for frontend logic or visualization.
     """
     try:
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            mapping_dict = {}
-            for line in lines:
-                # Skip empty lines and braces
-                if line.strip() and line.strip() not in ["{", "}"]:
-                    # Assuming the line format is '    'place': 'code','
-                    parts = line.strip().replace("'", "").replace(",", "").split(': ')
-                    if len(parts) == 2:
-                        mapping_dict[parts[0]] = parts[1]
-        return mapping_dict
+        # Parsed once per change of the file by the model registry
+        return get_mapping(file_path)
     except FileNotFoundError:
         print("database_sec_controls.py")
         print(f"No mapping file found at {file_path}.")
@@ -0,0 +1,133 @@
+import sqlite3
+import pandas as pd
+
+from create_incidents_database import TABLE_SCHEMAS, table_columns, cast_chunk, chunk_rows, stream_csv_to_sqlite
+from prepare_incidents_table import seed_incidents, update_closed_at
+from copy_values import transfer_event_log_data
+from derive_incident_features import derive_incident_features
+from helper import INCIDENT_INDEXES
+
+def append_events_to_sqlite(csv_file, delimiter=';', database='../data/incidents.db', chunksize=100000):
+    """
+    Merges the events of a (partial) event log export into event_log_table.
+
+    The CSV is streamed in chunks into a temporary staging table. Events already present in event_log_table
+    (same incident_id, sys_updated_at and event) are skipped, so overlapping exports can be appended repeatedly.
+    If event_log_table does not exist yet, the export is loaded as a full table instead.
+
+    Args:
+        csv_file (str): Path to the CSV file with new events.
+        delimiter (str): CSV delimiter.
+        database (str): Path to the SQLite database file.
+        chunksize (int): Number of CSV rows held in memory at once.
+
+    Returns:
+        list: The incident IDs which received new events.
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        existing_columns = [row[1] for row in conn.execute("PRAGMA table_info(event_log_table)")]
+        if not existing_columns:
+            conn.close()
+            stream_csv_to_sqlite(csv_file, 'event_log_table', delimiter=delimiter, database=database, chunksize=chunksize)
+            conn = sqlite3.connect(database)
+            return [row[0] for row in conn.execute("SELECT DISTINCT incident_id FROM event_log_table")]
+
+        # The existing log is kept under the rollback journal, only the staging side is tuned
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -262144")
+
+        schema = TABLE_SCHEMAS['event_log_table']
+        reader = pd.read_csv(csv_file, delimiter=delimiter, on_bad_lines='skip', dtype=str,
+                             keep_default_na=False, na_values=[''], chunksize=chunksize)
+
+        conn.execute("BEGIN")
+        staging_columns = None
+        for chunk in reader:
+            if staging_columns is None:
+                staging_columns = table_columns(list(chunk.columns), schema)
+                columns_sql = ', '.join(f'"{column}" {column_type}'.strip() for column, column_type in staging_columns)
+                conn.execute("DROP TABLE IF EXISTS temp.staging_events")
+                conn.execute(f"CREATE TEMP TABLE staging_events ({columns_sql})")
+            chunk = cast_chunk(chunk, schema)
+            conn.executemany(f"INSERT INTO temp.staging_events VALUES ({', '.join('?' * len(chunk.columns))})", chunk_rows(chunk))
+
+        if staging_columns is None:
+            conn.execute("ROLLBACK")
+            return []
+
+        # Only events which are not yet part of the log are merged, looked up through the (incident_id, sys_updated_at) index
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_event_log_incident_time ON {INCIDENT_INDEXES['idx_event_log_incident_time']}")
+        conn.execute("""
+            DELETE FROM temp.staging_events
+            WHERE EXISTS (
+                SELECT 1 FROM event_log_table e
+                WHERE e.incident_id = staging_events.incident_id
+                  AND e.sys_updated_at = staging_events.sys_updated_at
+                  AND e.event IS staging_events.event
+            )
+        """)
+        touched_incidents = [row[0] for row in conn.execute("SELECT DISTINCT incident_id FROM temp.staging_events")]
+
+        shared_columns = ', '.join(f'"{column}"' for column, _ in staging_columns if column in existing_columns)
+        conn.execute(f"""
+            INSERT INTO event_log_table ({shared_columns})
+            SELECT {shared_columns} FROM temp.staging_events
+            ORDER BY incident_id, sys_updated_at
+        """)
+        conn.execute("DROP TABLE temp.staging_events")
+        conn.execute("COMMIT")
+
+        print("delta_ingest.py")
+        print(f"Merged new events of {len(touched_incidents)} incidents from {csv_file} into event_log_table.")
+        return touched_incidents
+
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print("delta_ingest.py")
+        print(f"An error occurred while appending events: {e}")
+        return []
+    finally:
+        conn.close()
+
+def refresh_touched_incidents(incident_ids, db_path="../data/incidents.db"):
+    """
+    Recomputes the derived columns of incidents_fa_values_table for the given incidents only.
+    Incidents without a row in incidents_fa_values_table are seeded first, with closed_at, fitness and cost,
+    and closed_at of the others is moved to their latest event.
+
+    Args:
+        incident_ids (list): Incident IDs which received new events.
+        db_path (str): Path to the SQLite database file.
+    """
+    if not incident_ids:
+        return
+
+    try:
+        seed_incidents(db_path, incident_ids)
+        update_closed_at(db_path, incident_ids)
+    except Exception as e:
+        print("delta_ingest.py")
+        print(f"An error occurred while adding new incidents: {e}")
+        return
+
+    transfer_event_log_data(db_path, incident_ids)
+    derive_incident_features(db_path, incident_ids)
+
+def ingest_event_delta(csv_file, delimiter=';', db_path="../data/incidents.db"):
+    """
+    Appends a new event log export and refreshes only the incidents it touched.
+
+    Returns:
+        list: The incident IDs which received new events.
+    """
+    touched_incidents = append_events_to_sqlite(csv_file, delimiter=delimiter, database=db_path)
+    refresh_touched_incidents(touched_incidents, db_path)
+    return touched_incidents
+
+# Example usage
+if __name__ == "__main__":
+    touched = ingest_event_delta('../data/simple_log_delta.csv')
+    print("delta_ingest.py")
+    print(f"Refreshed {len(touched)} incidents.")
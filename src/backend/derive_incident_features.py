@@ -0,0 +1,182 @@
+import sqlite3
+import json
+import time
+from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+from helper import create_incident_indexes, incident_scope
+from incident_metrics import refresh_incident_metrics, TIME_KINDS
+from quantile_sketches import refresh_quantile_sketches
+
+# Order in which the process states are expected within an incident
+STATE_ORDER = ['N', 'A', 'W', 'R', 'C']
+
+def compute_state_intervals(events):
+    """
+    Determines the first and last occurrence of each state for the ordered events of one incident.
+
+    Args:
+        events (list): (event, timestamp) tuples ordered by sys_updated_at.
+
+    Returns:
+        dict: Maps each state to a (first_occurrence, last_occurrence) tuple of timestamps, in STATE_ORDER.
+    """
+    state_intervals = {}
+    start_index = 0
+
+    for state in STATE_ORDER:
+        first_occurrence = None
+        last_occurrence = None
+        last_occurrence_index = None
+
+        for i in range(start_index, len(events)):
+            event, timestamp = events[i]
+            if event == state:
+                if first_occurrence is None:
+                    first_occurrence = timestamp
+                last_occurrence = timestamp
+                last_occurrence_index = i
+
+        if first_occurrence and last_occurrence:
+            state_intervals[state] = (first_occurrence, last_occurrence)
+            start_index = last_occurrence_index + 1
+
+    return state_intervals
+
+def minutes_between(start, end):
+    """Returns the whole minutes between two datetimes."""
+    return int((end - start).total_seconds() // 60)
+
+def compute_incident_features(events, opened_at):
+    """
+    Derives all time and variant features of one incident from its ordered events.
+
+    Args:
+        events (list): (event, datetime) tuples ordered by sys_updated_at.
+        opened_at (datetime): Earliest opened_at of the incident.
+
+    Returns:
+        dict: event_interval_minutes, transition_interval_minutes and time_to_states_last_occurrence
+              as dictionaries of minutes, and the variant as a space separated string of events.
+              None if the incident has no state intervals.
+    """
+    state_intervals = compute_state_intervals(events)
+    if not state_intervals:
+        return None
+
+    states = list(state_intervals.keys())
+    event_interval_minutes = {}
+    transition_interval_minutes = {}
+    for i, state in enumerate(states):
+        first_occurrence, last_occurrence = state_intervals[state]
+        if i + 1 < len(states):
+            next_state = states[i + 1]
+            next_first_occurrence = state_intervals[next_state][0]
+            event_interval_minutes[state] = minutes_between(first_occurrence, next_first_occurrence)
+            transition_interval_minutes[f"{state}->{next_state}"] = minutes_between(last_occurrence, next_first_occurrence)
+        else:
+            event_interval_minutes[state] = minutes_between(first_occurrence, last_occurrence)
+
+    time_to_states_last_occurrence = {
+        f"TT{state}": minutes_between(opened_at, last_occurrence)
+        for state, (_, last_occurrence) in state_intervals.items()
+    }
+
+    return {
+        'event_interval_minutes': event_interval_minutes,
+        'transition_interval_minutes': transition_interval_minutes,
+        'time_to_states_last_occurrence': time_to_states_last_occurrence,
+        'variant': ' '.join(event for event, _ in events),
+    }
+
+def derive_incident_features(db_path="../data/incidents.db", incident_ids=None):
+    """
+    Recomputes opened_at, variant, event_interval_minutes, transition_interval_minutes and
+    time_to_states_last_occurrence of incidents_fa_values_table in a single ordered scan of event_log_table.
+
+    All results are collected in a temporary table and written back with one UPDATE in one transaction,
+    together with the matching rows of the typed incident_metrics table and the quantile sketches of their days.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        incident_ids (list, optional): Restricts the derivation to these incidents. All incidents if None.
+
+    Returns:
+        int: The number of incidents for which features were derived, or None if an error occurred.
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA temp_store = MEMORY")
+        create_incident_indexes(conn)
+
+        rows = conn.execute(f"""
+            SELECT incident_id, event, sys_updated_at, opened_at
+            FROM event_log_table
+            WHERE {incident_scope(conn, incident_ids)}
+            ORDER BY incident_id, sys_updated_at
+        """)
+
+        results = []
+        for incident_id, incident_rows in groupby(rows, key=itemgetter(0)):
+            incident_rows = list(incident_rows)
+            # Events without a timestamp cannot be ordered, incidents without opened_at keep their features
+            events = [(event, datetime.fromisoformat(updated_at)) for _, event, updated_at, _ in incident_rows if updated_at is not None]
+            opened_ats = [row[3] for row in incident_rows if row[3] is not None]
+            if not opened_ats:
+                continue
+            opened_at = min(opened_ats)
+
+            features = compute_incident_features(events, datetime.fromisoformat(opened_at))
+            if features is None:
+                continue
+
+            results.append((
+                incident_id,
+                opened_at,
+                features['variant'],
+                json.dumps(features['event_interval_minutes']),
+                json.dumps(features['transition_interval_minutes']),
+                json.dumps(features['time_to_states_last_occurrence']),
+            ))
+
+        conn.execute("BEGIN")
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS derived_features (
+                incident_id TEXT PRIMARY KEY, opened_at TEXT, variant TEXT, event_interval_minutes TEXT,
+                transition_interval_minutes TEXT, time_to_states_last_occurrence TEXT
+            )
+        """)
+        conn.execute("DELETE FROM temp.derived_features")
+        conn.executemany("INSERT OR REPLACE INTO temp.derived_features VALUES (?, ?, ?, ?, ?, ?)", results)
+        conn.execute("""
+            UPDATE incidents_fa_values_table
+            SET opened_at = d.opened_at,
+                variant = d.variant,
+                event_interval_minutes = d.event_interval_minutes,
+                transition_interval_minutes = d.transition_interval_minutes,
+                time_to_states_last_occurrence = d.time_to_states_last_occurrence
+            FROM temp.derived_features AS d
+            WHERE incidents_fa_values_table.incident_id = d.incident_id
+        """)
+        refresh_incident_metrics(conn, TIME_KINDS, incident_ids)
+        refresh_quantile_sketches(conn, incident_ids)
+        conn.execute("COMMIT")
+
+        print("derive_incident_features.py")
+        print(f"Derived features for {len(results)} incidents in {time.perf_counter() - started:.2f}s.")
+        return len(results)
+
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print("derive_incident_features.py")
+        print(f"An error occurred: {e}")
+        return None
+    finally:
+        conn.close()
+
+# Example usage
+if __name__ == "__main__":
+    derive_incident_features()
@@ -1,6 +1,6 @@
-import sqlite3
 import json
 import eel
+from database_connections import get_connection, SECURITY_CONTROLS_DATABASE
 
 @eel.expose
 def get_global_progress():
@@ -8,9 +8,7 @@ def get_global_progress():
     Connects to the SQLite database and calculates the progress of security controls
     for each operator. Returns the results as a JSON object (dictionary).
     """
-    # Connect to the SQLite database
-    conn = sqlite3.connect('../data/security_controls.db')
-    cursor = conn.cursor()
+    cursor = get_connection(SECURITY_CONTROLS_DATABASE).cursor()
 
     # SQL query to calculate the progress per operator_id
     cursor.execute("""
@@ -33,9 +31,6 @@ def get_global_progress():
         operator_name = str(operator_id) if operator_id is not None else "Unassigned"
         progress_dict[operator_name] = progress
 
-    # Close the database connection
-    conn.close()
-
     # Return the dictionary (JSON object)
     return json.dumps(progress_dict)
 
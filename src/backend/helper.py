@@ -1,29 +1,55 @@
 import sqlite3
 
-def update_incidents_with_opened_at(db_path="../data/incidents.db"):
+# Indexes needed by the preparation steps which join event_log_table, incident_alignment_table and incidents_fa_values_table
+INCIDENT_INDEXES = {
+    'idx_event_log_incident_time': 'event_log_table (incident_id, sys_updated_at)',
+    'idx_incident_alignment_incident': 'incident_alignment_table (incident_id)',
+    'idx_incidents_fa_incident': 'incidents_fa_values_table (incident_id)',
+}
+
+def create_incident_indexes(conn):
+    """
+    Creates the indexes in INCIDENT_INDEXES if they do not exist yet.
+    """
+    for index_name, index_target in INCIDENT_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {index_target}")
+
+def incident_scope(conn, incident_ids, column="incident_id"):
+    """
+    Returns a SQL condition restricting column to the given incident IDs.
+    The IDs are loaded into a temporary table of the connection, so the condition has no variable limit.
+    If incident_ids is None, the condition matches all incidents.
+    """
+    if incident_ids is None:
+        return "1 = 1"
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS scoped_incident_ids (incident_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.scoped_incident_ids")
+    conn.executemany("INSERT OR IGNORE INTO temp.scoped_incident_ids VALUES (?)", [(i,) for i in incident_ids])
+    return f"{column} IN (SELECT incident_id FROM temp.scoped_incident_ids)"
+
+def update_incidents_with_opened_at(db_path="../data/incidents.db", incident_ids=None):
     """
     Update the incidents_fa_values_table with the earliest opened_at value from the event_log_table.
+    If incident_ids is given, only these incidents are updated.
     """
     try:
         # Connect to the database
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
-        # Fetch the earliest opened_at time for each incident_id from event_log_table
-        cursor.execute("""
-            SELECT incident_id, MIN(opened_at) AS earliest_opened_at
-            FROM event_log_table
-            GROUP BY incident_id
+        # Update every incident with the earliest opened_at time of its events in one statement
+        scope = incident_scope(conn, incident_ids)
+        cursor.execute(f"""
+            UPDATE incidents_fa_values_table
+            SET opened_at = e.earliest_opened_at
+            FROM (
+                SELECT incident_id, MIN(opened_at) AS earliest_opened_at
+                FROM event_log_table
+                WHERE {scope}
+                GROUP BY incident_id
+            ) AS e
+            WHERE incidents_fa_values_table.incident_id = e.incident_id
         """)
-        incident_opened_times = cursor.fetchall()
-
-        # Update the incidents_fa_values_table with the earliest opened_at time
-        for incident_id, earliest_opened_at in incident_opened_times:
-            cursor.execute("""
-                UPDATE incidents_fa_values_table
-                SET opened_at = ?
-                WHERE incident_id = ?
-            """, (earliest_opened_at, incident_id))
 
         # Commit the changes and close the connection
         conn.commit()
@@ -37,7 +63,7 @@ def update_incidents_with_opened_at(db_path="../data/incidents.db"):
         print("helper.py")
         print(f"An error occurred: {e}")
 
-def copy_deviation_columns(db_path="../data/incidents.db"):
+def copy_deviation_columns(db_path="../data/incidents.db", incident_ids=None):
     """
     Copies the content of the 'missing', 'repetition', and 'mismatch' columns from the 
     'incident_alignment_table' into the 'missing_deviation', 'repetition_deviation', and 
@@ -45,47 +71,52 @@ def copy_deviation_columns(db_path="../data/incidents.db"):
     
     Args:
         db_path (str): Path to the SQLite database file.
+        incident_ids (list, optional): Restricts the copy to these incidents. All incidents if None.
+
+    Returns:
+        int: The number of updated incidents, or None if an error occurred.
     """
+    conn = None
     try:
         # Connect to the SQLite database
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
-        # SQL query to update the incidents_fa_values_table
-        update_query = """
+        # SQL query to update the incidents_fa_values_table from a single join with the alignments
+        scope = incident_scope(conn, incident_ids, "a.incident_id")
+        update_query = f"""
         UPDATE incidents_fa_values_table
         SET 
-            missing_deviation = (
-                SELECT missing 
-                FROM incident_alignment_table 
-                WHERE incident_alignment_table.incident_id = incidents_fa_values_table.incident_id
-            ),
-            repetition_deviation = (
-                SELECT repetition 
-                FROM incident_alignment_table 
-                WHERE incident_alignment_table.incident_id = incidents_fa_values_table.incident_id
-            ),
-            mismatch_deviation = (
-                SELECT mismatch 
-                FROM incident_alignment_table 
-                WHERE incident_alignment_table.incident_id = incidents_fa_values_table.incident_id
-            )
+            missing_deviation = a.missing,
+            repetition_deviation = a.repetition,
+            mismatch_deviation = a.mismatch
+        FROM incident_alignment_table AS a
+        WHERE a.incident_id = incidents_fa_values_table.incident_id
+          AND {scope}
         """
 
         # Execute the update query
         cursor.execute(update_query)
+        updated_incidents = cursor.rowcount
+
+        # Keep the typed per-state deviation values in sync, imported here as incident_metrics builds on this module
+        from incident_metrics import refresh_incident_metrics, DEVIATION_KINDS
+        refresh_incident_metrics(conn, DEVIATION_KINDS, incident_ids)
 
         # Commit the changes
         conn.commit()
         print("helper.py")
         print("Deviation columns updated successfully.")
+        return updated_incidents
 
     except Exception as e:
         print("helper.py")
         print(f"An error occurred: {e}")
+        return None
     finally:
         # Close the database connection
-        conn.close()
+        if conn:
+            conn.close()
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import sqlite3
+
+from helper import incident_scope
+
+# Per-state metric columns of incidents_fa_values_table and the kind under which their values are stored
+# in incident_metrics. The time_to_states_last_occurrence keys carry a 'TT' prefix which is stripped.
+METRIC_COLUMNS = {
+    'event_interval_minutes': 'event_interval',
+    'transition_interval_minutes': 'transition_interval',
+    'time_to_states_last_occurrence': 'time_to_last',
+    'missing_deviation': 'missing',
+    'repetition_deviation': 'repetition',
+    'mismatch_deviation': 'mismatch',
+}
+
+TIME_KINDS = ['event_interval', 'transition_interval', 'time_to_last']
+DEVIATION_KINDS = ['missing', 'repetition', 'mismatch']
+
+INCIDENT_METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS incident_metrics (
+    incident_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    value NUMERIC,
+    PRIMARY KEY (kind, state, incident_id)
+) WITHOUT ROWID
+"""
+
+# Compatibility view exposing the metrics in the JSON layout of the original columns
+INCIDENT_METRICS_JSON_VIEW = """
+CREATE VIEW IF NOT EXISTS incident_metrics_json AS
+SELECT
+    incident_id,
+    json_group_object(state, value) FILTER (WHERE kind = 'event_interval') AS event_interval_minutes,
+    json_group_object(state, value) FILTER (WHERE kind = 'transition_interval') AS transition_interval_minutes,
+    json_group_object('TT' || state, value) FILTER (WHERE kind = 'time_to_last') AS time_to_states_last_occurrence,
+    json_group_object(state, value) FILTER (WHERE kind = 'missing') AS missing_deviation,
+    json_group_object(state, value) FILTER (WHERE kind = 'repetition') AS repetition_deviation,
+    json_group_object(state, value) FILTER (WHERE kind = 'mismatch') AS mismatch_deviation
+FROM incident_metrics
+GROUP BY incident_id
+"""
+
+# Incremented whenever incident_metrics is rebuilt, so that data derived from it can be cached until then
+incident_metrics_generation = 0
+
+def get_incident_metrics_generation():
+    return incident_metrics_generation
+
+def create_incident_metrics_table(conn):
+    """Creates the incident_metrics table, its incident index and the incident_metrics_json view."""
+    conn.execute(INCIDENT_METRICS_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_incident_metrics_incident ON incident_metrics (incident_id)")
+    conn.execute(INCIDENT_METRICS_JSON_VIEW)
+
+def refresh_incident_metrics(conn, kinds, incident_ids=None):
+    """
+    Rebuilds the incident_metrics rows of the given kinds from the per-state columns of incidents_fa_values_table.
+    The JSON and Python-literal strings are expanded in SQL with json_each, there is no per-row parsing in Python.
+    The caller commits.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the incidents database.
+        kinds (list): Metric kinds to rebuild, values of METRIC_COLUMNS.
+        incident_ids (list, optional): Restricts the rebuild to these incidents. All incidents if None.
+    """
+    global incident_metrics_generation
+    create_incident_metrics_table(conn)
+    scope = incident_scope(conn, incident_ids)
+    source_scope = incident_scope(conn, incident_ids, "f.incident_id")
+    for column, kind in METRIC_COLUMNS.items():
+        if kind not in kinds:
+            continue
+        key = "substr(j.key, 3)" if kind == 'time_to_last' else "j.key"
+        conn.execute(f"DELETE FROM incident_metrics WHERE kind = ? AND {scope}", (kind,))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO incident_metrics (incident_id, kind, state, value)
+            SELECT f.incident_id, ?, {key}, j.value
+            FROM incidents_fa_values_table AS f, json_each(replace(f.{column}, '''', '"')) AS j
+            WHERE f.{column} IS NOT NULL AND json_valid(replace(f.{column}, '''', '"'))
+              AND {source_scope}
+        """, (kind,))
+    incident_metrics_generation += 1
+
+def migrate_incident_metrics(db_path="../data/incidents.db"):
+    """
+    Migrates all per-state metric columns of incidents_fa_values_table into the typed incident_metrics table.
+    """
+    try:
+        conn = sqlite3.connect(db_path)
+        refresh_incident_metrics(conn, list(METRIC_COLUMNS.values()))
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM incident_metrics").fetchone()[0]
+        conn.close()
+        print("incident_metrics.py")
+        print(f"Migrated {count} metric values into incident_metrics.")
+    except Exception as e:
+        print("incident_metrics.py")
+        print(f"An error occurred: {e}")
+
+# Run the migration
+if __name__ == "__main__":
+    migrate_incident_metrics()
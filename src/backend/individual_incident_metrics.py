@@ -1,14 +1,16 @@
-import sqlite3
 import pandas as pd
 import eel
-import json
 from database_filter_variables import get_incident_compliance_metric, get_incident_ids_from_tabular_selection
+from result_cache import cached_endpoint
+from payload_encoding import encodable_endpoint
+from database_connections import get_connection
 
 @eel.expose
+@cached_endpoint
 def calculate_individual_averages(db_path="../data/incidents.db"):
     """
     Fetches selected incidents from 'incident_ids_from_tabular_selection',
-    queries the 'incidents_fa_values_table' to retrieve the compliance metric values, TTR (time_to_states_last_occurrence),
+    queries the 'incidents_fa_values_table' to retrieve the compliance metric values, TTR (from incident_metrics),
     and SLA compliance, and returns the averages and percentage of incidents that made the SLA.
 
     Args:
@@ -19,7 +21,7 @@ def calculate_individual_averages(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
 
         # Fetch the selected incident IDs from 'incident_ids_from_tabular_selection'
         incident_ids = get_incident_ids_from_tabular_selection()  # Directly use the list
@@ -30,9 +32,13 @@ def calculate_individual_averages(db_path="../data/incidents.db"):
         # Get the compliance metric column name
         compliance_metric = get_incident_compliance_metric()
 
-        # Query the database for the compliance metric values, time_to_states_last_occurrence (TTR), and made_sla values
+        # Query the database for the compliance metric values, the TTR from incident_metrics and made_sla values
         query = f"""
-        SELECT {compliance_metric}, time_to_states_last_occurrence, made_sla
+        SELECT {compliance_metric},
+               (SELECT m.value FROM incident_metrics m
+                WHERE m.kind = 'time_to_last' AND m.state = 'R'
+                  AND m.incident_id = incidents_fa_values_table.incident_id) AS TTR,
+               made_sla
         FROM incidents_fa_values_table
         WHERE incident_id IN ({','.join(['?'] * len(incident_ids))})
         """
@@ -43,13 +49,6 @@ def calculate_individual_averages(db_path="../data/incidents.db"):
         if df.empty:
             return {"error": "No matching incidents found"}
 
-        # Extract the TTR values from the time_to_states_last_occurrence column
-        def extract_ttr(time_to_states):
-            time_to_states_dict = json.loads(time_to_states)
-            return time_to_states_dict.get("TTR", None)  # Get the TTR value, or None if it doesn't exist
-
-        df["TTR"] = df["time_to_states_last_occurrence"].apply(extract_ttr)
-
         # Calculate the averages
         avg_compliance_metric = df[compliance_metric].mean()
         avg_ttr = df["TTR"].mean()
@@ -85,11 +84,9 @@ def calculate_individual_averages(db_path="../data/incidents.db"):
         print(f"An error occurred: {e}")
         return {"error": str(e)}
 
-    finally:
-        # Close the database connection
-        conn.close()
-
 @eel.expose
+@encodable_endpoint
+@cached_endpoint
 def get_incident_event_intervals(db_path="../data/incidents.db"):
     """
     Fetches selected incidents from 'incident_ids_from_tabular_selection',
@@ -104,7 +101,7 @@ def get_incident_event_intervals(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
 
         # Fetch the selected incident IDs from 'incident_ids_from_tabular_selection'
         incident_ids = get_incident_ids_from_tabular_selection()  # Directly use the list
@@ -135,10 +132,6 @@ def get_incident_event_intervals(db_path="../data/incidents.db"):
         print(f"An error occurred: {e}")
         return {"error": str(e)}
 
-    finally:
-        # Close the database connection
-        conn.close()
-
 # Example usage
 if __name__ == "__main__":
     averages = calculate_individual_averages()
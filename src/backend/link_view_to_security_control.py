@@ -7,6 +7,7 @@ import string
 import json
 from google import genai
 from api_keys import GEMINI_API_KEY
+from database_connections import get_connection, write_transaction
 
 def get_gemini_summary(comments):
     prompt = (
@@ -71,41 +72,38 @@ def save_screenshot_and_link_to_control(screenshot_data, name, comments, control
         # Generate AI summary from comments
         ai_summary = get_gemini_summary(comments)
         
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Insert the filename and comments into the assessment_views table
-        cursor.execute("""
-            INSERT INTO assessment_views (view_data, comments, ai_summary) 
-            VALUES (?, ?, ?)
-        """, (filename, comments, ai_summary))
-
-        # Fetch the ID of the newly inserted assessment view
-        assessment_view_id = cursor.lastrowid
-
-        # Fetch the current evidence value for the security control
-        cursor.execute("SELECT evidence FROM security_controls WHERE id = ?", (control_id,))
-        result = cursor.fetchone()
-        current_evidence = result[0] if result else ""
-
-        # Append the new filename to the current evidence, separating by ';' if necessary
-        if current_evidence:
-            updated_evidence = current_evidence + ";" + filename
-        else:
-            updated_evidence = filename
+        # Insert the view and update the control in one transaction of the writer, committed at the end of the block
+        with write_transaction(db_path) as conn:
+            cursor = conn.cursor()
+
+            # Insert the filename and comments into the assessment_views table
+            cursor.execute("""
+                INSERT INTO assessment_views (view_data, comments, ai_summary) 
+                VALUES (?, ?, ?)
+            """, (filename, comments, ai_summary))
+
+            # Fetch the ID of the newly inserted assessment view
+            assessment_view_id = cursor.lastrowid
+
+            # Fetch the current evidence value for the security control
+            cursor.execute("SELECT evidence FROM security_controls WHERE id = ?", (control_id,))
+            result = cursor.fetchone()
+            current_evidence = result[0] if result else ""
+
+            # Append the new filename to the current evidence, separating by ';' if necessary
+            if current_evidence:
+                updated_evidence = current_evidence + ";" + filename
+            else:
+                updated_evidence = filename
 
-        # Update the evidence and status fields in the security_controls table
-        cursor.execute("""
-            UPDATE security_controls 
-            SET evidence = ?, status = ?
-            WHERE id = ?
-        """, (updated_evidence, status, control_id))
+            # Update the evidence and status fields in the security_controls table
+            cursor.execute("""
+                UPDATE security_controls 
+                SET evidence = ?, status = ?
+                WHERE id = ?
+            """, (updated_evidence, status, control_id))
 
-        # Commit the transaction and close the connection
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.close()
 
         # Return the ID of the newly inserted assessment view and the filename
         return {"assessment_view_id": assessment_view_id, "filename": filename}
@@ -128,17 +126,12 @@ def fetch_all_assessment_views(db_path="../data/security_controls.db"):
         str: A JSON string containing the assessment view data (ID, image filename, base64-encoded image, comments).
     """
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        cursor = get_connection(db_path).cursor()
 
         # Fetch all entries from the assessment_views table
         cursor.execute("SELECT id, view_data, comments, ai_summary FROM assessment_views")
         views = cursor.fetchall()
 
-        # Close the database connection
-        conn.close()
-
         # Prepare the list to hold the assessment view data
         assessment_views_list = []
 
@@ -189,40 +182,35 @@ def remove_assessment_view(view_id, db_path="../data/security_controls.db"):
         str: A success message or error message.
     """
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch the filename of the assessment view to be removed
-        cursor.execute("SELECT view_data FROM assessment_views WHERE id = ?", (view_id,))
-        result = cursor.fetchone()
-        if not result:
-            raise ValueError(f"No assessment view found with ID {view_id}")
-        image_filename = result[0]
-
-        # Delete the assessment view from the assessment_views table
-        cursor.execute("DELETE FROM assessment_views WHERE id = ?", (view_id,))
-
-        # Update the evidence field in the security_controls table
-        cursor.execute("SELECT id, evidence FROM security_controls")
-        controls = cursor.fetchall()
-        for control_id, evidence in controls:
-            if evidence:
-                # Remove the reference to the deleted view from the evidence field
-                updated_evidence = ";".join(
-                    [e.strip() for e in evidence.split(";") if e.strip() != image_filename]
-                )
-                cursor.execute(
-                    "UPDATE security_controls SET evidence = ? WHERE id = ?",
-                    (updated_evidence, control_id),
-                )
+        # Remove the view and its evidence references in one transaction of the writer
+        with write_transaction(db_path) as conn:
+            cursor = conn.cursor()
 
-        # Commit the transaction
-        conn.commit()
+            # Fetch the filename of the assessment view to be removed
+            cursor.execute("SELECT view_data FROM assessment_views WHERE id = ?", (view_id,))
+            result = cursor.fetchone()
+            if not result:
+                raise ValueError(f"No assessment view found with ID {view_id}")
+            image_filename = result[0]
+
+            # Delete the assessment view from the assessment_views table
+            cursor.execute("DELETE FROM assessment_views WHERE id = ?", (view_id,))
+
+            # Update the evidence field in the security_controls table
+            cursor.execute("SELECT id, evidence FROM security_controls")
+            controls = cursor.fetchall()
+            for control_id, evidence in controls:
+                if evidence:
+                    # Remove the reference to the deleted view from the evidence field
+                    updated_evidence = ";".join(
+                        [e.strip() for e in evidence.split(";") if e.strip() != image_filename]
+                    )
+                    cursor.execute(
+                        "UPDATE security_controls SET evidence = ? WHERE id = ?",
+                        (updated_evidence, control_id),
+                    )
 
-        # Close the database connection
-        cursor.close()
-        conn.close()
+            cursor.close()
 
         # Remove the image file from the filesystem
         save_directory = '../assessment_results'
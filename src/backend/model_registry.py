@@ -0,0 +1,146 @@
+import os
+import hashlib
+import threading
+import xml.etree.ElementTree as ET
+
+DEFAULT_PNML_PATH = "../data/reference_model.pnml"
+DEFAULT_MAPPING_PATH = "../data/mapping.txt"
+
+def local_name(element):
+    """Returns the tag of an XML element without its namespace."""
+    return element.tag.rsplit('}', 1)[-1]
+
+def element_text(element):
+    """Returns the first non-empty <text> below an element, e.g. of <name><text>, or None."""
+    for child in element.iter():
+        if local_name(child) == 'text' and child.text and child.text.strip():
+            return child.text.strip()
+    return None
+
+def parse_mapping(text):
+    """Parses the content of mapping.txt, lines of the form "    'place': 'code',", into a dictionary."""
+    mapping = {}
+    for line in text.splitlines():
+        # Skip empty lines and braces
+        if line.strip() and line.strip() not in ["{", "}"]:
+            parts = line.strip().replace("'", "").replace(",", "").split(': ')
+            if len(parts) == 2:
+                mapping[parts[0]] = parts[1]
+    return mapping
+
+def file_signature(path):
+    """Returns the modification time and size of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+class CompiledModel:
+    """
+    The reference model and the place mapping, parsed once per version of the two files.
+
+    Attributes:
+        version (str): SHA-256 of the PNML and mapping contents.
+        raw_xml (str): The PNML file content.
+        mapping (dict): Place names to state codes.
+        place_ids, place_names (list): Id and name of each place in document order, None for unnamed places.
+        transition_ids, transition_names (list): Id and name of each transition in document order.
+        state_codes (list): State codes of the mapped places in place order.
+    """
+
+    def __init__(self, pnml_path, raw_xml, mapping, mapping_text):
+        self.pnml_path = pnml_path
+        self.raw_xml = raw_xml
+        self.mapping = mapping
+        self.version = hashlib.sha256(raw_xml.encode() + b'\0' + mapping_text.encode()).hexdigest()
+
+        root = ET.fromstring(raw_xml)
+        places = [element for element in root.iter() if local_name(element) == 'place']
+        transitions = [element for element in root.iter() if local_name(element) == 'transition']
+        self.place_ids = [place.get('id') for place in places]
+        self.place_names = [element_text(place) for place in places]
+        self.transition_ids = [transition.get('id') for transition in transitions]
+        self.transition_names = [element_text(transition) for transition in transitions]
+        self.state_codes = list(dict.fromkeys(mapping[name] for name in self.place_names if name in mapping))
+        self._reference_model = None
+        self._lock = threading.Lock()
+
+    @property
+    def reference_model(self):
+        """The ReferenceModel (places, transitions, incidence matrices) for replay and alignments, compiled on first use."""
+        with self._lock:
+            if self._reference_model is None:
+                # Imported here as token_replay builds on this module
+                from token_replay import compile_reference_model
+                self._reference_model = compile_reference_model(self.pnml_path, self.mapping)
+            return self._reference_model
+
+    @property
+    def incidence(self):
+        """The incidence matrix (transitions x places) of the reference model."""
+        return self.reference_model.post - self.reference_model.pre
+
+    def __repr__(self):
+        return f"CompiledModel({len(self.place_ids)} places, {len(self.transition_ids)} transitions, version {self.version[:12]})"
+
+# Compiled models and mappings per absolute file path with the file signatures they were read with
+model_registry = {}
+mapping_registry = {}
+registry_lock = threading.Lock()
+
+def read_text(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+def get_mapping(mapping_path=DEFAULT_MAPPING_PATH):
+    """
+    Returns the place mapping of mapping_path, parsed once per change of the file.
+
+    Raises:
+        FileNotFoundError: If the mapping file does not exist.
+    """
+    path = os.path.abspath(mapping_path)
+    signature = file_signature(path)
+    with registry_lock:
+        entry = mapping_registry.get(path)
+        if entry is None or entry[0] != signature:
+            text = read_text(path)
+            entry = (signature, parse_mapping(text), text)
+            mapping_registry[path] = entry
+    return dict(entry[1])
+
+def get_compiled_model(pnml_path=DEFAULT_PNML_PATH, mapping_path=DEFAULT_MAPPING_PATH):
+    """
+    Returns the CompiledModel of the PNML and mapping files. The files are only read again when their
+    modification time or size changed, and the model is only recompiled when their content changed.
+    A missing mapping file is an empty mapping.
+
+    Raises:
+        FileNotFoundError: If the PNML file does not exist.
+    """
+    pnml = os.path.abspath(pnml_path)
+    mapping_file = os.path.abspath(mapping_path)
+    signature = (file_signature(pnml), file_signature(mapping_file))
+    key = (pnml, mapping_file)
+    with registry_lock:
+        entry = model_registry.get(key)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+
+    raw_xml = read_text(pnml)
+    mapping_text = read_text(mapping_file) if signature[1] is not None else ''
+    model = CompiledModel(pnml, raw_xml, parse_mapping(mapping_text), mapping_text)
+    with registry_lock:
+        entry = model_registry.get(key)
+        if entry is not None and entry[1].version == model.version:
+            # Same content with a new signature, e.g. a touched file: keep the compiled model
+            model = entry[1]
+        model_registry[key] = (signature, model)
+    return model
+
+def invalidate_model_registry():
+    """Drops all compiled models and mappings, called whenever the reference model or the mapping is written."""
+    with registry_lock:
+        model_registry.clear()
+        mapping_registry.clear()
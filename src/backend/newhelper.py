@@ -1,5 +1,5 @@
-import sqlite3
 import json
+from database_connections import get_connection
 
 def convert_minutes_to_days_hours_minutes(minutes):
     """
@@ -26,7 +26,7 @@ def get_mean_cost_total_and_state_times(db_path="../data/incidents.db"):
         ]
 
         # Connect to the database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
         # Convert the list of excluded incident IDs into a format suitable for the SQL query
@@ -43,9 +43,8 @@ def get_mean_cost_total_and_state_times(db_path="../data/incidents.db"):
         cursor.execute(query, excluded_incident_ids)
         results = cursor.fetchall()
 
-        # Close the cursor and connection
+        # Close the cursor
         cursor.close()
-        conn.close()
 
         # If no results, return a message
         if not results:
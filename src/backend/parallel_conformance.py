@@ -0,0 +1,125 @@
+import os
+import heapq
+import time
+import threading
+import multiprocessing
+import eel
+from concurrent.futures import ProcessPoolExecutor
+
+from alignments import Aligner, MoveCosts, align_variant
+from token_replay import replay_variant
+
+# Number of chunks per worker process: enough to balance uneven chunks, few enough to keep the overhead low
+CHUNKS_PER_WORKER = 4
+
+# Seconds between two checks for finished chunks, during which the Eel hub serves other calls
+POLL_INTERVAL = 0.1
+
+# Progress of the running conformance check, polled by the frontend through get_conformance_progress
+conformance_progress = {"method": None, "done": 0, "total": 0, "started": None, "finished": None}
+conformance_progress_lock = threading.Lock()
+
+def balanced_chunks(variants, chunk_count):
+    """
+    Splits variants into chunk_count chunks of about equal work. The work of a variant is estimated by its
+    number of events, variants are assigned longest first to the chunk with the least work so far.
+
+    Returns:
+        list: Non-empty lists of variants.
+    """
+    chunks = [[] for _ in range(max(1, chunk_count))]
+    loads = [(0, index) for index in range(len(chunks))]
+    for variant in sorted(variants, key=lambda variant: len(variant.split()), reverse=True):
+        load, index = heapq.heappop(loads)
+        chunks[index].append(variant)
+        heapq.heappush(loads, (load + len(variant.split()) + 1, index))
+    return [chunk for chunk in chunks if chunk]
+
+# The model and engine of a worker process, set once by init_worker
+worker_method = None
+worker_model = None
+worker_aligner = None
+worker_model_only_cost = None
+
+def init_worker(method, model, cost_function):
+    """Receives the compiled model once per worker process and prepares the engine."""
+    global worker_method, worker_model, worker_aligner, worker_model_only_cost
+    worker_method = method
+    worker_model = model
+    if method == 'alignment':
+        worker_aligner = Aligner(model, MoveCosts(cost_function))
+        worker_model_only_cost = worker_aligner.align([])[1]
+
+def check_chunk(variants):
+    """Runs the conformance check of the worker on a chunk of variants, returns (variant, result) tuples."""
+    if worker_method == 'alignment':
+        return [(variant, align_variant(worker_aligner, variant, worker_model_only_cost)) for variant in variants]
+    return [(variant, replay_variant(worker_model, variant.split())) for variant in variants]
+
+def update_progress(**values):
+    with conformance_progress_lock:
+        conformance_progress.update(values)
+
+def run_conformance(method, model, cost_function, variants, on_results, max_workers=None):
+    """
+    Checks the conformance of variants in a process pool and streams the results back chunk by chunk.
+
+    The variants are split into balanced chunks by trace length. The compiled model is shipped once to
+    each worker through the pool initializer, only variant strings and results cross the process boundary.
+    on_results is called in the calling process with the (variant, result) tuples of every finished chunk,
+    so results can be written in batches while the other chunks are still running. While waiting for the
+    chunks the Eel hub keeps serving calls, e.g. get_conformance_progress.
+
+    Args:
+        method (str): 'alignment' (alignments.align_variant) or 'replay' (token_replay.replay_variant).
+        model (ReferenceModel): The compiled reference model.
+        cost_function (dict): Cost function of the alignment moves, unused for replay.
+        variants (list): Variant strings to check.
+        on_results (callable): Receives the list of (variant, result) tuples of each finished chunk.
+        max_workers (int, optional): Number of worker processes, the number of CPUs by default.
+
+    Returns:
+        int: The number of checked variants.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = balanced_chunks(variants, max_workers * CHUNKS_PER_WORKER)
+    update_progress(method=method, done=0, total=len(variants), started=time.time(), finished=None)
+
+    done = 0
+    if chunks:
+        # Spawned workers do not inherit the state of the Eel/gevent event loop
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(chunks)), mp_context=context,
+                                 initializer=init_worker, initargs=(method, model, cost_function)) as executor:
+            pending = {executor.submit(check_chunk, chunk) for chunk in chunks}
+            while pending:
+                # Eel is not monkey patched: blocking on the futures would stall the hub, and with it
+                # get_conformance_progress, until the whole run ends. Poll and sleep cooperatively instead.
+                finished = [future for future in pending if future.done()]
+                if not finished:
+                    eel.sleep(POLL_INTERVAL)
+                    continue
+                for future in finished:
+                    pending.remove(future)
+                    results = future.result()
+                    on_results(results)
+                    done += len(results)
+                    update_progress(done=done)
+                    eel.sleep(0)
+
+    update_progress(finished=time.time())
+    print("parallel_conformance.py")
+    print(f"Checked {done} variants with {method} in {len(chunks)} chunks.")
+    return done
+
+@eel.expose
+def get_conformance_progress():
+    """
+    Returns the progress of the running or last conformance check.
+
+    Returns:
+        dict: method ('alignment' or 'replay'), done and total number of variants, and the started and
+              finished timestamps (seconds since the epoch, finished is None while running).
+    """
+    with conformance_progress_lock:
+        return dict(conformance_progress)
@@ -0,0 +1,118 @@
+import base64
+import gc
+import json
+import math
+import zlib
+import eel
+
+from result_cache import cached_endpoint
+
+# Encodings of get_encoded_payload: 'columnar' for column arrays with dictionary-encoded strings, 'columnar+zlib'
+# for the same payload compressed and base64 encoded. src/payload_encoding.js decodes both.
+ENCODINGS = ['columnar', 'columnar+zlib']
+
+# String columns with at most this share of distinct values are sent as a dictionary and integer codes
+DICTIONARY_RATIO = 0.5
+
+# zlib level of 'columnar+zlib': the columns compress well already at the fastest levels
+COMPRESSION_LEVEL = 1
+
+# Endpoints returning lists of rows which get_encoded_payload can encode, by name
+encodable_endpoints = {}
+
+def encodable_endpoint(function):
+    """Registers an endpoint for get_encoded_payload. Apply between @eel.expose and @cached_endpoint."""
+    encodable_endpoints[function.__name__] = function
+    return function
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def encode_column(values):
+    """
+    Encodes the values of one column as {'values': [...]}, or as {'dictionary': [...], 'codes': [...]} if they are
+    strings repeating often enough. Missing values, None or NaN, are sent as null, as JSON has no NaN.
+    """
+    try:
+        distinct = dict.fromkeys(values)
+    except TypeError:
+        # Unhashable values, e.g. lists, are sent as they are
+        return {'values': values}
+    if len(distinct) <= DICTIONARY_RATIO * len(values) and all(isinstance(value, str) or is_missing(value) for value in distinct):
+        codes = {value: code for code, value in enumerate(distinct)}
+        return {
+            'dictionary': [None if is_missing(value) else value for value in distinct],
+            'codes': list(map(codes.__getitem__, values))
+        }
+    if any(isinstance(value, float) and math.isnan(value) for value in distinct):
+        return {'values': [None if is_missing(value) else value for value in values]}
+    return {'values': values}
+
+def encode_columnar(rows):
+    """
+    Transposes a list of rows, dictionaries or sequences, into one encoded column per field.
+
+    Returns:
+        dict: {'length': <number of rows>, 'names': <field names, None for sequences>, 'columns': [...]}
+    """
+    if rows and isinstance(rows[0], dict):
+        names = list(dict.fromkeys(name for row in rows for name in row))
+        columns = [[row.get(name) for row in rows] for name in names]
+    else:
+        names = None
+        columns = [list(column) for column in zip(*rows)]
+    return {'length': len(rows), 'names': names, 'columns': [encode_column(column) for column in columns]}
+
+def encode_payload(result, encoding="columnar"):
+    """
+    Encodes the result of an endpoint. Lists of rows (also as a JSON string) are encoded column by column, any other
+    result, e.g. {'error': ...}, is passed on as it is.
+
+    Returns:
+        dict: {'encoding': 'columnar', ...encode_columnar(rows)}, {'encoding': 'columnar+zlib', 'data': <base64>}
+              or {'encoding': 'json', 'data': <result>}.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding '{encoding}', expected one of {', '.join(ENCODINGS)}.")
+    rows = json.loads(result) if isinstance(result, str) else result
+    if not isinstance(rows, list):
+        return {'encoding': 'json', 'data': result}
+
+    # The encoding allocates millions of short-lived objects, none of them cyclic: collecting during it is wasted time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        payload = encode_columnar(rows)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if encoding == 'columnar+zlib':
+        compressed = zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), COMPRESSION_LEVEL)
+        return {'encoding': encoding, 'data': base64.b64encode(compressed).decode('ascii')}
+    return {'encoding': encoding, **payload}
+
+@eel.expose
+@cached_endpoint
+def get_encoded_payload(endpoint, encoding="columnar", args=()):
+    """
+    Calls a registered endpoint and returns its rows column by column instead of one dictionary per row, so field
+    names are sent once and repeated strings once per column. Decode the result with decodePayload of
+    src/payload_encoding.js, which returns the rows as the endpoint would (parsed, for endpoints returning JSON).
+
+    Args:
+        endpoint (str): Name of an endpoint registered with @encodable_endpoint, e.g. 'get_tabular_incidents_entries'.
+        encoding (str): 'columnar' or 'columnar+zlib'.
+        args (list): Positional arguments of the endpoint.
+
+    Returns:
+        dict: The encoded payload (see encode_payload), or {'error': <error_message>}.
+    """
+    try:
+        if endpoint not in encodable_endpoints:
+            raise ValueError(f"The endpoint '{endpoint}' cannot be encoded.")
+        return encode_payload(encodable_endpoints[endpoint](*args), encoding)
+
+    except Exception as e:
+        print("payload_encoding.py")
+        print(f"An error occurred: {e}")
+        return {'error': str(e)}
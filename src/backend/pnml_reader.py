@@ -1,7 +1,6 @@
-import os
 import eel
-import json
-import xml.etree.ElementTree as ET
+
+from model_registry import get_compiled_model
 
 @eel.expose
 def get_pnml_data():
@@ -22,15 +21,7 @@ def get_pnml_data():
         - The string can be parsed using XML libraries to extract specific elements or attributes as needed.
     """
     try:
-        # Define the path for the data directory and file
-        data_dir = os.path.abspath(os.path.join(os.getcwd(), '..', 'data'))
-        file_path = os.path.join(data_dir, 'reference_model.pnml')
-
-        # Read the file content
-        with open(file_path, 'r') as file:
-            pnml_data = file.read()
-        
-        return pnml_data
+        return get_compiled_model().raw_xml
     except Exception as e:
         print("pnml_reader.py")
         print(f"Error reading file: {e}")
@@ -43,74 +34,12 @@ def get_pnml_states():
     Extracts all the states (places) from the PNML file and returns them as a list.
     """
     try:
-        # Define the path for the data directory and file
-        data_dir = os.path.abspath(os.path.join(os.getcwd(), '..', 'data'))
-        file_path = os.path.join(data_dir, 'reference_model.pnml')
-
-        # Check if the file exists
-        if not os.path.exists(file_path):
-            print("pnml_reader.py")
-            print(f"File not found: {file_path}")
-            return "Error: File not found"
-
-        # Parse the PNML file using ElementTree
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
-        # Debug: print root element and its children
-        print("pnml_reader.py")
-        print(f"Root element: {root.tag}")
-        for child in root:
-            print("pnml_reader.py")
-            print(f"Child element: {child.tag}")
+        return [name for name in get_compiled_model().place_names if name]
 
-        # Try to find the net element without namespace
-        nets = root.findall(".//net")
+    except FileNotFoundError as e:
         print("pnml_reader.py")
-        print(f"Number of nets found without namespace: {len(nets)}")
-        
-        # Try to find place elements directly under each net element
-        states = []
-        for net in nets:
-            places = net.findall(".//place")
-            print("pnml_reader.py")
-            print(f"Number of places found without namespace: {len(places)}")
-            for place in places:
-                name_element = place.find(".//text")
-                if name_element is not None and name_element.text:
-                    states.append(name_element.text)
-                else:
-                    print("pnml_reader.py")
-                    print(f"No text found for place with ID: {place.get('id')}")
-
-        # If no places found, try with namespace
-        if not states:
-            namespace = {'pnml': 'http://www.informatik.hu-berlin.de/top/pntd/ptNetb'}
-            if root.tag.startswith("{"):
-                # Extract the namespace
-                uri = root.tag.split("}")[0].strip("{")
-                namespace = {'pnml': uri}
-            print("pnml_reader.py")
-            print(f"Using namespace: {namespace}")
-
-            # Find all place elements in the PNML file using namespace
-            places = root.findall(".//pnml:place", namespaces=namespace)
-            print("pnml_reader.py")
-            print(f"Number of places found with namespace: {len(places)}")
-
-            for place in places:
-                name_element = place.find("pnml:name/pnml:text", namespaces=namespace)
-                if name_element is not None and name_element.text:
-                    states.append(name_element.text)
-                else:
-                    print("pnml_reader.py")
-                    print(f"No text found for place with ID: {place.get('id')}")
-
-        # Debug: print the extracted states
-        print("pnml_reader.py")
-        print(f"Extracted states: {states}")
-
-        return states
+        print(f"File not found: {e.filename}")
+        return "Error: File not found"
 
     except Exception as e:
         print("pnml_reader.py")
@@ -0,0 +1,317 @@
+import sqlite3
+import time
+
+from helper import create_incident_indexes, incident_scope, copy_deviation_columns
+from copy_values import transfer_event_log_data
+from derive_incident_features import derive_incident_features
+from incident_metrics import create_incident_metrics_table, refresh_incident_metrics, METRIC_COLUMNS
+from quantile_sketches import refresh_quantile_sketches, has_quantile_sketches
+from database_connections import write_transaction
+
+# Columns of the per-incident table read by the analytics views
+INCIDENTS_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents_fa_values_table (
+    incident_id TEXT,
+    fitness REAL,
+    cost REAL,
+    variant TEXT,
+    missing_deviation TEXT,
+    repetition_deviation TEXT,
+    mismatch_deviation TEXT,
+    opened_at TEXT,
+    closed_at TEXT,
+    location TEXT,
+    category TEXT,
+    subcategory TEXT,
+    u_symptom TEXT,
+    impact TEXT,
+    urgency TEXT,
+    priority TEXT,
+    assignment_group TEXT,
+    assigned_to TEXT,
+    resolved_by TEXT,
+    made_sla INTEGER,
+    event_interval_minutes TEXT,
+    transition_interval_minutes TEXT,
+    time_to_states_last_occurrence TEXT,
+    closed_date INTEGER,
+    variant_id INTEGER REFERENCES variants (variant_id),
+    impact_number INTEGER,
+    urgency_number INTEGER,
+    priority_number INTEGER,
+    category_number INTEGER,
+    location_number INTEGER,
+    u_symptom_number INTEGER,
+    produced_tokens INTEGER,
+    consumed_tokens INTEGER,
+    missing_tokens INTEGER,
+    remaining_tokens INTEGER
+)
+"""
+
+# Dictionary of the distinct variants. Each incident refers to its variant by variant_id, which triggers keep in
+# sync with the variant column, so that variants are counted by grouping integer ids.
+VARIANTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS variants (
+    variant_id INTEGER PRIMARY KEY,
+    sequence TEXT NOT NULL UNIQUE,
+    length INTEGER NOT NULL
+)
+"""
+
+# Number of space separated activity codes of a variant
+VARIANT_LENGTH_EXPRESSION = "CASE WHEN {variant} = '' THEN 0 ELSE length({variant}) - length(replace({variant}, ' ', '')) + 1 END"
+
+# Day number (days since 1970-01-01) of closed_at. It is stored in closed_date by triggers and indexed together
+# with the incident_id, so that time period selections are range scans of a covering index.
+CLOSED_DATE_EXPRESSION = "CAST(julianday(substr({closed_at}, 1, 10)) - 2440587.5 AS INTEGER)"
+
+def create_closed_date_index(conn):
+    """
+    Adds the closed_date column to incidents_fa_values_table if it is missing, the triggers which keep it in
+    sync with closed_at and its covering index.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(incidents_fa_values_table)")]
+    if 'closed_date' not in columns:
+        conn.execute("ALTER TABLE incidents_fa_values_table ADD COLUMN closed_date INTEGER")
+        conn.execute(f"UPDATE incidents_fa_values_table SET closed_date = {CLOSED_DATE_EXPRESSION.format(closed_at='closed_at')}")
+
+    new_closed_date = CLOSED_DATE_EXPRESSION.format(closed_at='NEW.closed_at')
+    for name, event in [("trg_fa_closed_date_insert", "INSERT"), ("trg_fa_closed_date_update", "UPDATE OF closed_at")]:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON incidents_fa_values_table
+            BEGIN
+                UPDATE incidents_fa_values_table SET closed_date = {new_closed_date} WHERE ROWID = NEW.ROWID;
+            END
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fa_closed_date ON incidents_fa_values_table (closed_date, incident_id)")
+
+# Numbers of the attribute codes, stored in <column>_number by triggers so that the tabular view filters and sorts
+# by indexed integers: the leading number of impact, urgency and priority (e.g. '2 - Medium' -> 2) and the trailing
+# number of category, location and u_symptom (e.g. 'Category 55' -> 55, NULL without one)
+LEADING_NUMBER_EXPRESSION = "CAST(substr({column}, 1, instr({column}, ' ') - 1) AS INTEGER)"
+TRAILING_NUMBER_EXPRESSION = "CAST(NULLIF(substr({column}, length(rtrim({column}, '0123456789')) + 1), '') AS INTEGER)"
+ATTRIBUTE_NUMBER_EXPRESSIONS = {
+    'impact': LEADING_NUMBER_EXPRESSION,
+    'urgency': LEADING_NUMBER_EXPRESSION,
+    'priority': LEADING_NUMBER_EXPRESSION,
+    'category': TRAILING_NUMBER_EXPRESSION,
+    'location': TRAILING_NUMBER_EXPRESSION,
+    'u_symptom': TRAILING_NUMBER_EXPRESSION,
+}
+
+# Columns the tabular view can be sorted by, each indexed together with the incident_id for keyset pagination
+SORT_INDEX_COLUMNS = ['fitness', 'cost', 'opened_at', 'closed_at'] + [f"{column}_number" for column in ATTRIBUTE_NUMBER_EXPRESSIONS]
+
+def create_attribute_number_columns(conn):
+    """
+    Adds the <column>_number columns to incidents_fa_values_table if they are missing, the triggers which keep them
+    in sync with the attribute codes and the indexes of the sortable columns.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(incidents_fa_values_table)")]
+    for column, expression in ATTRIBUTE_NUMBER_EXPRESSIONS.items():
+        if f"{column}_number" not in columns:
+            conn.execute(f"ALTER TABLE incidents_fa_values_table ADD COLUMN {column}_number INTEGER")
+            conn.execute(f"UPDATE incidents_fa_values_table SET {column}_number = {expression.format(column=column)}")
+
+    new_numbers = ', '.join(
+        f"{column}_number = {expression.format(column=f'NEW.{column}')}" for column, expression in ATTRIBUTE_NUMBER_EXPRESSIONS.items()
+    )
+    events = [("trg_fa_attribute_numbers_insert", "INSERT"), ("trg_fa_attribute_numbers_update", f"UPDATE OF {', '.join(ATTRIBUTE_NUMBER_EXPRESSIONS)}")]
+    for name, event in events:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON incidents_fa_values_table
+            BEGIN
+                UPDATE incidents_fa_values_table SET {new_numbers} WHERE ROWID = NEW.ROWID;
+            END
+        """)
+    for column in SORT_INDEX_COLUMNS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_fa_sort_{column} ON incidents_fa_values_table ({column}, incident_id)")
+
+# Token counts of the last token replay (token_replay.replay_reference_model), from which its fitness is computed
+TOKEN_COLUMNS = ['produced_tokens', 'consumed_tokens', 'missing_tokens', 'remaining_tokens']
+
+def create_token_columns(conn):
+    """Adds the token count columns of the token replay to incidents_fa_values_table if they are missing."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(incidents_fa_values_table)")]
+    for column in TOKEN_COLUMNS:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE incidents_fa_values_table ADD COLUMN {column} INTEGER")
+
+def create_variant_dictionary(conn):
+    """
+    Creates the variants table, adds the variant_id column to incidents_fa_values_table if it is missing,
+    fills both from the existing variants and creates the triggers which keep them in sync with the variant column.
+    """
+    conn.execute(VARIANTS_SCHEMA)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(incidents_fa_values_table)")]
+    if 'variant_id' not in columns:
+        conn.execute("ALTER TABLE incidents_fa_values_table ADD COLUMN variant_id INTEGER REFERENCES variants (variant_id)")
+    conn.execute(f"""
+        INSERT OR IGNORE INTO variants (sequence, length)
+        SELECT DISTINCT variant, {VARIANT_LENGTH_EXPRESSION.format(variant='variant')}
+        FROM incidents_fa_values_table
+        WHERE variant IS NOT NULL
+    """)
+    conn.execute("""
+        UPDATE incidents_fa_values_table
+        SET variant_id = (SELECT v.variant_id FROM variants AS v WHERE v.sequence = incidents_fa_values_table.variant)
+        WHERE variant_id IS NOT (SELECT v.variant_id FROM variants AS v WHERE v.sequence = incidents_fa_values_table.variant)
+    """)
+
+    new_length = VARIANT_LENGTH_EXPRESSION.format(variant='NEW.variant')
+    for name, event in [("trg_fa_variant_insert", "INSERT"), ("trg_fa_variant_update", "UPDATE OF variant")]:
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON incidents_fa_values_table
+            BEGIN
+                INSERT OR IGNORE INTO variants (sequence, length)
+                SELECT NEW.variant, {new_length} WHERE NEW.variant IS NOT NULL;
+                UPDATE incidents_fa_values_table
+                SET variant_id = (SELECT variant_id FROM variants WHERE sequence = NEW.variant)
+                WHERE ROWID = NEW.ROWID;
+            END
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fa_variant_id ON incidents_fa_values_table (variant_id, incident_id)")
+
+def create_incidents_table(db_path="../data/incidents.db"):
+    """
+    Creates incidents_fa_values_table and incident_metrics if they do not exist, the indexes used by the
+    preparation steps, the indexed closed_date column, the variant dictionary, the attribute number columns and
+    the token count columns.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(INCIDENTS_TABLE_SCHEMA)
+        create_incident_indexes(conn)
+        create_closed_date_index(conn)
+        create_variant_dictionary(conn)
+        create_attribute_number_columns(conn)
+        create_token_columns(conn)
+        create_incident_metrics_table(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+def migrate_incidents_table(db_path="../data/incidents.db"):
+    """
+    Adds the indexed closed_date column, the variant dictionary, the attribute number columns and the token count
+    columns to an incidents_fa_values_table prepared before they were introduced, fills the typed incident_metrics
+    table if it is empty and builds the quantile sketches if they were never fully built. Runs once at startup through the
+    writer of the database, before a read replica is loaded, so the read paths only query the migrated schema.
+    """
+    try:
+        with write_transaction(db_path) as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'incidents_fa_values_table'").fetchone() is None:
+                return
+            create_closed_date_index(conn)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_fa_variant_update'").fetchone() is None:
+                create_variant_dictionary(conn)
+            create_attribute_number_columns(conn)
+            create_token_columns(conn)
+            create_incident_metrics_table(conn)
+            if conn.execute("SELECT 1 FROM incident_metrics LIMIT 1").fetchone() is None:
+                refresh_incident_metrics(conn, list(METRIC_COLUMNS.values()))
+            if not has_quantile_sketches(conn):
+                refresh_quantile_sketches(conn)
+            # The incident selection moved to TEMP tables of the read connections
+            conn.execute("DROP TABLE IF EXISTS main.incident_selection")
+            conn.execute("DROP TABLE IF EXISTS main.incident_selection_meta")
+    except Exception as e:
+        print("prepare_incidents_table.py")
+        print(f"An error occurred while migrating incidents_fa_values_table: {e}")
+
+def seed_incidents(db_path="../data/incidents.db", incident_ids=None):
+    """
+    Inserts a row into incidents_fa_values_table for every incident of the event log which has none yet,
+    with closed_at from the event log and fitness and cost from the incident_alignment_table.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        scope = incident_scope(conn, incident_ids)
+        cursor = conn.execute(f"""
+            INSERT INTO incidents_fa_values_table (incident_id, closed_at, fitness, cost)
+            SELECT e.incident_id, e.closed_at, a.fitness, a.costTotal
+            FROM (
+                SELECT incident_id, MAX(closed_at) AS closed_at
+                FROM event_log_table
+                WHERE {scope}
+                GROUP BY incident_id
+            ) AS e
+            LEFT JOIN incident_alignment_table AS a ON a.incident_id = e.incident_id
+            WHERE NOT EXISTS (SELECT 1 FROM incidents_fa_values_table f WHERE f.incident_id = e.incident_id)
+        """)
+        conn.commit()
+        print("prepare_incidents_table.py")
+        print(f"Seeded {cursor.rowcount} new incidents.")
+    finally:
+        conn.close()
+
+def update_closed_at(db_path="../data/incidents.db", incident_ids=None):
+    """
+    Sets closed_at of the incidents in incidents_fa_values_table to the latest closed_at of their events, e.g. after
+    new events of already seeded incidents were appended. The triggers keep closed_date in sync.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        scope = incident_scope(conn, incident_ids)
+        cursor = conn.execute(f"""
+            UPDATE incidents_fa_values_table
+            SET closed_at = e.closed_at
+            FROM (
+                SELECT incident_id, MAX(closed_at) AS closed_at
+                FROM event_log_table
+                WHERE {scope}
+                GROUP BY incident_id
+            ) AS e
+            WHERE incidents_fa_values_table.incident_id = e.incident_id
+              AND incidents_fa_values_table.closed_at IS NOT e.closed_at
+        """)
+        conn.commit()
+        print("prepare_incidents_table.py")
+        print(f"Updated closed_at of {cursor.rowcount} incidents.")
+    finally:
+        conn.close()
+
+def prepare_incidents_table(db_path="../data/incidents.db", incident_ids=None):
+    """
+    Runs all preparation steps which fill incidents_fa_values_table from event_log_table and
+    incident_alignment_table, each as a set-based statement or a single batched transaction.
+
+    Steps:
+        - create the table and the join indexes
+        - seed rows for new incidents
+        - copy the latest event attributes (copy_values.transfer_event_log_data)
+        - copy the deviation columns (helper.copy_deviation_columns)
+        - derive opened_at, variant and the time features (derive_incident_features)
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        incident_ids (list, optional): Restricts the preparation to these incidents. All incidents if None.
+
+    Returns:
+        dict: The duration in seconds of each step, in execution order.
+    """
+    steps = [
+        ("create_table_and_indexes", lambda: create_incidents_table(db_path)),
+        ("seed_incidents", lambda: seed_incidents(db_path, incident_ids)),
+        ("transfer_event_log_data", lambda: transfer_event_log_data(db_path, incident_ids)),
+        ("copy_deviation_columns", lambda: copy_deviation_columns(db_path, incident_ids)),
+        ("derive_incident_features", lambda: derive_incident_features(db_path, incident_ids)),
+    ]
+
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings[name] = round(time.perf_counter() - started, 3)
+
+    print("prepare_incidents_table.py")
+    for name, seconds in timings.items():
+        print(f"  {name}: {seconds:.3f}s")
+    print(f"  total: {sum(timings.values()):.3f}s")
+
+    return timings
+
+# Run the preparation
+if __name__ == "__main__":
+    prepare_incidents_table()
@@ -1,16 +1,100 @@
-import sqlite3
 import json
+import numpy as np
 from database_filter_variables import *
 import eel
+from result_cache import cached_endpoint
+from database_connections import get_connection
+from quantile_sketches import quantile_label
+
+# Number of histogram bins and of points of the density curve of the binned distribution
+DEFAULT_BINS = 30
+KDE_GRID_POINTS = 128
+
+# The values are pre-binned on this many points before the density is estimated, so the cost of the
+# density curve does not grow with the number of incidents
+KDE_PRE_BINS = 1024
+
+SUMMARY_QUANTILES = [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]
+
+def histogram(values, bins=DEFAULT_BINS, binning="fixed"):
+    """
+    Bins the values into a histogram.
+
+    Args:
+        values (numpy.ndarray): Metric values.
+        bins (int): Number of bins.
+        binning (str): 'fixed' for bins of equal width between the minimum and the maximum, 'adaptive' for
+            bins holding about the same number of values (bins narrow where the values are dense).
+
+    Returns:
+        dict: The bin 'edges' (one more than bins) and the 'counts' per bin.
+    """
+    if binning == "adaptive":
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+        if len(edges) < 2:
+            edges = np.array([edges[0] - 0.5, edges[0] + 0.5])
+    elif binning == "fixed":
+        edges = np.histogram_bin_edges(values, bins=bins)
+    else:
+        raise ValueError(f"Unknown binning '{binning}', expected 'fixed' or 'adaptive'.")
+    counts, edges = np.histogram(values, bins=edges)
+    return {'edges': np.round(edges, 6).tolist(), 'counts': counts.tolist()}
+
+def kde_curve(values, points=KDE_GRID_POINTS):
+    """
+    Estimates the density of the values with a Gaussian kernel and Silverman's bandwidth, evaluated on an
+    evenly spaced grid between the minimum and the maximum.
+
+    Returns:
+        dict: The grid 'x', the 'density' at each grid point and the 'bandwidth'.
+    """
+    low, high = values.min(), values.max()
+    std = values.std(ddof=1) if len(values) > 1 else 0.0
+    spread = min(std, np.subtract(*np.quantile(values, [0.75, 0.25])) / 1.34) or std
+    bandwidth = 0.9 * spread * len(values) ** -0.2 if spread > 0 else max(abs(high), 1.0) * 1e-3
+    if low == high:
+        low, high = low - 3 * bandwidth, high + 3 * bandwidth
+
+    # Weighted kernel sum over the pre-binned values instead of over every value
+    counts, edges = np.histogram(values, bins=KDE_PRE_BINS, range=(low, high))
+    centers = (edges[:-1] + edges[1:]) / 2
+    grid = np.linspace(low, high, points)
+    kernel = np.exp(-0.5 * ((grid[:, None] - centers[None, :]) / bandwidth) ** 2)
+    density = kernel @ counts / (len(values) * bandwidth * np.sqrt(2 * np.pi))
+    return {'x': np.round(grid, 6).tolist(), 'density': np.round(density, 6).tolist(), 'bandwidth': round(float(bandwidth), 6)}
+
+def binned_distribution(values, bins=DEFAULT_BINS, binning="fixed"):
+    """
+    Summarizes the values in a payload whose size does not depend on their number: a histogram, a density
+    curve and summary statistics.
+    """
+    if len(values) == 0:
+        return {'count': 0, 'histogram': {'edges': [], 'counts': []}, 'kde': {'x': [], 'density': [], 'bandwidth': None},
+                'quantiles': {}, 'mean': None, 'std': None}
+    return {
+        'count': int(len(values)),
+        'histogram': histogram(values, bins, binning),
+        'kde': kde_curve(values),
+        'quantiles': {
+            quantile_label(quantile): round(float(value), 6)
+            for quantile, value in zip(SUMMARY_QUANTILES, np.quantile(values, SUMMARY_QUANTILES))
+        },
+        'mean': round(float(values.mean()), 6),
+        'std': round(float(values.std(ddof=1)), 6) if len(values) > 1 else 0.0,
+    }
 
 @eel.expose
-def get_compliance_metric_distribution(db_path="../data/incidents.db"):
+@cached_endpoint
+def get_compliance_metric_distribution(db_path="../data/incidents.db", mode="incidents", bins=DEFAULT_BINS, binning="fixed"):
     """
     Retrieves the distribution of a selected compliance metric for all incidents specified by get_incident_ids_selection(),
     formatted as a JSON array suitable for visualization (e.g., violin plot).
 
     Args:
         db_path (str): Path to the SQLite database file.
+        mode (str): 'incidents' for one value per incident (default), 'binned' for a summary of constant size.
+        bins (int): Number of histogram bins in binned mode.
+        binning (str): 'fixed' for bins of equal width or 'adaptive' for bins of about equal counts, in binned mode.
 
     Returns:
         str: A JSON-formatted string containing a list of dictionaries, each with 'incident_id' and 'value' keys.
@@ -22,6 +106,16 @@ def get_compliance_metric_distribution(db_path="../data/incidents.db"):
             ]
         If no data is found or an error occurs, returns an empty JSON array: []
 
+        In binned mode, a JSON object instead:
+            {
+                "metric": "fitness", "count": 1200,
+                "histogram": {"edges": [0.0, 0.05, ...], "counts": [12, 40, ...]},
+                "kde": {"x": [0.0, 0.008, ...], "density": [0.31, 0.35, ...], "bandwidth": 0.04},
+                "quantiles": {"p0": 0.0, "p10": 0.31, "p25": 0.52, "p50": 0.71, "p75": 0.88, "p90": 0.95, "p100": 1.0},
+                "mean": 0.68, "std": 0.21
+            }
+        On error, {"error": <error_message>}.
+
     Interpretation:
         - Each dictionary in the list represents one incident and its compliance metric value.
         - The metric column is selected dynamically via get_filter_value("filters.compliance_metric").
@@ -35,32 +129,28 @@ def get_compliance_metric_distribution(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
         metric_column = get_filter_value("filters.compliance_metric")
 
-        # Get the selected incident IDs
-        incident_ids = get_incident_ids_selection()
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
 
-        # Convert incident_ids list to a format suitable for the SQL query
-        incident_ids_placeholder = ",".join("?" * len(incident_ids))
+        if mode == "binned":
+            cursor.execute(f"""SELECT {metric_column} FROM incidents_fa_values_table JOIN incident_selection USING (incident_id) WHERE {metric_column} IS NOT NULL""")
+            values = np.fromiter((row[0] for row in cursor), dtype=float)
+            cursor.close()
+            return json.dumps({'metric': metric_column, **binned_distribution(values, int(bins), binning)})
 
         # Fetch the desired compliance metric values for the selected incidents
-        query = f"""SELECT incident_id, {metric_column} FROM incidents_fa_values_table WHERE incident_id IN ({incident_ids_placeholder})"""
-
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
+        query = f"""SELECT incident_id, {metric_column} FROM incidents_fa_values_table JOIN incident_selection USING (incident_id)"""
 
-        cursor.execute(query, incident_ids)
+        cursor.execute(query)
         metric_values = cursor.fetchall()
 
-        # Close the connection
+        # Close the cursor
         cursor.close()
-        conn.close()
 
         if not metric_values:
             return json.dumps([])  # Return an empty list if no data is found
@@ -83,7 +173,7 @@ def get_compliance_metric_distribution(db_path="../data/incidents.db"):
     except Exception as e:
         print("process_compliance_distribution.py")
         print(f"An error occurred: {e}")
-        return json.dumps([])
+        return json.dumps({'error': str(e)} if mode == "binned" else [])
 
 # Example usage
 if __name__ == "__main__":
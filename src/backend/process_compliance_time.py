@@ -1,28 +1,38 @@
 import sqlite3
 from database_filter_variables import *
 import eel
+from result_cache import cached_endpoint
+from payload_encoding import encodable_endpoint
+from database_connections import get_connection
 
 @eel.expose
+@encodable_endpoint
+@cached_endpoint
 def get_closed_ordered_incidents(db_name='../data/incidents.db'):
     # Connect to the SQLite database
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
 
     try:
-        # Get the list of incident IDs from get_incident_ids_selection
-        incident_ids = get_incident_ids_selection()
+        # Materialize the selected incident IDs. incident_selection lacks the what-if exclusions, which this
+        # timeline shows as well: they are added back by ID.
+        materialize_incident_selection(conn)
+        excluded_ids = get_excluded_selection_ids()
+        placeholder = ', '.join('?' for _ in excluded_ids)
 
-        # Create a placeholder string for the incident_ids list for the SQL query
-        placeholder = ', '.join('?' for _ in incident_ids)
         compliance_metric = get_incident_compliance_metric()
 
         # Query to select the incidents, filter by selected incident IDs, and order by closed_at
         cursor.execute(f'''
+            SELECT incident_id, closed_at, {compliance_metric}
+            FROM incidents_fa_values_table
+            JOIN incident_selection USING (incident_id)
+            UNION ALL
             SELECT incident_id, closed_at, {compliance_metric}
             FROM incidents_fa_values_table
             WHERE incident_id IN ({placeholder})
             ORDER BY closed_at ASC
-        ''', incident_ids)
+        ''', excluded_ids)
 
         # Fetch all the results
         incidents = cursor.fetchall()
@@ -42,10 +52,6 @@ def get_closed_ordered_incidents(db_name='../data/incidents.db'):
         print("process_compliance_time.py")
         print(f"An error occurred: {e}")
         return None
-    
-    finally:
-        # Close the connection
-        conn.close()
 
 def main():
     
@@ -2,8 +2,13 @@ import sqlite3
 import json
 from database_filter_variables import *
 import eel
+from result_cache import cached_endpoint
+from payload_encoding import encodable_endpoint
+from database_connections import get_connection
 
 @eel.expose
+@encodable_endpoint
+@cached_endpoint
 def get_ordered_time_to_states_last_occurrence(db_name='../data/incidents.db'):
     """
     Fetches and returns the time to last occurrence of process states for each incident, ordered by the incident's closed_at timestamp.
@@ -38,37 +43,28 @@ def get_ordered_time_to_states_last_occurrence(db_name='../data/incidents.db'):
         - Use this output to analyze the timing of process state transitions across incidents, identify bottlenecks, or visualize process timelines.
         - The JSON string can be directly consumed by JavaScript via Eel for frontend analytics, dashboards, or reporting.
     """
-    conn = sqlite3.connect(db_name)
+    conn = get_connection(db_name)
     cursor = conn.cursor()
 
     try:
-        # Get the list of incident IDs from get_incident_ids_selection
-        incident_ids = get_incident_ids_selection()
-
-        # Create a placeholder string for the incident_ids list for the SQL query
-        placeholder = ', '.join('?' for _ in incident_ids)
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
 
         # Query to select the incidents, filter by selected incident IDs, and order by closed_at
         # Start with the base query, including placeholders for the incident_ids
         query = """
-            SELECT incident_id, closed_at, time_to_states_last_occurrence
+            SELECT incident_id, closed_at,
+                   (SELECT json_group_object('TT' || state, value) FROM (
+                        SELECT m.state, m.value FROM incident_metrics m
+                        WHERE m.kind = 'time_to_last' AND m.incident_id = incidents_fa_values_table.incident_id
+                        ORDER BY instr('NAWRC', m.state)))
             FROM incidents_fa_values_table
-            WHERE incident_id IN ({placeholder})
+            JOIN incident_selection USING (incident_id)
             ORDER BY closed_at ASC
         """
 
-        # Add the 'whatif_analysis' exclusion clause if it exists
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            # Insert the 'whatif_analysis' clause before the ORDER BY clause
-            query = query.replace('ORDER BY closed_at ASC', f"AND ( {whatif_clause} ) ORDER BY closed_at ASC")
-
-        # Replace the placeholder for the incident_ids
-        placeholder = ','.join(['?'] * len(incident_ids))
-        query = query.format(placeholder=placeholder)
-
-        # Execute the query with the incident_ids as parameters
-        cursor.execute(query, incident_ids)
+        # Execute the query against the materialized selection
+        cursor.execute(query)
 
         # Fetch all the results
         incidents = cursor.fetchall()
@@ -78,7 +74,7 @@ def get_ordered_time_to_states_last_occurrence(db_name='../data/incidents.db'):
         for incident in incidents:
             incident_id = incident[0]
             closed_at = incident[1]
-            time_to_states = json.loads(incident[2])  # Assuming time_to_states_last_occurrence is stored as a JSON string
+            time_to_states = json.loads(incident[2])  # Built from the typed incident_metrics rows
             result.append({
                 'incident_id': incident_id,
                 'closed_at': closed_at,
@@ -91,10 +87,6 @@ def get_ordered_time_to_states_last_occurrence(db_name='../data/incidents.db'):
         print("process_timedeltas.py")
         print(f"An error occurred: {e}")
         return None
-    
-    finally:
-        # Close the connection
-        conn.close()
 
 
 def main():
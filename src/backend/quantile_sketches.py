@@ -0,0 +1,249 @@
+import math
+import sqlite3
+
+from helper import incident_scope
+
+# Relative accuracy of the sketches: every quantile is within 1% of a value of the same rank
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+# Values closer to zero than this are counted in bucket 0
+MIN_MAGNITUDE = 1e-6
+MIN_INDEX = math.ceil(math.log(MIN_MAGNITUDE) / LOG_GAMMA)
+
+DEFAULT_QUANTILES = [0.5, 0.9, 0.99]
+
+# Sketched metrics and the rows (incident_id, key, value) they are built from. Time metrics are keyed by
+# state or transition, compliance metrics by ''.
+SKETCH_METRICS = {
+    'event_interval': "SELECT incident_id, state AS key, value FROM incident_metrics WHERE kind = 'event_interval' AND value IS NOT NULL",
+    'transition_interval': "SELECT incident_id, state AS key, value FROM incident_metrics WHERE kind = 'transition_interval' AND value IS NOT NULL",
+    'time_to_last': "SELECT incident_id, state AS key, value FROM incident_metrics WHERE kind = 'time_to_last' AND value IS NOT NULL",
+    'fitness': "SELECT incident_id, '' AS key, fitness AS value FROM incidents_fa_values_table WHERE fitness IS NOT NULL",
+    'cost': "SELECT incident_id, '' AS key, cost AS value FROM incidents_fa_values_table WHERE cost IS NOT NULL",
+}
+
+# Mergeable quantile sketches per metric, closed_date day and key: the number of values per logarithmic
+# bucket. The sketch of any time period is the sum of the bucket counts of its days.
+QUANTILE_SKETCHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quantile_sketches (
+    metric TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (metric, day, key, bucket)
+) WITHOUT ROWID
+"""
+
+# The day under which each incident is counted, so that an incident whose closed_at moves is removed
+# from the sketches of its previous day
+QUANTILE_SKETCH_INCIDENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quantile_sketch_incidents (
+    incident_id TEXT PRIMARY KEY,
+    day INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+# Written by full builds only: the sketches cover every day. A database prepared before the sketches were
+# introduced has none, and a scoped refresh alone would only sketch the days of the touched incidents.
+QUANTILE_SKETCHES_BUILT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quantile_sketches_built (
+    built_at TEXT NOT NULL
+)
+"""
+
+def sketch_bucket(value):
+    """
+    Returns the bucket of a value. Buckets grow by a factor GAMMA, and their numbers are ordered like the
+    values: negative for negative values, 0 around zero and positive for positive values.
+    """
+    if value is None:
+        return None
+    value = float(value)
+    if abs(value) < MIN_MAGNITUDE:
+        return 0
+    bucket = math.ceil(math.log(abs(value)) / LOG_GAMMA) - MIN_INDEX + 1
+    return bucket if value > 0 else -bucket
+
+def bucket_value(bucket):
+    """Returns the value representing a bucket, within RELATIVE_ACCURACY of every value in it."""
+    if bucket == 0:
+        return 0.0
+    value = float(f"{2 * GAMMA ** (abs(bucket) + MIN_INDEX - 1) / (GAMMA + 1):.6g}")
+    return value if bucket > 0 else -value
+
+def quantile_rank(quantile, count):
+    """Returns the 0-based rank of a quantile among count ordered values."""
+    return int(quantile * (count - 1))
+
+def quantile_label(quantile):
+    """Returns the label of a quantile, e.g. 'p50' or 'p99.9'."""
+    return f"p{quantile * 100:g}"
+
+def create_quantile_sketch_tables(conn):
+    conn.execute(QUANTILE_SKETCHES_SCHEMA)
+    conn.execute(QUANTILE_SKETCH_INCIDENTS_SCHEMA)
+    conn.execute(QUANTILE_SKETCHES_BUILT_SCHEMA)
+
+def refresh_quantile_sketches(conn, incident_ids=None):
+    """
+    Rebuilds the quantile sketches of the days the given incidents are closed on, now or when they were last
+    sketched, from incident_metrics and incidents_fa_values_table. Runs within the transaction of the caller,
+    which commits. If the sketches were never fully built, all days are built.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the incidents database.
+        incident_ids (list, optional): Incidents whose values changed. All days are rebuilt if None.
+    """
+    if incident_ids is not None and not has_quantile_sketches(conn):
+        incident_ids = None
+    create_quantile_sketch_tables(conn)
+    conn.create_function("sketch_bucket", 1, sketch_bucket, deterministic=True)
+
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS sketch_days (day INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.sketch_days")
+    if incident_ids is None:
+        conn.execute("DELETE FROM quantile_sketches")
+        conn.execute("DELETE FROM quantile_sketch_incidents")
+        conn.execute("INSERT INTO temp.sketch_days SELECT DISTINCT closed_date FROM incidents_fa_values_table WHERE closed_date IS NOT NULL")
+    else:
+        scope = incident_scope(conn, incident_ids)
+        conn.execute(f"""
+            INSERT OR IGNORE INTO temp.sketch_days
+            SELECT day FROM quantile_sketch_incidents WHERE {scope}
+            UNION
+            SELECT closed_date FROM incidents_fa_values_table WHERE closed_date IS NOT NULL AND {scope}
+        """)
+        conn.execute("DELETE FROM quantile_sketches WHERE day IN (SELECT day FROM temp.sketch_days)")
+        conn.execute(f"DELETE FROM quantile_sketch_incidents WHERE day IN (SELECT day FROM temp.sketch_days) OR {scope}")
+
+    conn.execute("""
+        INSERT INTO quantile_sketch_incidents (incident_id, day)
+        SELECT incident_id, closed_date FROM incidents_fa_values_table
+        WHERE closed_date IN (SELECT day FROM temp.sketch_days)
+    """)
+    for metric, source in SKETCH_METRICS.items():
+        conn.execute(f"""
+            INSERT INTO quantile_sketches (metric, day, key, bucket, count)
+            SELECT ?, i.day, s.key, sketch_bucket(s.value) AS bucket, COUNT(*)
+            FROM ({source}) AS s
+            JOIN quantile_sketch_incidents AS i USING (incident_id)
+            WHERE i.day IN (SELECT day FROM temp.sketch_days)
+            GROUP BY i.day, s.key, bucket
+        """, (metric,))
+
+    if incident_ids is None:
+        conn.execute("DELETE FROM quantile_sketches_built")
+        conn.execute("INSERT INTO quantile_sketches_built (built_at) VALUES (datetime('now'))")
+
+def has_quantile_sketches(conn):
+    """Tells whether the database holds quantile sketches of every day, i.e. whether they were fully built once."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'quantile_sketches_built'").fetchone() is None:
+        return False
+    return conn.execute("SELECT 1 FROM quantile_sketches_built").fetchone() is not None
+
+def sketch_quantiles(conn, metric, quantiles, first_day=None, last_day=None):
+    """
+    Merges the daily sketches of a metric over a range of closed_date days and reads the quantiles of every key.
+
+    Returns:
+        dict: Maps each key to the list of quantile values.
+    """
+    rows = conn.execute("""
+        SELECT key, bucket, SUM(count)
+        FROM quantile_sketches
+        WHERE metric = ? AND day BETWEEN ? AND ?
+        GROUP BY key, bucket
+        ORDER BY key, bucket
+    """, (metric, -2**63 if first_day is None else first_day, 2**63 - 1 if last_day is None else last_day)).fetchall()
+
+    buckets_by_key = {}
+    for key, bucket, count in rows:
+        buckets_by_key.setdefault(key, []).append((bucket, count))
+
+    result = {}
+    for key, buckets in buckets_by_key.items():
+        total = sum(count for _, count in buckets)
+        values = []
+        for quantile in quantiles:
+            rank = quantile_rank(quantile, total)
+            seen = 0
+            for bucket, count in buckets:
+                seen += count
+                if seen > rank:
+                    values.append(bucket_value(bucket))
+                    break
+        result[key] = values
+    return result
+
+def exact_quantiles(conn, metric, quantiles):
+    """
+    Reads the quantiles of every key of a metric from the values of the incidents in incident_selection.
+
+    Returns:
+        dict: Maps each key to the list of quantile values.
+    """
+    rows = conn.execute(f"""
+        SELECT s.key, s.value
+        FROM ({SKETCH_METRICS[metric]}) AS s
+        JOIN incident_selection USING (incident_id)
+        ORDER BY s.key, s.value
+    """).fetchall()
+
+    values_by_key = {}
+    for key, value in rows:
+        values_by_key.setdefault(key, []).append(value)
+
+    return {
+        key: [values[quantile_rank(quantile, len(values))] for quantile in quantiles]
+        for key, values in values_by_key.items()
+    }
+
+def selection_quantiles(conn, metric, quantiles=DEFAULT_QUANTILES, day_range=None):
+    """
+    Returns the quantiles of a metric per key over the selected incidents. If the selection is a range of
+    closed_date days (first_day, last_day), either bound None for an open range, they are read from the
+    merged daily sketches, otherwise from the incident_selection table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the incidents database, with a materialized selection.
+        metric (str): A key of SKETCH_METRICS.
+        quantiles (list): Quantiles between 0 and 1.
+        day_range (tuple, optional): The closed_date day range the selection consists of.
+
+    Returns:
+        tuple: {key: {label: value}} and the source, 'sketch' or 'exact'.
+    """
+    if metric not in SKETCH_METRICS:
+        raise ValueError(f"No quantiles are available for '{metric}'.")
+    quantiles = [float(quantile) for quantile in quantiles]
+    if any(not 0 <= quantile <= 1 for quantile in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1.")
+
+    if day_range is not None and has_quantile_sketches(conn):
+        values, source = sketch_quantiles(conn, metric, quantiles, *day_range), 'sketch'
+    else:
+        values, source = exact_quantiles(conn, metric, quantiles), 'exact'
+
+    labels = [quantile_label(quantile) for quantile in quantiles]
+    return {key: dict(zip(labels, key_values)) for key, key_values in values.items()}, source
+
+def build_quantile_sketches(db_path="../data/incidents.db"):
+    """Builds the quantile sketches of all days, e.g. for a database prepared before they were introduced."""
+    try:
+        conn = sqlite3.connect(db_path)
+        refresh_quantile_sketches(conn)
+        conn.commit()
+        count = conn.execute("SELECT COUNT(DISTINCT day) FROM quantile_sketch_incidents").fetchone()[0]
+        conn.close()
+        print("quantile_sketches.py")
+        print(f"Built the quantile sketches of {count} days.")
+    except Exception as e:
+        print("quantile_sketches.py")
+        print(f"An error occurred: {e}")
+
+# Build the sketches of an existing database
+if __name__ == "__main__":
+    build_quantile_sketches()
@@ -0,0 +1,165 @@
+import json
+import pickle
+import threading
+import functools
+import eel
+from collections import OrderedDict
+
+from database_connections import get_database_generation
+from database_filter_variables import get_filters_fingerprint
+from model_registry import get_compiled_model
+
+# Memory budget of the cached results, measured as the size of their pickled form
+RESULT_CACHE_BUDGET = 64 * 1024 * 1024
+
+# Results larger than this share of the budget are returned without being cached
+RESULT_CACHE_MAX_ENTRY_SHARE = 0.25
+
+DATABASE_PATH = "../data/incidents.db"
+
+def get_dataset_generation(db_path=DATABASE_PATH):
+    """
+    Returns the generation of the database, see database_connections.get_database_generation. It changes
+    with every committed write, whether by an ingest, the data pipeline or another process.
+    """
+    return get_database_generation(db_path)
+
+def get_model_version():
+    try:
+        return get_compiled_model().version
+    except Exception:
+        # No or no valid reference model, the endpoints report their own errors
+        return None
+
+class ResultCache:
+    """
+    LRU cache of endpoint results with a memory budget. Results are stored pickled, so every hit returns
+    a fresh copy and the pickled size is the memory accounted for. Concurrent calls with the same key are
+    deduplicated: the first computes the result while the others wait for it (single-flight).
+    """
+
+    def __init__(self, budget=RESULT_CACHE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.statistics = {"hits": 0, "misses": 0, "deduplicated": 0, "evictions": 0, "uncached": 0}
+
+    def get(self, key, compute, is_current=None):
+        """
+        Returns the cached result of key, or computes and caches it. If is_current is given, the result is only
+        cached if is_current() still holds after the computation, e.g. the data did not change meanwhile.
+        """
+        waited = False
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.statistics["deduplicated" if waited else "hits"] += 1
+                    return pickle.loads(self.entries[key])
+                pending = self.in_flight.get(key)
+                if pending is None:
+                    pending = self.in_flight[key] = threading.Event()
+                    self.statistics["misses"] += 1
+                    break
+            # Wait for the identical call in flight, then take its result or compute if it was not cached
+            waited = True
+            pending.wait()
+
+        try:
+            result = compute()
+            if is_current is None or is_current():
+                self.put(key, result)
+            else:
+                with self.lock:
+                    self.statistics["uncached"] += 1
+            return result
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            pending.set()
+
+    def put(self, key, result):
+        if is_error_result(result):
+            with self.lock:
+                self.statistics["uncached"] += 1
+            return
+        try:
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            blob = None
+        with self.lock:
+            if blob is None or len(blob) > self.budget * RESULT_CACHE_MAX_ENTRY_SHARE:
+                self.statistics["uncached"] += 1
+                return
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = blob
+            self.size += len(blob)
+            while self.size > self.budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.statistics["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.statistics["hits"] + self.statistics["misses"] + self.statistics["deduplicated"]
+            return {
+                **self.statistics,
+                "entries": len(self.entries),
+                "size_bytes": self.size,
+                "budget_bytes": self.budget,
+                "hit_rate": round((self.statistics["hits"] + self.statistics["deduplicated"]) / lookups, 3) if lookups else None,
+            }
+
+def is_error_result(result):
+    """Error results, {'error': ...} as a dictionary or a JSON string, are not cached as they may be transient."""
+    if isinstance(result, dict):
+        return 'error' in result
+    if isinstance(result, str) and result.startswith('{"error"'):
+        return True
+    return False
+
+result_cache = ResultCache()
+
+def cached_endpoint(function):
+    """
+    Caches the results of an analytics endpoint in result_cache. The key combines the function, its
+    arguments, the filter fingerprint, the dataset generation and the reference model version, so any
+    change of the filters, the data or the model leads to a recomputation. A result is not cached if the
+    dataset generation changed while it was computed, as it may mix both generations. Apply below @eel.expose.
+    """
+    name = f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        arguments = json.dumps([args, kwargs], sort_keys=True, default=repr)
+        generation = get_dataset_generation()
+        key = (name, arguments, get_filters_fingerprint(), generation, get_model_version())
+        return result_cache.get(
+            key, lambda: function(*args, **kwargs), is_current=lambda: get_dataset_generation() == generation
+        )
+
+    wrapper.uncached = function
+    return wrapper
+
+@eel.expose
+def get_result_cache_stats():
+    """
+    Returns the hit and miss statistics of the endpoint result cache.
+
+    Returns:
+        dict: hits, misses, deduplicated (calls which waited for an identical call in flight), evictions,
+              uncached (error or oversized results, or computed while the data changed), entries, size_bytes, budget_bytes and hit_rate.
+    """
+    return result_cache.stats()
+
+@eel.expose
+def clear_result_cache():
+    result_cache.clear()
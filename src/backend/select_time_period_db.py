@@ -2,54 +2,57 @@ import sqlite3
 from datetime import datetime
 import eel
 
-from database_filter_variables import set_incident_ids_selection
+from database_filter_variables import select_incidents_into_selection, set_incident_selection_day_range
+from result_cache import cached_endpoint
+from database_connections import get_connection
+
+# Day zero of the closed_date day numbers
+EPOCH = datetime(1970, 1, 1)
+
+def closed_date_range(start_date=None, end_date=None):
+    """
+    Builds the condition on the indexed closed_date day number for a time period given as 'dd/mm/YYYY' strings.
+    Without any bound the condition matches all incidents, including those which are not closed.
+
+    Returns:
+        tuple: The SQL condition and its parameters.
+    """
+    first_day, last_day = closed_day_bounds(start_date, end_date)
+    if start_date and end_date:
+        return "closed_date BETWEEN ? AND ?", [first_day, last_day]
+    elif start_date:
+        return "closed_date >= ?", [first_day]
+    elif end_date:
+        return "closed_date <= ?", [last_day]
+    return "1 = 1", []
+
+def closed_day_bounds(start_date=None, end_date=None):
+    """Returns the closed_date day numbers of a time period given as 'dd/mm/YYYY' strings, None for an open bound."""
+    def day_number(date_str):
+        return (datetime.strptime(date_str, "%d/%m/%Y") - EPOCH).days
+
+    return (day_number(start_date) if start_date else None, day_number(end_date) if end_date else None)
 
 @eel.expose
 def query_closed_incidents(start_date=None, end_date=None, db_path="../data/incidents.db"):
     try:
 
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
-        def standardize_date(date_str):
-            return datetime.strptime(date_str, "%d/%m/%Y").strftime("%Y-%m-%d")
-
-        query = "SELECT DISTINCT incident_id FROM event_log_table"
-        params = []
-
-        if start_date and end_date:
-            start_date_formatted = standardize_date(start_date)
-            end_date_formatted = standardize_date(end_date)
-            query += """
-            WHERE date(substr(closed_at, 1, 10)) 
-                  BETWEEN ? AND ?
-            """
-            params.extend([start_date_formatted, end_date_formatted])
-        elif start_date:
-            start_date_formatted = standardize_date(start_date)
-            query += """
-            WHERE date(substr(closed_at, 1, 10)) 
-                  >= ?
-            """
-            params.append(start_date_formatted)
-        elif end_date:
-            end_date_formatted = standardize_date(end_date)
-            query += """
-            WHERE date(substr(closed_at, 1, 10)) 
-                  <= ?
-            """
-            params.append(end_date_formatted)
-
-        cursor.execute(query, params)
-        incidents = cursor.fetchall()
-
-        # Set global list of selected incidents
-        set_incident_ids_selection([incident[0] for incident in incidents])
+        # Range scan of the (closed_date, incident_id) covering index
+        condition, params = closed_date_range(start_date, end_date)
+        query = f"SELECT incident_id FROM incidents_fa_values_table WHERE {condition}"
+
+        # Set global list of selected incidents, materialized in incident_selection with one INSERT ... SELECT
+        incident_ids = select_incidents_into_selection(conn, query, params)
+        if start_date or end_date:
+            # Only a time period consists of whole closed_date days, all incidents include those not closed
+            set_incident_selection_day_range(*closed_day_bounds(start_date, end_date))
 
         cursor.close()
-        conn.close()
 
-        return [incident[0] for incident in incidents]
+        return incident_ids
 
     except Exception as e:
         print("select_time_period_db.py")
@@ -57,9 +60,10 @@ def query_closed_incidents(start_date=None, end_date=None, db_path="../data/inci
         return []
 
 @eel.expose
+@cached_endpoint
 def count_unique_incidents(db_path="../data/incidents.db"):
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
         query = "SELECT COUNT(DISTINCT incident_id) FROM event_log_table"
@@ -68,7 +72,6 @@ def count_unique_incidents(db_path="../data/incidents.db"):
         count = cursor.fetchone()[0]
 
         cursor.close()
-        conn.close()
 
         return count
 
@@ -82,9 +85,10 @@ def number_of_closed_incidents_in_time_period(start_date, end_date):
     return len(query_closed_incidents(start_date, end_date))
 
 @eel.expose
+@cached_endpoint
 def get_min_max_closed_date(db_path="../data/incidents.db"):
     """
-    Returns the minimum and maximum closed_at dates from the event_log_table.
+    Returns the minimum and maximum closed dates of the incidents from the indexed closed_date column.
     
     Args:
     db_path (str): Path to the SQLite database file.
@@ -93,21 +97,20 @@ def get_min_max_closed_date(db_path="../data/incidents.db"):
     tuple: A tuple containing the minimum and maximum dates in 'YYYY-MM-DD' format.
     """
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
 
+        # MIN and MAX are answered from the ends of the closed_date index
         query = """
         SELECT 
-            MIN(date(substr(closed_at, 1, 10))), 
-            MAX(date(substr(closed_at, 1, 10)))
-        FROM event_log_table
+            date((SELECT MIN(closed_date) FROM incidents_fa_values_table) * 86400, 'unixepoch'), 
+            date((SELECT MAX(closed_date) FROM incidents_fa_values_table) * 86400, 'unixepoch')
         """
 
         cursor.execute(query)
         min_date, max_date = cursor.fetchone()
 
         cursor.close()
-        conn.close()
 
         return min_date, max_date
 
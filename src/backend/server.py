@@ -7,16 +7,17 @@ import sys
 import eel
 
 from validate_pnml import validate_pnml
-from calculate_averages_db import calculate_column_average
+from calculate_averages_db import calculate_column_average, calculate_column_quantiles
 from csv_reader import get_csv_data
 from pnml_reader import get_pnml_data, get_pnml_states
 from common_variants_db import *
 from database_sec_controls import insert_security_control
 from count_deviations_db import count_frequencies
 from define_mapping import extract_places_from_pnml, write_mapping_to_file
+from model_registry import invalidate_model_registry
 from select_time_period_db import query_closed_incidents, count_unique_incidents, number_of_closed_incidents_in_time_period
 from tabular_entries import *
-from time_between_states_and_transitions import get_average_state_times, get_average_transition_times
+from time_between_states_and_transitions import get_average_state_times, get_average_transition_times, get_time_statistics, get_time_quantiles
 from pnml_reader import get_pnml_data
 from process_compliance_time import get_closed_ordered_incidents
 from process_compliance_distribution import get_compliance_metric_distribution
@@ -31,6 +32,13 @@ from add_assessment_result import insert_assessment_result, apply_what_if_analys
 from link_view_to_security_control import save_screenshot_and_link_to_control, fetch_all_assessment_views
 from global_progress import get_global_progress
 from ai_recommendation import generate_assessment_security_control
+from token_replay import replay_reference_model
+from alignments import align_event_log
+from parallel_conformance import get_conformance_progress
+from result_cache import get_result_cache_stats, clear_result_cache
+from payload_encoding import get_encoded_payload
+from database_connections import enable_read_replica
+from prepare_incidents_table import migrate_incidents_table
 from database_filter_variables import *
 
 filter_conditions = {}
@@ -49,6 +57,7 @@ def communicate_pnml_validation_py(pnml_input):
         file_path = os.path.join(data_dir, 'reference_model.pnml')
         with open(file_path, 'w') as file:
             file.write(pnml_input)
+        invalidate_model_registry()
     
     return validation_result
 
@@ -180,5 +189,13 @@ def start_eel(develop):
 if __name__ == '__main__':
     import sys
 
-    # Pass any second argument to enable debugging
-    start_eel(develop=len(sys.argv) == 2)
+    # Bring a database prepared by an earlier version up to the current schema, before any replica is loaded
+    migrate_incidents_table()
+
+    # Serve the analytics reads from an in-memory copy of incidents.db
+    if "--read-replica" in sys.argv:
+        enable_read_replica()
+
+    # Pass any second argument (other than an option) to enable debugging
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith("--")]
+    start_eel(develop=len(arguments) == 1)
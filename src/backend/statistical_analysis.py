@@ -1,10 +1,11 @@
-import sqlite3
 import json
-import pandas as pd
 import eel
 from database_filter_variables import *
+from result_cache import cached_endpoint
+from database_connections import get_connection
 
 @eel.expose
+@cached_endpoint
 def get_statistical_analysis_data(db_path="../data/incidents.db"):
     """
     Calculates and returns key statistical metrics for the selected incidents from the 'incidents_fa_values_table'.
@@ -24,7 +25,7 @@ def get_statistical_analysis_data(db_path="../data/incidents.db"):
 
     Interpretation:
         - "perc_sla_met": The proportion (in percent) of selected incidents that met their SLA requirements.
-        - "avg_time_to_resolve": The average time to resolve (TTR) for selected incidents, extracted from the time_to_states_last_occurrence field.
+        - "avg_time_to_resolve": The average time to resolve (TTR) for selected incidents, read from the time_to_last metrics of the incident_metrics table.
         - "perc_assigned_to_resolved_by": The proportion (in percent) of incidents where the person assigned to the incident is the same as the person who resolved it.
         - "perc_false_positives": The proportion (in percent) of incidents where the incident was closed at the same time it was opened (potential false positives).
         - All metrics are calculated only for incidents whose IDs are returned by get_incident_ids_selection(), and may be further filtered by what-if analysis.
@@ -36,7 +37,7 @@ def get_statistical_analysis_data(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         
         # Fetch selected incident IDs
         incident_ids = get_incident_ids_selection()
@@ -44,46 +45,25 @@ def get_statistical_analysis_data(db_path="../data/incidents.db"):
         if not incident_ids:
             return json.dumps({"error": "No incidents selected."})
 
-        # Query to get necessary columns from incidents table
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
+        # Aggregate all metrics in one query, TTR is read from the typed incident_metrics table
         query = f"""
-        SELECT incident_id, made_sla, time_to_states_last_occurrence, assigned_to, resolved_by, 
-               closed_at, opened_at
+        SELECT
+            AVG(made_sla) * 100,
+            AVG((SELECT m.value FROM incident_metrics m
+                 WHERE m.kind = 'time_to_last' AND m.state = 'R'
+                   AND m.incident_id = incidents_fa_values_table.incident_id)),
+            AVG(COALESCE(assigned_to = resolved_by, 0)) * 100,
+            AVG(COALESCE(closed_at = opened_at, 0)) * 100
         FROM incidents_fa_values_table
-        WHERE incident_id IN ({','.join(['?'] * len(incident_ids))})
+        JOIN incident_selection USING (incident_id)
         """
-        
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
-        # Load data into pandas DataFrame
-        df = pd.read_sql_query(query, conn, params=incident_ids)
-        
-        # Calculate PERC SLA MET
-        perc_sla_met = df['made_sla'].mean() * 100 
-
-        # Calculate AVG TIME TO RESOLVE
-        def extract_ttr(time_to_states):
-            if time_to_states:
-                time_to_states_dict = json.loads(time_to_states)
-                return time_to_states_dict.get("TTR", None)  # Get the TTR value, or None if it doesn't exist
-            return None
 
-        df['TTR'] = df['time_to_states_last_occurrence'].apply(extract_ttr)
-        avg_time_to_resolve = df['TTR'].mean() if pd.notna(df['TTR']).any() else 0
-        
-        # Calculate PERC ASSIGNED TO RESOLVED BY
-        perc_assigned_to_resolved_by = (df['assigned_to'] == df['resolved_by']).mean() * 100
-        
-        # Calculate FALSE POSITIVES
-        def calculate_false_positive(closed_at, opened_at):
-            if closed_at and opened_at:
-                return 1 if closed_at == opened_at else 0
-            return 0
-        
-        df['false_positive'] = df.apply(lambda x: calculate_false_positive(x['closed_at'], x['opened_at']), axis=1)
-        perc_false_positives = df['false_positive'].mean() * 100
+        perc_sla_met, avg_time_to_resolve, perc_assigned_to_resolved_by, perc_false_positives = (
+            value or 0 for value in conn.execute(query).fetchone()
+        )
         
         # Create the result dictionary
         result = {
@@ -99,11 +79,6 @@ def get_statistical_analysis_data(db_path="../data/incidents.db"):
     except Exception as e:
         return json.dumps({"error": str(e)})
 
-    finally:
-        # Close the database connection
-        if conn:
-            conn.close()
-
 # Example usage
 if __name__ == "__main__":
     data = get_statistical_analysis_data()
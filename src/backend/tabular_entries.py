@@ -1,10 +1,51 @@
-import sqlite3
 import pandas as pd
 import json
 from database_filter_variables import *
+from thresholds import get_severity_thresholds, classify_sql
+from result_cache import cached_endpoint
+from payload_encoding import encodable_endpoint
 import eel
 import ast
 import re  # Import re for regex operations
+from database_connections import get_connection, write_transaction
+from prepare_incidents_table import create_attribute_number_columns, SORT_INDEX_COLUMNS
+
+# Columns of the incidents shown in the tabular view, after the incident_id and the compliance metric
+TABULAR_COLUMNS = "opened_at, closed_at, impact, urgency, priority, made_sla, assigned_to, resolved_by, category, location, u_symptom, variant, missing_deviation, repetition_deviation, mismatch_deviation"
+
+# Columns the tabular view can be sorted by and the indexed column each one is sorted on
+SORT_COLUMNS = {
+    'incident_id': 'incident_id',
+    'fitness': 'fitness',
+    'cost': 'cost',
+    'opened_at': 'opened_at',
+    'closed_at': 'closed_at',
+    'impact': 'impact_number',
+    'urgency': 'urgency_number',
+    'priority': 'priority_number',
+    'category': 'category_number',
+    'location': 'location_number',
+    'u_symptom': 'u_symptom_number',
+}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Selections of up to this many incidents are sorted for every page rather than read along the sort index
+SORTED_SELECTION_LIMIT = 20000
+
+def get_tabular_connection(db_path):
+    """
+    Returns the read connection to the incidents database after adding the attribute number columns and the
+    sort indexes, if the database was prepared before they were introduced.
+    """
+    conn = get_connection(db_path)
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"idx_fa_sort_{SORT_INDEX_COLUMNS[-1]}",)).fetchone():
+        with write_transaction(db_path) as writer:
+            create_attribute_number_columns(writer)
+        # A read replica is reloaded with the new columns
+        conn = get_connection(db_path)
+    return conn
 
 def build_filter_query(filters):
     """
@@ -25,30 +66,15 @@ def build_filter_query(filters):
 
     # Handle compliance bar filters (severity levels)
     compliance_bar_filters = filters.get('overview_metrics', {}).get('compliance_bar', {})
-    severity_levels = filters.get('thresholds', {}).get('compliance_metric_severity_levels', {})
-    compliance_conditions = []
+    active_levels = [level for level, is_active in compliance_bar_filters.items() if is_active]
 
     compliance_metric = filters.get('compliance_metric', '')
     print("tabular_entries.py1")
-    for level, is_active in compliance_bar_filters.items():
-        if is_active:
-            threshold = severity_levels.get(level)
-            if threshold:
-                # Correct the SQL syntax by repeating the compliance_metric for both conditions
-                min_condition, max_condition = threshold.split('AND')
-                min_condition = min_condition.strip()
-                max_condition = max_condition.strip()
-
-                # If compliance_metric is not present, add it to both conditions
-                if compliance_metric not in min_condition:
-                    min_condition = f"{compliance_metric} {min_condition}"
-                if compliance_metric not in max_condition:
-                    max_condition = f"{compliance_metric} {max_condition}"
-
-                compliance_conditions.append(f"({min_condition} AND {max_condition})")
-    
-    if compliance_conditions:
-        conditions.append(f"({' OR '.join(compliance_conditions)})")
+    if active_levels:
+        # Classify the compliance metric with the compiled severity thresholds, as in the compliance bar
+        severity_case = classify_sql(compliance_metric, get_severity_thresholds(compliance_metric))
+        conditions.append(f"{severity_case} IN ({', '.join('?' for _ in active_levels)})")
+        parameters.extend(active_levels)
 
     # Handle statistical analysis filters
     statistical_analysis_filters = filters.get('statistical_analysis', {})
@@ -81,10 +107,13 @@ def build_filter_query(filters):
     deviation_filters = filters.get('deviations_distribution', {})
     for deviation_type, states in deviation_filters.items():
         if states:  # Check if it's not None and not empty
-            deviation_column = f"{deviation_type}_deviation"
             for state in states:
-                # Build condition to check if the value for a state is not zero
-                conditions.append(f"CAST(json_extract({deviation_column}, '$.{state}') AS INTEGER) > 0")
+                # Build condition to check if the typed value for a state is not zero
+                conditions.append(
+                    "EXISTS (SELECT 1 FROM incident_metrics m WHERE m.kind = ? AND m.state = ? AND m.value > 0 "
+                    "AND m.incident_id = incidents_fa_values_table.incident_id)"
+                )
+                parameters.extend([deviation_type, state])
 
     # Map filter fields to database column names
     field_column_mapping = {
@@ -121,10 +150,9 @@ def build_filter_query(filters):
                             # Handle values that don't start with a number
                             continue
                     if numeric_ids:
+                        # Indexed leading number of the code, stored at ingest
                         placeholders = ', '.join('?' for _ in numeric_ids)
-                        conditions_sub.append(
-                            f"CAST(substr({column_name}, 1, instr({column_name}, ' ') - 1) AS INTEGER) IN ({placeholders})"
-                        )
+                        conditions_sub.append(f"{column_name}_number IN ({placeholders})")
                         params_sub.extend(numeric_ids)
                 if non_numeric_values:
                     # Handle '?' value
@@ -149,10 +177,9 @@ def build_filter_query(filters):
                 conditions_sub = []
                 params_sub = []
                 if numeric_values:
+                    # Indexed trailing number of the code, stored at ingest
                     placeholders = ', '.join('?' for _ in numeric_values)
-                    conditions_sub.append(
-                        f"extract_numeric_end({column_name}) IN ({placeholders})"
-                    )
+                    conditions_sub.append(f"{column_name}_number IN ({placeholders})")
                     params_sub.extend(numeric_values)
                 if non_numeric_values:
                     # Handle '?' or other non-numeric values
@@ -178,6 +205,8 @@ def build_filter_query(filters):
     return ' AND '.join(conditions), parameters
 
 @eel.expose
+@encodable_endpoint
+@cached_endpoint
 def get_tabular_incidents_entries(db_path="../data/incidents.db"):
     """
     Queries the incident_alignment_table for selected incident IDs and the specified compliance metric,
@@ -191,20 +220,8 @@ def get_tabular_incidents_entries(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        
-        # Register the extract_numeric_end function
-        def extract_numeric_end(s):
-            import re
-            if s is None:
-                return None
-            m = re.search(r'(\d+)$', s)
-            if m:
-                return int(m.group(1))
-            else:
-                return None
-        conn.create_function("extract_numeric_end", 1, extract_numeric_end)
-        
+        conn = get_tabular_connection(db_path)
+
         # Get all the filters
         filters = get_filter_value()
 
@@ -214,34 +231,26 @@ def get_tabular_incidents_entries(db_path="../data/incidents.db"):
         if not incident_ids_selection:
             return []  # Return an empty list if no incident IDs
 
-        # Format the incident IDs for SQL query
-        formatted_incident_ids = ', '.join('?' for _ in incident_ids_selection)
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
         compliance_metric = get_filter_value("filters.compliance_metric")
-        incident_id_params = incident_ids_selection
 
         # Build the base SQL query to select the desired columns
         query = f"""
-        SELECT incident_id, {compliance_metric}, opened_at, closed_at, impact, urgency, priority, made_sla, assigned_to, resolved_by, category, location, u_symptom, variant, missing_deviation, repetition_deviation, mismatch_deviation
+        SELECT incident_id, {compliance_metric}, {TABULAR_COLUMNS}
         FROM incidents_fa_values_table
-        WHERE incident_id IN ({formatted_incident_ids})
+        JOIN incident_selection USING (incident_id)
         """
 
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
         # Add the dynamically constructed filter conditions
         filter_clause, parameters = build_filter_query(filters)
         if filter_clause:
-            query += f" AND ( {filter_clause} )"
-
-        
-        # Combine parameters
-        all_params = incident_id_params + parameters
+            query += f" WHERE ( {filter_clause} )"
+        query += " ORDER BY incident_id"
         
         # Execute the query and load the result into a DataFrame
-        df = pd.read_sql_query(query, conn, params=all_params)
+        df = pd.read_sql_query(query, conn, params=parameters)
 
         # Convert the DataFrame to a list of dictionaries
         result = df.to_dict(orient='records')
@@ -252,10 +261,120 @@ def get_tabular_incidents_entries(db_path="../data/incidents.db"):
         print("tabular_entries.py3")
         print(f"An error occurred: {e}")
         return []  # Return an empty list on error
-        
-    finally:
-        # Close the database connection
-        conn.close()
+
+def keyset_segments(sort_column, descending, cursor):
+    """
+    Builds the conditions selecting the rows after a cursor in the order (sort_column, incident_id), ascending or
+    descending. NULL sort values come first in ascending and last in descending order, as in SQLite. The rows with
+    and without a sort value are separate segments, read one after the other, so that each segment is a range of
+    the (sort_column, incident_id) index.
+
+    Args:
+        sort_column (str): The indexed column sorted on.
+        descending (bool): Whether the page is sorted in descending order.
+        cursor (list): The sort value and the incident_id of the last row of the previous page, None for the first page.
+
+    Returns:
+        list: The SQL condition and its parameters of each segment, in sort order.
+    """
+    if not cursor:
+        return [("1 = 1", [])]
+    sort_value, incident_id = cursor
+    if sort_column == 'incident_id':
+        return [("incident_id < ?" if descending else "incident_id > ?", [incident_id])]
+    if sort_value is None:
+        if descending:
+            return [(f"{sort_column} IS NULL AND incident_id < ?", [incident_id])]
+        return [(f"{sort_column} IS NULL AND incident_id > ?", [incident_id]), (f"{sort_column} IS NOT NULL", [])]
+    if descending:
+        return [(f"({sort_column}, incident_id) < (?, ?)", [sort_value, incident_id]), (f"{sort_column} IS NULL", [])]
+    return [(f"({sort_column}, incident_id) > (?, ?)", [sort_value, incident_id])]
+
+@cached_endpoint
+def count_tabular_incidents(db_path="../data/incidents.db"):
+    """Counts the selected incidents matching the active filters, shared by all pages of the tabular view."""
+    conn = get_tabular_connection(db_path)
+    materialize_incident_selection(conn)
+    query = "SELECT COUNT(*) FROM incidents_fa_values_table JOIN incident_selection USING (incident_id)"
+    filter_clause, parameters = build_filter_query(get_filter_value())
+    if filter_clause:
+        query += f" WHERE ( {filter_clause} )"
+    return conn.execute(query, parameters).fetchone()[0]
+
+@eel.expose
+@cached_endpoint
+def get_tabular_incidents_page(sort_by="incident_id", descending=False, page_size=DEFAULT_PAGE_SIZE, cursor=None, db_path="../data/incidents.db"):
+    """
+    Returns one page of the selected incidents matching the active filters, sorted on the server. Pages are read
+    with a keyset cursor: for large selections every page is a range scan of the index of the sort column, however
+    deep it is, small selections are sorted in memory.
+
+    Args:
+        sort_by (str): The column to sort by, a key of SORT_COLUMNS. Impact, urgency, priority, category, location
+            and u_symptom are sorted by the number of their code.
+        descending (bool): Sort in descending order.
+        page_size (int): Number of incidents per page, at most MAX_PAGE_SIZE.
+        cursor (list, optional): The 'next_cursor' of the previous page, None for the first page.
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        dict: {'rows': [incident dictionaries as in get_tabular_incidents_entries], 'total': <number of matching
+              incidents>, 'next_cursor': <cursor of the next page, None on the last page>}.
+              On error, the dictionary also holds 'error': <error_message> and no rows.
+    """
+    try:
+        if sort_by not in SORT_COLUMNS:
+            raise ValueError(f"The tabular view cannot be sorted by '{sort_by}'.")
+        sort_column = SORT_COLUMNS[sort_by]
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+        if not get_incident_ids_selection():
+            return {'rows': [], 'total': 0, 'next_cursor': None}
+
+        conn = get_tabular_connection(db_path)
+
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
+        compliance_metric = get_filter_value("filters.compliance_metric")
+        filter_clause, parameters = build_filter_query(get_filter_value())
+
+        # Large selections are read in the order of the sort index and stop after the page, small ones are sorted
+        if len(get_incident_ids_selection()) > SORTED_SELECTION_LIMIT:
+            tables = "incidents_fa_values_table CROSS JOIN incident_selection USING (incident_id)"
+        else:
+            tables = "incident_selection CROSS JOIN incidents_fa_values_table USING (incident_id)"
+
+        direction = "DESC" if descending else "ASC"
+        rows = []
+        for condition, cursor_parameters in keyset_segments(sort_column, descending, cursor):
+            query = f"""
+            SELECT incident_id, {compliance_metric}, {TABULAR_COLUMNS}, {sort_column} AS sort_value
+            FROM {tables}
+            WHERE {condition}{f" AND ( {filter_clause} )" if filter_clause else ""}
+            ORDER BY {sort_column} {direction}, incident_id {direction}
+            LIMIT ?
+            """
+            # One row more than the page tells whether there is a next page
+            result = conn.execute(query, cursor_parameters + parameters + [page_size + 1 - len(rows)])
+            names = [description[0] for description in result.description]
+            rows += [dict(zip(names, row)) for row in result.fetchall()]
+            if len(rows) > page_size:
+                break
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = [rows[-1]['sort_value'], rows[-1]['incident_id']]
+        for row in rows:
+            del row['sort_value']
+
+        return {'rows': rows, 'total': count_tabular_incidents(db_path), 'next_cursor': next_cursor}
+
+    except Exception as e:
+        print("tabular_entries.py")
+        print(f"An error occurred: {e}")
+        return {'rows': [], 'total': 0, 'next_cursor': None, 'error': str(e)}
 
 # Example usage
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
-import sqlite3
 import json
 import re  # To handle extracting numbers from string
 import eel
 from database_filter_variables import *
+from result_cache import cached_endpoint
+from payload_encoding import encodable_endpoint
+from database_connections import get_connection
 
 def extract_numeric_value(value):
     """
@@ -18,6 +20,8 @@ def extract_numeric_value(value):
     return None
 
 @eel.expose
+@encodable_endpoint
+@cached_endpoint
 def get_incident_technical_attributes(db_path="../data/incidents.db"):
     """
     Retrieves selected technical attributes for each incident specified by get_incident_ids_selection(),
@@ -55,7 +59,7 @@ def get_incident_technical_attributes(db_path="../data/incidents.db"):
     """
     try:
         # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
 
         # Fetch the selected incident IDs
         incident_ids = get_incident_ids_selection()  # Directly use the list
@@ -63,21 +67,19 @@ def get_incident_technical_attributes(db_path="../data/incidents.db"):
         if not incident_ids:
             return {"error": "No incidents selected."}
 
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
         # Query to get the desired columns from the incidents_fa_values_table
         query = f"""
         SELECT incident_id, u_symptom, impact, urgency, priority, location, category
         FROM incidents_fa_values_table
-        WHERE incident_id IN ({','.join(['?'] * len(incident_ids))})
+        JOIN incident_selection USING (incident_id)
         """
 
-        # Add the 'whatif_analysis' exclusion clause
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
         # Execute the query
         cursor = conn.cursor()
-        cursor.execute(query, incident_ids)
+        cursor.execute(query)
         rows = cursor.fetchall()
 
         # Format the result into a list of dictionaries
@@ -98,11 +100,6 @@ def get_incident_technical_attributes(db_path="../data/incidents.db"):
     except Exception as e:
         return {"error": str(e)}
 
-    finally:
-        # Close the database connection
-        if conn:
-            conn.close()
-
 # Example usage
 if __name__ == "__main__":
     result = get_incident_technical_attributes()
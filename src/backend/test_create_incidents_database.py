@@ -0,0 +1,48 @@
+import sqlite3
+
+from create_incidents_database import stream_csv_to_sqlite
+
+ALIGNMENT_HEADER = "incident_id,alignment,missing,repetition,mismatch,fitness,costTotal,severity\n"
+
+def table_info(db_path, table_name):
+    conn = sqlite3.connect(db_path)
+    try:
+        columns = [(row[1], row[2]) for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+        count = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0] if columns else None
+        return columns, count
+    finally:
+        conn.close()
+
+def test_stream_csv_to_sqlite_creates_the_table_of_a_header_only_csv(tmp_path):
+    csv_file = tmp_path / "IM_log.csv"
+    csv_file.write_text(ALIGNMENT_HEADER)
+    db_path = str(tmp_path / "incidents.db")
+
+    assert stream_csv_to_sqlite(str(csv_file), 'incident_alignment_table', delimiter=',', database=db_path) == 0
+
+    columns, count = table_info(db_path, 'incident_alignment_table')
+    assert ('fitness', 'REAL') in columns
+    assert count == 0
+
+def test_stream_csv_to_sqlite_creates_the_declared_table_of_an_empty_csv(tmp_path):
+    csv_file = tmp_path / "simple_log.csv"
+    csv_file.write_text("")
+    db_path = str(tmp_path / "incidents.db")
+
+    assert stream_csv_to_sqlite(str(csv_file), 'event_log_table', database=db_path) == 0
+
+    columns, count = table_info(db_path, 'event_log_table')
+    assert ('sys_updated_at_min', 'INTEGER') in columns
+    assert ('event_code', 'INTEGER') in columns
+    assert count == 0
+
+def test_stream_csv_to_sqlite_loads_the_rows(tmp_path):
+    csv_file = tmp_path / "IM_log.csv"
+    csv_file.write_text(ALIGNMENT_HEADER + '"INC0000001","[S]N;[S]C;","{}","{}","{}","0.9","0.1","low"\n')
+    db_path = str(tmp_path / "incidents.db")
+
+    assert stream_csv_to_sqlite(str(csv_file), 'incident_alignment_table', delimiter=',', database=db_path) == 1
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT incident_id, fitness FROM incident_alignment_table").fetchall() == [('INC0000001', 0.9)]
+    conn.close()
@@ -0,0 +1,59 @@
+import sqlite3
+
+from derive_incident_features import derive_incident_features
+from prepare_incidents_table import migrate_incidents_table
+
+EVENT_LOG_SCHEMA = "CREATE TABLE event_log_table (incident_id TEXT, event TEXT, sys_updated_at TEXT, opened_at TEXT)"
+
+ALIGNMENT_SCHEMA = "CREATE TABLE incident_alignment_table (incident_id TEXT, alignment TEXT)"
+
+INCIDENTS_TABLE_SCHEMA = """
+CREATE TABLE incidents_fa_values_table (
+    incident_id TEXT, fitness REAL, cost REAL, variant TEXT, missing_deviation TEXT, repetition_deviation TEXT,
+    mismatch_deviation TEXT, opened_at TEXT, closed_at TEXT, location TEXT, category TEXT, subcategory TEXT,
+    u_symptom TEXT, impact TEXT, urgency TEXT, priority TEXT, assignment_group TEXT, assigned_to TEXT,
+    resolved_by TEXT, made_sla INTEGER, event_interval_minutes TEXT, transition_interval_minutes TEXT,
+    time_to_states_last_occurrence TEXT
+)
+"""
+
+EVENTS = [
+    ('INC0000001', 'N', '2016-03-01 10:00:00', '2016-03-01 09:00:00'),
+    ('INC0000001', 'A', '2016-03-01 11:00:00', '2016-03-01 09:00:00'),
+    # An event without a timestamp is left out of the variant and the intervals
+    ('INC0000001', 'W', None, '2016-03-01 09:00:00'),
+    ('INC0000001', 'C', '2016-03-01 12:30:00', None),
+    # An incident without any opened_at keeps its features
+    ('INC0000002', 'N', '2016-03-02 10:00:00', None),
+    ('INC0000002', 'C', '2016-03-02 11:00:00', None),
+]
+
+def create_database(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(EVENT_LOG_SCHEMA)
+    conn.execute(ALIGNMENT_SCHEMA)
+    conn.execute(INCIDENTS_TABLE_SCHEMA)
+    conn.executemany("INSERT INTO event_log_table VALUES (?, ?, ?, ?)", EVENTS)
+    conn.executemany(
+        "INSERT INTO incidents_fa_values_table (incident_id, variant, opened_at, closed_at) VALUES (?, ?, ?, ?)",
+        [('INC0000001', None, None, '2016-03-01 12:30:00'), ('INC0000002', 'N C', '2016-03-02 09:00:00', '2016-03-02 11:00:00')]
+    )
+    conn.commit()
+    conn.close()
+    migrate_incidents_table(db_path)
+
+def test_derive_incident_features_skips_rows_without_timestamps(tmp_path):
+    db_path = str(tmp_path / "incidents.db")
+    create_database(db_path)
+
+    assert derive_incident_features(db_path) == 1
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("""
+        SELECT incident_id, opened_at, variant, event_interval_minutes, time_to_states_last_occurrence
+        FROM incidents_fa_values_table ORDER BY incident_id
+    """).fetchall() == [
+        ('INC0000001', '2016-03-01 09:00:00', 'N A C', '{"N": 60, "A": 90, "C": 0}', '{"TTN": 60, "TTA": 120, "TTC": 210}'),
+        ('INC0000002', '2016-03-02 09:00:00', 'N C', None, None),
+    ]
+    conn.close()
@@ -0,0 +1,87 @@
+import sqlite3
+
+from prepare_incidents_table import migrate_incidents_table
+
+# incidents_fa_values_table as prepared before closed_date, the variant dictionary, the attribute numbers, the token
+# counts and incident_metrics were introduced
+BASELINE_INCIDENTS_TABLE_SCHEMA = """
+CREATE TABLE incidents_fa_values_table (
+    incident_id TEXT, fitness REAL, cost REAL, variant TEXT, missing_deviation TEXT, repetition_deviation TEXT,
+    mismatch_deviation TEXT, opened_at TEXT, closed_at TEXT, location TEXT, category TEXT, subcategory TEXT,
+    u_symptom TEXT, impact TEXT, urgency TEXT, priority TEXT, assignment_group TEXT, assigned_to TEXT,
+    resolved_by TEXT, made_sla INTEGER, event_interval_minutes TEXT, transition_interval_minutes TEXT,
+    time_to_states_last_occurrence TEXT
+)
+"""
+
+BASELINE_INCIDENTS = [
+    ('INC0000001', 0.8, 0.1, 'N A R C', "{'N': 0, 'A': 1}", "{'N': 0, 'A': 0}", "{'N': 0, 'A': 0}",
+     '2016-03-01 10:00:00', '2016-03-05 10:00:00', 'Location 12', 'Category 3', '2 - Medium',
+     '{"N": 60.0, "A": 120.0}', '{"NA": 30.0}', '{"TTN": 0.0, "TTA": 90.0}'),
+    ('INC0000002', 1.0, 0.0, 'N R C', "{'N': 0, 'A': 0}", "{'N': 1, 'A': 0}", "{'N': 0, 'A': 0}",
+     '2016-03-02 10:00:00', '2016-03-09 10:00:00', 'Location 7', 'Category 55', '1 - High',
+     '{"N": 15.0}', '{"NR": 45.0}', '{"TTN": 0.0}'),
+]
+
+def create_baseline_database(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(BASELINE_INCIDENTS_TABLE_SCHEMA)
+    conn.executemany("""
+        INSERT INTO incidents_fa_values_table (
+            incident_id, fitness, cost, variant, missing_deviation, repetition_deviation, mismatch_deviation,
+            opened_at, closed_at, location, category, impact, event_interval_minutes, transition_interval_minutes,
+            time_to_states_last_occurrence
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, BASELINE_INCIDENTS)
+    conn.commit()
+    conn.close()
+
+def test_migrate_incidents_table_upgrades_a_baseline_database(tmp_path):
+    db_path = str(tmp_path / "incidents.db")
+    create_baseline_database(db_path)
+
+    migrate_incidents_table(db_path)
+
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(incidents_fa_values_table)")]
+    for column in ['closed_date', 'impact_number', 'category_number', 'missing_tokens']:
+        assert column in columns
+
+    assert conn.execute("""
+        SELECT incident_id, closed_date, impact_number, category_number, location_number
+        FROM incidents_fa_values_table ORDER BY incident_id
+    """).fetchall() == [('INC0000001', 16865, 2, 3, 12), ('INC0000002', 16869, 1, 55, 7)]
+
+    assert conn.execute("""
+        SELECT f.incident_id, v.sequence FROM incidents_fa_values_table AS f JOIN variants AS v USING (variant_id)
+        ORDER BY f.incident_id
+    """).fetchall() == [('INC0000001', 'N A R C'), ('INC0000002', 'N R C')]
+
+    metrics = dict(((kind, state, incident_id), value) for incident_id, kind, state, value in conn.execute(
+        "SELECT incident_id, kind, state, value FROM incident_metrics"
+    ))
+    assert metrics[('missing', 'A', 'INC0000001')] == 1
+    assert metrics[('repetition', 'N', 'INC0000002')] == 1
+    assert metrics[('event_interval', 'A', 'INC0000001')] == 120.0
+    assert metrics[('time_to_last', 'A', 'INC0000001')] == 90.0
+
+    assert conn.execute("SELECT COUNT(*) FROM quantile_sketches_built").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(DISTINCT day) FROM quantile_sketch_incidents").fetchone()[0] == 2
+    conn.close()
+
+def test_migrate_incidents_table_keeps_existing_metrics(tmp_path):
+    db_path = str(tmp_path / "incidents.db")
+    create_baseline_database(db_path)
+    migrate_incidents_table(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM incident_metrics WHERE incident_id = 'INC0000002'")
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM incident_metrics").fetchone()[0]
+    conn.close()
+
+    migrate_incidents_table(db_path)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM incident_metrics").fetchone()[0] == count
+    conn.close()
@@ -0,0 +1,46 @@
+import sqlite3
+
+from prepare_incidents_table import migrate_incidents_table
+from select_time_period_db import query_closed_incidents
+from database_filter_variables import get_incident_ids_selection, get_sketch_day_range
+
+INCIDENTS_TABLE_SCHEMA = """
+CREATE TABLE incidents_fa_values_table (
+    incident_id TEXT, fitness REAL, cost REAL, variant TEXT, missing_deviation TEXT, repetition_deviation TEXT,
+    mismatch_deviation TEXT, opened_at TEXT, closed_at TEXT, location TEXT, category TEXT, subcategory TEXT,
+    u_symptom TEXT, impact TEXT, urgency TEXT, priority TEXT, assignment_group TEXT, assigned_to TEXT,
+    resolved_by TEXT, made_sla INTEGER, event_interval_minutes TEXT, transition_interval_minutes TEXT,
+    time_to_states_last_occurrence TEXT
+)
+"""
+
+INCIDENTS = [
+    ('INC0000001', '2016-03-01 10:00:00', '2016-03-05 10:00:00'),
+    ('INC0000002', '2016-03-02 10:00:00', '2016-04-09 10:00:00'),
+    # An incident which is not closed yet
+    ('INC0000003', '2016-03-03 10:00:00', None),
+]
+
+def create_database(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute(INCIDENTS_TABLE_SCHEMA)
+    conn.executemany("INSERT INTO incidents_fa_values_table (incident_id, opened_at, closed_at) VALUES (?, ?, ?)", INCIDENTS)
+    conn.commit()
+    conn.close()
+    migrate_incidents_table(db_path)
+
+def test_query_closed_incidents_without_a_period_selects_all_incidents(tmp_path):
+    db_path = str(tmp_path / "incidents.db")
+    create_database(db_path)
+
+    assert sorted(query_closed_incidents(db_path=db_path)) == ['INC0000001', 'INC0000002', 'INC0000003']
+    assert sorted(get_incident_ids_selection()) == ['INC0000001', 'INC0000002', 'INC0000003']
+    assert get_sketch_day_range() is None
+
+def test_query_closed_incidents_selects_the_incidents_closed_in_a_period(tmp_path):
+    db_path = str(tmp_path / "incidents.db")
+    create_database(db_path)
+
+    assert query_closed_incidents('01/03/2016', '31/03/2016', db_path=db_path) == ['INC0000001']
+    assert sorted(query_closed_incidents(start_date='01/03/2016', db_path=db_path)) == ['INC0000001', 'INC0000002']
+    assert get_sketch_day_range() == (16861, None)
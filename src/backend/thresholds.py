@@ -0,0 +1,144 @@
+import re
+import math
+import numpy as np
+
+from database_filter_variables import get_filter_value, get_thresholds_generation
+
+# A single comparison of a threshold expression, e.g. '>= 0.65' or '<=20'
+COMPARISON_PATTERN = re.compile(r'^\s*(>=|<=|==|=|>|<)\s*([-+]?\d+(?:\.\d+)?)\s*$')
+
+# Severity levels of the compliance metric in the order in which they are checked
+SEVERITY_LEVELS = ['low', 'moderate', 'high', 'critical']
+
+class ThresholdInterval:
+    """
+    Interval of values satisfying a conjunction of comparisons, e.g. '>= 0.65 AND < 0.85' is [0.65, 0.85).
+    """
+
+    def __init__(self):
+        self.lower = -math.inf
+        self.upper = math.inf
+        self.lower_inclusive = True
+        self.upper_inclusive = True
+
+    def restrict(self, operator, bound):
+        """Narrows the interval by one comparison."""
+        if operator in ('>', '>=', '=', '==') and (bound > self.lower or (bound == self.lower and operator == '>')):
+            self.lower = bound
+            self.lower_inclusive = operator != '>'
+        if operator in ('<', '<=', '=', '==') and (bound < self.upper or (bound == self.upper and operator == '<')):
+            self.upper = bound
+            self.upper_inclusive = operator != '<'
+
+    def mask(self, values):
+        """Returns the boolean mask of the values of a NumPy array inside the interval, False for NaN."""
+        lower = values >= self.lower if self.lower_inclusive else values > self.lower
+        upper = values <= self.upper if self.upper_inclusive else values < self.upper
+        return lower & upper
+
+    def sql(self, column):
+        """Returns the interval as a SQL condition on column."""
+        conditions = []
+        if self.lower != -math.inf:
+            conditions.append(f"{column} {'>=' if self.lower_inclusive else '>'} {self.lower!r}")
+        if self.upper != math.inf:
+            conditions.append(f"{column} {'<=' if self.upper_inclusive else '<'} {self.upper!r}")
+        return f"({' AND '.join(conditions)})" if conditions else f"({column} IS NOT NULL)"
+
+    def __repr__(self):
+        return f"{'[' if self.lower_inclusive else '('}{self.lower}, {self.upper}{']' if self.upper_inclusive else ')'}"
+
+class Threshold:
+    """
+    Compiled threshold expression: a union of ThresholdInterval objects, one per OR-separated part.
+    """
+
+    def __init__(self, expression, intervals):
+        self.expression = expression
+        self.intervals = intervals
+
+    def mask(self, values):
+        values = np.asarray(values, dtype=float)
+        mask = np.zeros(values.shape, dtype=bool)
+        for interval in self.intervals:
+            mask |= interval.mask(values)
+        return mask
+
+    def contains(self, value):
+        return value is not None and bool(self.mask([value])[0])
+
+    def sql(self, column):
+        return f"({' OR '.join(interval.sql(column) for interval in self.intervals)})"
+
+    def __repr__(self):
+        return f"Threshold({self.expression!r}: {' | '.join(map(repr, self.intervals))})"
+
+def compile_threshold(expression):
+    """
+    Parses a threshold expression such as '>= 0.65 AND < 0.85' into a Threshold.
+
+    Raises:
+        ValueError: If a part of the expression is not a comparison with a number.
+    """
+    intervals = []
+    for alternative in re.split(r'\s+OR\s+', expression.strip(), flags=re.IGNORECASE):
+        interval = ThresholdInterval()
+        for comparison in re.split(r'\s+AND\s+', alternative, flags=re.IGNORECASE):
+            match = COMPARISON_PATTERN.match(comparison)
+            if not match:
+                raise ValueError(f"Invalid threshold expression: {expression!r}")
+            interval.restrict(match.group(1), float(match.group(2)))
+        intervals.append(interval)
+    return Threshold(expression, intervals)
+
+def compile_thresholds(value):
+    """Compiles every threshold string of a (nested) dictionary, other values are kept as they are."""
+    if isinstance(value, dict):
+        return {key: compile_thresholds(item) for key, item in value.items()}
+    if isinstance(value, str):
+        try:
+            return compile_threshold(value)
+        except ValueError:
+            return value
+    return value
+
+# Compiled thresholds per filter path, dropped whenever set_filter_value changes a threshold
+compiled_thresholds_cache = {}
+compiled_thresholds_generation = None
+
+def get_compiled_thresholds(path="filters.thresholds"):
+    """
+    Returns the thresholds stored at path in the filters, compiled once per change of the thresholds.
+    """
+    global compiled_thresholds_generation
+    if compiled_thresholds_generation != get_thresholds_generation():
+        compiled_thresholds_cache.clear()
+        compiled_thresholds_generation = get_thresholds_generation()
+    if path not in compiled_thresholds_cache:
+        compiled_thresholds_cache[path] = compile_thresholds(get_filter_value(path))
+    return compiled_thresholds_cache[path]
+
+def get_severity_thresholds(compliance_metric):
+    """
+    Returns the compiled severity levels of a compliance metric, falling back to the generic severity levels
+    when no metric-specific ones are configured.
+    """
+    severity_levels = get_compiled_thresholds("filters.thresholds.compliance_metric_severity_levels2")
+    if severity_levels and compliance_metric in severity_levels:
+        return severity_levels[compliance_metric]
+    return get_compiled_thresholds("filters.thresholds.compliance_metric_severity_levels")
+
+def classify(values, thresholds, levels=SEVERITY_LEVELS):
+    """
+    Assigns each value of an array to the index of the first level whose threshold contains it.
+
+    Returns:
+        numpy.ndarray: Level indexes, -1 for values outside all thresholds or NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    return np.select([thresholds[level].mask(values) for level in levels], range(len(levels)), default=-1)
+
+def classify_sql(column, thresholds, levels=SEVERITY_LEVELS):
+    """Returns a SQL CASE expression naming the first level whose threshold contains the column value."""
+    cases = ' '.join(f"WHEN {thresholds[level].sql(column)} THEN '{level}'" for level in levels)
+    return f"CASE {cases} END"
@@ -1,16 +1,35 @@
-import sqlite3
+import os
+import threading
 from datetime import datetime, timedelta
 import json  # Import JSON to store the data in JSON format
 from database_filter_variables import *
 from define_mapping import read_mapping_from_file
+from derive_incident_features import compute_state_intervals, derive_incident_features
 import eel
+from result_cache import cached_endpoint
+from database_connections import get_connection, get_database_generation
+from quantile_sketches import selection_quantiles, DEFAULT_QUANTILES
+
+# Count, mean, minimum and maximum minutes per state and per transition of the selected incidents, in one
+# pass over the (kind, state, incident_id) primary key of incident_metrics
+TIME_STATISTICS_QUERY = """
+SELECT kind, state, COUNT(value), AVG(value), MIN(value), MAX(value)
+FROM incident_metrics
+JOIN incident_selection USING (incident_id)
+WHERE kind IN ('event_interval', 'transition_interval')
+GROUP BY kind, state
+"""
+
+# Statistics of the last selection, shared by the state and the transition endpoints
+time_statistics_cache = {}
+time_statistics_lock = threading.Lock()
 
 def get_event_state_intervals(incident_id, db_path="../data/incidents.db"):
     """
     Retrieve the first and last occurrence of each state (N, A, W, R, C) for a given incident_id.
     """
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_connection(db_path)
         cursor = conn.cursor()
         query = """
         SELECT event, sys_updated_at
@@ -21,30 +40,8 @@ def get_event_state_intervals(incident_id, db_path="../data/incidents.db"):
         cursor.execute(query, (incident_id,))
         events = cursor.fetchall()
         cursor.close()
-        conn.close()
 
-        state_intervals = {}
-        state_order = ['N', 'A', 'W', 'R', 'C']
-        start_index = 0
-
-        for state in state_order:
-            first_occurrence = None
-            last_occurrence = None
-            last_occurrence_index = None
-
-            for i in range(start_index, len(events)):
-                event, timestamp = events[i]
-                if event == state:
-                    if first_occurrence is None:
-                        first_occurrence = timestamp
-                    last_occurrence = timestamp
-                    last_occurrence_index = i
-
-            if first_occurrence and last_occurrence:
-                state_intervals[state] = (first_occurrence, last_occurrence)
-                start_index = last_occurrence_index + 1
-
-        return state_intervals
+        return compute_state_intervals(events)
 
     except Exception as e:
         print("time_between_states_and_transitions.py")
@@ -119,7 +116,126 @@ def format_minutes_to_timedelta(minutes):
     minutes = remainder // 60
     return f"{days}d, {hours}h, {minutes}min"
 
-@eel.expose   
+def load_time_statistics(db_path="../data/incidents.db"):
+    """
+    Aggregates the minutes spent in each state and between each pair of states over the selected incidents
+    with TIME_STATISTICS_QUERY. The result is kept until the selection or the database changes, so the state
+    and the transition endpoints share one query.
+
+    Returns:
+        dict: {'states': {state: statistics}, 'transitions': {'A->B': statistics}}, where statistics holds the
+              count, mean, min and max minutes.
+    """
+    conn = get_connection(db_path)
+
+    # Materialize the selected incident IDs, without the what-if exclusions
+    materialize_incident_selection(conn)
+
+    key = (os.path.abspath(db_path), get_incident_selection_generation(), get_database_generation(db_path))
+    with time_statistics_lock:
+        if time_statistics_cache.get('key') == key:
+            return time_statistics_cache['statistics']
+
+    statistics = {'states': {}, 'transitions': {}}
+    for kind, state, count, mean, minimum, maximum in conn.execute(TIME_STATISTICS_QUERY):
+        group = statistics['states' if kind == 'event_interval' else 'transitions']
+        group[state] = {'count': count, 'mean': mean, 'min': minimum, 'max': maximum}
+
+    with time_statistics_lock:
+        time_statistics_cache.clear()
+        time_statistics_cache.update(key=key, statistics=statistics)
+    return statistics
+
+def order_transitions(transitions, state_mapping):
+    """Orders transition keys 'A->B' by the position of A and then of B in the state mapping."""
+    return [
+        f"{state}->{next_state}"
+        for state in state_mapping.values() for next_state in state_mapping.values()
+        if f"{state}->{next_state}" in transitions
+    ]
+
+@eel.expose
+@cached_endpoint
+def get_time_statistics(db_path="../data/incidents.db"):
+    """
+    Returns the number of incidents, the mean, the minimum and the maximum time spent in each process state and
+    taken by each transition between states, over the incidents closed within the currently selected date range.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        dict: {'states': {state: statistics}, 'transitions': {'StateA->StateB': statistics}} in the order of the
+              state mapping. Each statistics dictionary holds 'count' and the 'mean', 'min' and 'max' minutes,
+              and the mean formatted as 'Xd, Xh, Xmin' under 'mean_formatted'. {'error': <error_message>} on error.
+    """
+    try:
+        statistics = load_time_statistics(db_path)
+        state_mapping = read_mapping_from_file()
+
+        def with_formatted_mean(values):
+            return {**values, 'mean_formatted': format_minutes_to_timedelta(values['mean'])}
+
+        return {
+            'states': {
+                state: with_formatted_mean(statistics['states'][state])
+                for state in state_mapping.values() if state in statistics['states']
+            },
+            'transitions': {
+                transition: with_formatted_mean(statistics['transitions'][transition])
+                for transition in order_transitions(statistics['transitions'], state_mapping)
+            },
+        }
+
+    except Exception as e:
+        print("time_between_states_and_transitions.py")
+        print(f"An error occurred while fetching time statistics: {e}")
+        return {'error': str(e)}
+
+@eel.expose
+@cached_endpoint
+def get_time_quantiles(quantiles=DEFAULT_QUANTILES, db_path="../data/incidents.db"):
+    """
+    Returns quantiles (e.g. the median, p90 and p99) of the time spent in each process state and taken by each
+    transition between states, over the incidents closed within the currently selected date range. For a
+    selected time period they are merged from the daily quantile sketches and are within 1% of the exact
+    values, for any other selection they are read from the selected incidents.
+
+    Args:
+        quantiles (list): Quantiles between 0 and 1, [0.5, 0.9, 0.99] by default.
+        db_path (str): Path to the SQLite database file.
+
+    Returns:
+        dict: {'states': {state: {'p50': minutes, ...}}, 'transitions': {'StateA->StateB': {'p50': minutes, ...}},
+              'source': 'sketch' or 'exact'} in the order of the state mapping. {'error': <error_message>} on error.
+    """
+    try:
+        conn = get_connection(db_path)
+
+        # Materialize the selected incident IDs, without the what-if exclusions
+        materialize_incident_selection(conn)
+
+        day_range = get_sketch_day_range()
+        state_quantiles, source = selection_quantiles(conn, 'event_interval', quantiles, day_range)
+        transition_quantiles, _ = selection_quantiles(conn, 'transition_interval', quantiles, day_range)
+        state_mapping = read_mapping_from_file()
+
+        return {
+            'states': {state: state_quantiles[state] for state in state_mapping.values() if state in state_quantiles},
+            'transitions': {
+                transition: transition_quantiles[transition]
+                for transition in order_transitions(transition_quantiles, state_mapping)
+            },
+            'source': source,
+        }
+
+    except Exception as e:
+        print("time_between_states_and_transitions.py")
+        print(f"An error occurred while fetching time quantiles: {e}")
+        return {'error': str(e)}
+
+@eel.expose
+@cached_endpoint
 def get_average_state_times(db_path="../data/incidents.db"):
     """
     Calculates and returns the average time spent in each process state across all incidents closed within the currently selected date range.
@@ -148,57 +264,11 @@ def get_average_state_times(db_path="../data/incidents.db"):
         - The JSON string can be directly consumed by JavaScript via Eel for frontend analytics and reporting.
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch incident IDs selection
-        incident_ids = tuple(get_incident_ids_selection())
-
-        # Fetch state times as JSON and convert them to minutes
-        query = """
-            SELECT event_interval_minutes 
-            FROM incidents_fa_values_table 
-            WHERE incident_id IN ({placeholders})
-        """
-
-        # Add the 'whatif_analysis' exclusion clause if it exists
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
-        # Now finalize the query by replacing the placeholders for incident IDs
-        placeholders = ','.join(['?'] * len(incident_ids))
-        query = query.format(placeholders=placeholders)
-
-
-        # Execute the query with the incident_ids as parameters
-        cursor.execute(query, incident_ids)
-
-        state_times_list = cursor.fetchall()
-
-        total_time_in_states = {}
-        count_in_states = {}
-
-        for state_times_json in state_times_list:
-            state_times = json.loads(state_times_json[0])  # Convert JSON string back to dictionary
-
-            for state, minutes in state_times.items():
-                if state not in total_time_in_states:
-                    total_time_in_states[state] = 0
-                    count_in_states[state] = 0
-
-                total_time_in_states[state] += minutes
-                count_in_states[state] += 1
-
-        # Calculate average time in each state
-        average_time_in_states = {}
-        for state in total_time_in_states:
-            if count_in_states[state] > 0:
-                avg_minutes = total_time_in_states[state] / count_in_states[state]
-                average_time_in_states[state] = format_minutes_to_timedelta(avg_minutes)
-
-        cursor.close()
-        conn.close()
+        # Format the average time in each state, aggregated in SQL together with the transitions
+        average_time_in_states = {
+            state: format_minutes_to_timedelta(values['mean'])
+            for state, values in load_time_statistics(db_path)['states'].items()
+        }
 
         # Read the state mapping
         state_mapping = read_mapping_from_file()
@@ -217,6 +287,7 @@ def get_average_state_times(db_path="../data/incidents.db"):
         return {}
 
 @eel.expose
+@cached_endpoint
 def get_average_transition_times(db_path="../data/incidents.db"):
     """
     Calculates and returns the average time taken to transition between each pair of process states across all incidents closed within the currently selected date range.
@@ -244,66 +315,20 @@ def get_average_transition_times(db_path="../data/incidents.db"):
         - The JSON string can be directly consumed by JavaScript via Eel for frontend analytics and reporting.
     """
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch incident IDs selection
-        incident_ids = tuple(get_incident_ids_selection())
-
-        query = """
-            SELECT transition_interval_minutes 
-            FROM incidents_fa_values_table 
-            WHERE incident_id IN ({placeholders})
-        """
-
-        # Add the 'whatif_analysis' exclusion clause if it exists
-        whatif_clause = apply_whatif_analysis_filter()
-        if whatif_clause:
-            query += f" AND ( {whatif_clause} )"
-
-        # Now finalize the query by replacing the placeholders for incident IDs
-        placeholders = ','.join(['?'] * len(incident_ids))
-        query = query.format(placeholders=placeholders)
-
-        # Execute the query with the incident_ids as parameters
-        cursor.execute(query, incident_ids)
-
-        transition_times_list = cursor.fetchall()
-
-        total_transition_times = {}
-        count_transition_times = {}
-
-        for transition_times_json in transition_times_list:
-            transition_times = json.loads(transition_times_json[0])  # Convert JSON string back to dictionary
-
-            for transition, minutes in transition_times.items():
-                if transition not in total_transition_times:
-                    total_transition_times[transition] = 0
-                    count_transition_times[transition] = 0
-
-                total_transition_times[transition] += minutes
-                count_transition_times[transition] += 1
-
-        # Calculate average transition time between states
-        average_transition_times = {}
-        for transition in total_transition_times:
-            if count_transition_times[transition] > 0:
-                avg_minutes = total_transition_times[transition] / count_transition_times[transition]
-                average_transition_times[transition] = format_minutes_to_timedelta(avg_minutes)
-
-        cursor.close()
-        conn.close()
+        # Format the average time of each transition between states, aggregated in SQL together with the states
+        average_transition_times = {
+            transition: format_minutes_to_timedelta(values['mean'])
+            for transition, values in load_time_statistics(db_path)['transitions'].items()
+        }
 
         # Read the state mapping
         state_mapping = read_mapping_from_file()
 
         # Order the transition results based on the state mapping
-        ordered_average_transition_times = {}
-        for state_key, state in state_mapping.items():
-            for next_state_key, next_state in state_mapping.items():
-                transition_key = f"{state}->{next_state}"
-                if transition_key in average_transition_times:
-                    ordered_average_transition_times[transition_key] = average_transition_times[transition_key]
+        ordered_average_transition_times = {
+            transition: average_transition_times[transition]
+            for transition in order_transitions(average_transition_times, state_mapping)
+        }
 
         return json.dumps(ordered_average_transition_times)
 
@@ -312,68 +337,16 @@ def get_average_transition_times(db_path="../data/incidents.db"):
         print(f"An error occurred while fetching average transition times: {e}")
         return {}
 
-def calculate_time_to_last_occurrence(db_path="../data/incidents.db"):
+def calculate_time_to_last_occurrence(db_path="../data/incidents.db", incident_ids=None):
     """
     Calculate the time to the last occurrence of each state for every incident.
     Store the result in the `time_to_states_last_occurrence` column in `incidents_fa_values_table`.
-    """
-    try:
-        # Connect to the database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Fetch all incident IDs and opened_at from incidents_fa_values_table
-        cursor.execute("SELECT incident_id, opened_at FROM incidents_fa_values_table")
-        incidents = cursor.fetchall()
-
-        total_incidents = len(incidents)
-        processed_incidents = 0
-
-        for incident_id, opened_at in incidents:
-            processed_incidents += 1
-            print("time_between_states_and_transitions.py")
-            print(f"Processing incident {processed_incidents}/{total_incidents} (ID: {incident_id})")
-
-            # Get the state intervals for the current incident
-            state_intervals = get_event_state_intervals(incident_id, db_path)
-
-            if not state_intervals:
-                print("time_between_states_and_transitions.py")
-                print(f"Skipping incident {incident_id} due to missing state intervals.")
-                continue
+    If incident_ids is given, only these incidents are recalculated.
 
-            # Convert the opened_at string to a datetime object
-            opened_at_datetime = datetime.strptime(opened_at, "%Y-%m-%d %H:%M:%S")
-
-            # Calculate the time to the last occurrence of each state
-            time_to_states_last_occurrence = {}
-            for state, interval in state_intervals.items():
-                last_occurrence = datetime.strptime(interval[1], "%Y-%m-%d %H:%M:%S")
-                time_to_last_occurrence = last_occurrence - opened_at_datetime
-                minutes = int(time_to_last_occurrence.total_seconds() // 60)
-                time_to_states_last_occurrence[f"TT{state}"] = minutes
-
-            # Convert the dictionary to a JSON string
-            time_to_states_last_occurrence_json = json.dumps(time_to_states_last_occurrence)
-
-            # Update the incidents_fa_values_table with the calculated times
-            cursor.execute("""
-                UPDATE incidents_fa_values_table
-                SET time_to_states_last_occurrence = ?
-                WHERE incident_id = ?
-            """, (time_to_states_last_occurrence_json, incident_id))
-
-            # Commit after each incident to ensure data is saved progressively
-            conn.commit()
-
-        cursor.close()
-        conn.close()
-        print("time_between_states_and_transitions.py")
-        print("Time to last occurrence of each state successfully calculated and stored.")
-
-    except Exception as e:
-        print("time_between_states_and_transitions.py")
-        print(f"An error occurred: {e}")
+    The calculation runs in the single-pass derive_incident_features engine, which stores the
+    other derived columns of the incidents in the same scan.
+    """
+    return derive_incident_features(db_path, incident_ids)
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,305 @@
+import time
+import eel
+import numpy as np
+import xml.etree.ElementTree as ET
+
+from define_mapping import read_mapping_from_file
+from incident_metrics import refresh_incident_metrics, DEVIATION_KINDS
+from model_registry import get_compiled_model, local_name, element_text
+from quantile_sketches import refresh_quantile_sketches
+from database_connections import write_transaction
+from prepare_incidents_table import create_token_columns
+
+class ReferenceModel:
+    """
+    Petri net of the reference model as pre- and post-incidence matrices (transitions x places).
+
+    Each transition is labelled with the state code of the event it replays. If final_choice is set, the
+    final marking is one token in any of the final places (a state machine), otherwise one token in each.
+    """
+
+    def __init__(self, places, place_states, labels, pre, post, initial, final_places, final_choice):
+        self.places = places
+        self.place_states = place_states
+        self.labels = labels
+        self.pre = np.asarray(pre, dtype=np.int64).reshape(len(labels), len(places))
+        self.post = np.asarray(post, dtype=np.int64).reshape(len(labels), len(places))
+        self.initial = np.asarray(initial, dtype=np.int64)
+        self.final_places = final_places
+        self.final_choice = final_choice
+        self.transitions_by_label = {}
+        for transition, label in enumerate(labels):
+            if label is not None:
+                self.transitions_by_label.setdefault(label, []).append(transition)
+
+    @property
+    def states(self):
+        """State codes of the model in the order of their places."""
+        return list(dict.fromkeys(state for state in self.place_states if state is not None))
+
+    def __repr__(self):
+        return f"ReferenceModel({len(self.places)} places, {len(self.labels)} transitions)"
+
+def compile_reference_model(pnml_path="../data/reference_model.pnml", mapping=None):
+    """
+    Compiles a PNML reference model into a ReferenceModel.
+
+    Place and transition names are translated to state codes with the place mapping, names which are
+    already state codes are kept. A net with transitions is compiled as it is, transitions without a name
+    are silent and never fired. A net of places connected by arcs, as produced by the reference model
+    editor, is read as a state machine: entering a place replays its state, so each arc X -> Y becomes a
+    transition labelled Y moving the token from X to Y, and each place without incoming arcs is entered
+    from an additional start place. Places without a state code are passed through.
+
+    Args:
+        pnml_path (str): Path to the PNML file.
+        mapping (dict, optional): Place names to state codes, read_mapping_from_file() by default.
+
+    Returns:
+        ReferenceModel: The compiled model.
+    """
+    if mapping is None:
+        mapping = read_mapping_from_file()
+    codes = set(mapping.values())
+
+    def state_of(name):
+        if name in mapping:
+            return mapping[name]
+        return name if name in codes else None
+
+    root = ET.parse(pnml_path).getroot()
+    places = [element for element in root.iter() if local_name(element) == 'place']
+    transitions = [element for element in root.iter() if local_name(element) == 'transition']
+    arcs = {(arc.get('source'), arc.get('target')) for arc in root.iter() if local_name(arc) == 'arc'}
+
+    place_ids = [place.get('id') for place in places]
+    place_states = [state_of(element_text(place)) for place in places]
+
+    if transitions:
+        transition_ids = [transition.get('id') for transition in transitions]
+        labels = [state_of(element_text(transition)) for transition in transitions]
+        pre = np.zeros((len(transitions), len(places)), dtype=np.int64)
+        post = np.zeros((len(transitions), len(places)), dtype=np.int64)
+        for source, target in arcs:
+            if source in place_ids and target in transition_ids:
+                pre[transition_ids.index(target), place_ids.index(source)] += 1
+            elif source in transition_ids and target in place_ids:
+                post[transition_ids.index(source), place_ids.index(target)] += 1
+        initial = (post.sum(axis=0) == 0).astype(np.int64)
+        final_places = [index for index in range(len(places)) if pre[:, index].sum() == 0]
+        return ReferenceModel(place_ids, place_states, labels, pre, post, initial, final_places, False)
+
+    # State machine: the start place is the last place. Places without a state are passed through, so an
+    # arc into such a place continues to every mapped place reachable through unmapped places only.
+    successors = {index: set() for index in range(len(place_ids))}
+    for source, target in arcs:
+        if source in place_ids and target in place_ids:
+            successors[place_ids.index(source)].add(place_ids.index(target))
+
+    def mapped_successors(index):
+        found, pending, seen = set(), list(successors[index]), set()
+        while pending:
+            place = pending.pop()
+            if place in seen:
+                continue
+            seen.add(place)
+            if place_states[place] is None:
+                pending.extend(successors[place])
+            else:
+                found.add(place)
+        return found
+
+    place_arcs = sorted(
+        (source, target) for source in range(len(place_ids)) if place_states[source] is not None
+        for target in mapped_successors(source)
+    )
+    start = len(place_ids)
+    targets = {target for _, target in place_arcs}
+    mapped = [index for index in range(len(place_ids)) if place_states[index] is not None]
+    sources = [index for index in mapped if index not in targets] or mapped[:1]
+    steps = [(start, target) for target in sources] + place_arcs
+
+    pre = np.zeros((len(steps), start + 1), dtype=np.int64)
+    post = np.zeros((len(steps), start + 1), dtype=np.int64)
+    for transition, (source, target) in enumerate(steps):
+        pre[transition, source] = 1
+        post[transition, target] = 1
+    initial = np.zeros(start + 1, dtype=np.int64)
+    initial[start] = 1
+    final_places = [index for index in mapped if all(source != index for source, _ in place_arcs)]
+    return ReferenceModel(
+        place_ids + ['start'], place_states + [None], [place_states[target] for _, target in steps],
+        pre, post, initial, final_places, True
+    )
+
+def replay_variant(model, events):
+    """
+    Replays one trace variant on the reference model with token-based replay.
+
+    An event fires an enabled transition of its label, or else the one with the fewest missing tokens,
+    which are created in its input places. An event repeating the previous one without an enabled
+    transition is a repetition, counted as one missing and one remaining token. Events without a
+    transition in the model are skipped. At the end the final marking is consumed.
+
+    Deviations per state: missing tokens count as missing in the state of their place, repetitions as
+    repetition of the event state, and tokens left behind (or skipped events) as mismatch.
+
+    Args:
+        model (ReferenceModel): The compiled reference model.
+        events (list): State codes of the events in order.
+
+    Returns:
+        dict: fitness, the produced, consumed, missing and remaining token counts, and 'missing',
+              'repetition' and 'mismatch' deviation counts per state.
+    """
+    states = model.states
+    deviations = {kind: dict.fromkeys(states, 0) for kind in DEVIATION_KINDS}
+    marking = model.initial.copy()
+    produced, consumed, missing, remaining = int(marking.sum()), 0, 0, 0
+    previous = None
+
+    for event in events:
+        candidates = model.transitions_by_label.get(event)
+        if not candidates:
+            if event in deviations['mismatch']:
+                deviations['mismatch'][event] += 1
+            previous = event
+            continue
+
+        shortages = [np.maximum(model.pre[transition] - marking, 0) for transition in candidates]
+        best = int(np.argmin([shortage.sum() for shortage in shortages]))
+        transition, shortage = candidates[best], shortages[best]
+
+        if shortage.any() and event == previous:
+            # Repeated event: an unmodelled self-loop needing and leaving one token
+            deviations['repetition'][event] += 1
+            consumed, produced, missing, remaining = consumed + 1, produced + 1, missing + 1, remaining + 1
+            continue
+
+        for place in np.flatnonzero(shortage):
+            state = model.place_states[place]
+            if state is not None:
+                deviations['missing'][state] += int(shortage[place])
+        missing += int(shortage.sum())
+        marking += shortage
+
+        marking -= model.pre[transition]
+        marking += model.post[transition]
+        consumed += int(model.pre[transition].sum())
+        produced += int(model.post[transition].sum())
+        previous = event
+
+    # Consume the final marking
+    final_places = model.final_places
+    if model.final_choice:
+        marked = [place for place in final_places if marking[place] > 0]
+        final_places = marked[:1] or final_places[:1]
+    for place in final_places:
+        consumed += 1
+        if marking[place] > 0:
+            marking[place] -= 1
+        else:
+            missing += 1
+
+    for place in np.flatnonzero(marking):
+        state = model.place_states[place]
+        if state is not None:
+            deviations['mismatch'][state] += int(marking[place])
+        remaining += int(marking[place])
+
+    fitness = 0.5 * (1 - missing / consumed if consumed else 1) + 0.5 * (1 - remaining / produced if produced else 1)
+    return {
+        'fitness': round(fitness, 3),
+        'produced': produced,
+        'consumed': consumed,
+        'missing_tokens': missing,
+        'remaining_tokens': remaining,
+        **deviations,
+    }
+
+# Number of variants replayed and written per transaction without a process pool
+REPLAY_BATCH_SIZE = 500
+
+@eel.expose
+def replay_reference_model(db_path="../data/incidents.db", pnml_path="../data/reference_model.pnml", parallel=False, max_workers=None):
+    """
+    Recomputes fitness, the produced, consumed, missing and remaining token counts and the missing, repetition
+    and mismatch deviation columns of incidents_fa_values_table by replaying the event log on the reference model. Each unique variant is replayed once and its result
+    is written to all incidents with that variant in one UPDATE per batch of variants, each batch committed
+    in its own transaction, so results are visible while the replay runs. The typed incident_metrics and the
+    quantile sketches are refreshed at the end.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        pnml_path (str): Path to the PNML reference model.
+        parallel (bool): Replay the variants in a process pool (parallel_conformance).
+        max_workers (int, optional): Number of worker processes, the number of CPUs by default.
+
+    Returns:
+        dict: The number of replayed variants and updated incidents, or {'error': <error_message>}.
+    """
+    started = time.perf_counter()
+    try:
+        model = get_compiled_model(pnml_path).reference_model
+        with write_transaction(db_path) as conn:
+            create_token_columns(conn)
+            variants = [row[0] for row in conn.execute(
+                "SELECT DISTINCT variant FROM incidents_fa_values_table WHERE variant IS NOT NULL"
+            )]
+        updated_count = 0
+
+        def write_results(results):
+            nonlocal updated_count
+            with write_transaction(db_path) as conn:
+                conn.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS replayed_variants (
+                        variant TEXT PRIMARY KEY, fitness REAL, produced INTEGER, consumed INTEGER, missing_tokens INTEGER,
+                        remaining_tokens INTEGER, missing TEXT, repetition TEXT, mismatch TEXT
+                    )
+                """)
+                conn.execute("DELETE FROM temp.replayed_variants")
+                conn.executemany("INSERT INTO temp.replayed_variants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                    (variant, result['fitness'], result['produced'], result['consumed'], result['missing_tokens'],
+                     result['remaining_tokens'], str(result['missing']), str(result['repetition']), str(result['mismatch']))
+                    for variant, result in results
+                ))
+                cursor = conn.execute("""
+                    UPDATE incidents_fa_values_table
+                    SET fitness = r.fitness,
+                        produced_tokens = r.produced,
+                        consumed_tokens = r.consumed,
+                        missing_tokens = r.missing_tokens,
+                        remaining_tokens = r.remaining_tokens,
+                        missing_deviation = r.missing,
+                        repetition_deviation = r.repetition,
+                        mismatch_deviation = r.mismatch
+                    FROM temp.replayed_variants AS r
+                    WHERE incidents_fa_values_table.variant = r.variant
+                """)
+                updated_count += cursor.rowcount
+
+        if parallel:
+            # Imported here as parallel_conformance builds on this module
+            from parallel_conformance import run_conformance
+            run_conformance('replay', model, None, variants, write_results, max_workers)
+        else:
+            for offset in range(0, len(variants), REPLAY_BATCH_SIZE):
+                batch = variants[offset:offset + REPLAY_BATCH_SIZE]
+                write_results([(variant, replay_variant(model, variant.split())) for variant in batch])
+
+        with write_transaction(db_path) as conn:
+            refresh_incident_metrics(conn, DEVIATION_KINDS)
+            refresh_quantile_sketches(conn)
+
+        print("token_replay.py")
+        print(f"Replayed {len(variants)} variants for {updated_count} incidents in {time.perf_counter() - started:.2f}s.")
+        return {"replayed_variants": len(variants), "updated_incidents": updated_count}
+
+    except Exception as e:
+        print("token_replay.py")
+        print(f"An error occurred: {e}")
+        return {'error': str(e)}
+
+# Run the replay
+if __name__ == "__main__":
+    print(replay_reference_model())
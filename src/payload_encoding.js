@@ -0,0 +1,46 @@
+import { eel } from './App.js';
+
+// Decodes a column of backend/payload_encoding.py: plain values, or a dictionary of strings and their codes
+function decodeColumn(column) {
+    if (column.dictionary) {
+        return column.codes.map(code => column.dictionary[code]);
+    }
+    return column.values;
+}
+
+// Inflates a base64 encoded zlib stream with the browser's DecompressionStream
+async function inflate(base64) {
+    const bytes = Uint8Array.from(atob(base64), character => character.charCodeAt(0));
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Response(stream).text();
+}
+
+// Rebuilds the rows of an encoded payload: objects if the rows had field names, arrays otherwise
+export async function decodePayload(payload) {
+    if (!payload || payload.error) {
+        return payload;
+    }
+    if (payload.encoding === 'json') {
+        return payload.data;
+    }
+    const columnar = payload.encoding === 'columnar+zlib' ? JSON.parse(await inflate(payload.data)) : payload;
+
+    const columns = columnar.columns.map(decodeColumn);
+    const rows = new Array(columnar.length);
+    for (let i = 0; i < columnar.length; i++) {
+        if (columnar.names) {
+            const row = {};
+            columnar.names.forEach((name, j) => { row[name] = columns[j][i]; });
+            rows[i] = row;
+        } else {
+            rows[i] = columns.map(column => column[i]);
+        }
+    }
+    return rows;
+}
+
+// Calls an endpoint through get_encoded_payload and returns its decoded rows,
+// e.g. await fetchEncoded('get_tabular_incidents_entries')
+export async function fetchEncoded(endpoint, args = [], encoding = 'columnar+zlib') {
+    return decodePayload(await eel.get_encoded_payload(endpoint, encoding, args)());
+}